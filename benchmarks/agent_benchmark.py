@@ -0,0 +1,161 @@
+"""
+Offline benchmark of the agent loop of both calculator agents.
+
+The LLM is replaced by the scripted client, which answers instantly (or after --latency seconds) with correct
+tool calls, so the timings measure the overhead of the agents themselves: prompt building, tool call parsing,
+calculation and expression reduction. Responses of a live model can be recorded once with --record and
+benchmarked offline with --replay (the corpus, i.e. --seed, --sizes and --count, and the config must not change).
+
+Corpora of increasing length are generated in two shapes:
+    chain: left-deep expressions, where every operation depends on the previous one (depth = length)
+    balanced: balanced trees, with many independent operations per round (depth ~ log2(length))
+
+Run from the repository root:
+    python -m benchmarks.agent_benchmark --sizes 2 4 8 16 --count 50
+"""
+import argparse
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from src.agents.metrics import AgentMetrics
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+from src.config import load_config_file
+from src.llm.llm_base import LLMClientBase
+from src.llm.replay import RecordReplayClient
+from src.llm.scripted import ScriptedCalculatorClient
+from src.tools.expression_parser import BinaryOpNode, Node, NumberNode, evaluate
+from src.tools.expression_plan import ExpressionPlan
+
+AGENTS = {
+    'stepwise': (StepwiseCalculatorAgent, 'config/stepwise_agent_config.yaml'),
+    'reducing': (ReducingCalculatorAgent, 'config/reducing_agent_config.yaml'),
+}
+
+SHAPES = ('chain', 'balanced')
+
+PHASES = ('llm_call', 'prompt_build', 'calculate', 'reduce')
+
+
+def generate_tree(rng: random.Random, num_ops: int, shape: str) -> Node:
+    if num_ops == 0:
+        if rng.random() < 0.3:
+            return NumberNode(round(rng.uniform(0.1, 100), 2))
+        return NumberNode(rng.randint(1, 99))
+
+    left_ops = num_ops - 1 if shape == 'chain' else (num_ops - 1) // 2
+    left = generate_tree(rng, left_ops, shape)
+    right = generate_tree(rng, num_ops - 1 - left_ops, shape)
+    return BinaryOpNode(rng.choice('+-*/'), left, right)
+
+
+def generate_expression(rng: random.Random, num_ops: int, shape: str) -> str:
+    """
+    Random expression with num_ops operations. Expressions dividing by zero are regenerated.
+    """
+    while True:
+        root = generate_tree(rng, num_ops, shape)
+        try:
+            evaluate(root)
+        except ZeroDivisionError:
+            continue
+        return ExpressionPlan(root).render()
+
+
+def generate_corpus(num_ops: int, shape: str, count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(f'{seed}-{num_ops}-{shape}')
+    return [generate_expression(rng, num_ops, shape) for _ in range(count)]
+
+
+def load_config(agent_name: str, num_ops: int, parallel_steps: bool) -> Dict[str, Any]:
+    config = load_config_file(AGENTS[agent_name][1])
+
+    config['verbose'] = False
+    config['parallel_steps'] = parallel_steps
+    config['max_llm_calls'] = 2 * num_ops + 2
+    config['max_expression_length'] = 100_000
+    return config
+
+
+def create_client(args: argparse.Namespace, agent_name: str, config: Dict[str, Any],
+                  metrics: AgentMetrics) -> LLMClientBase:
+    if args.replay:
+        return RecordReplayClient(f'{args.replay}.{agent_name}.json', mode='replay')
+    if args.record:
+        from src.llm.routing import create_llm_client
+        return RecordReplayClient(f'{args.record}.{agent_name}.json', mode='auto',
+                                  client=create_llm_client(config, metrics))
+    return ScriptedCalculatorClient(parallel_steps=config['parallel_steps'], latency=args.latency,
+                                    error_rate=args.error_rate, seed=args.seed)
+
+
+def benchmark_corpus(args: argparse.Namespace, agent_name: str, corpus: List[str], num_ops: int) -> Dict[str, Any]:
+    config = load_config(agent_name, num_ops, args.parallel_steps)
+    metrics = AgentMetrics()
+    agent = AGENTS[agent_name][0](create_client(args, agent_name, config, metrics), config, metrics=metrics)
+
+    failures = 0
+    start = time.perf_counter()
+    for expression in corpus:
+        try:
+            result: Optional[float] = agent.run(expression)
+        except Exception:
+            result = None
+        if result is None:
+            failures += 1
+    elapsed = time.perf_counter() - start
+
+    snapshot = metrics.snapshot()
+    return {
+        'expr_per_s': len(corpus) / elapsed,
+        'llm_calls_per_expr': snapshot['counters'].get('llm_calls', 0) / len(corpus),
+        'prompt_tokens': snapshot['counters'].get('prompt_tokens', 0),
+        'cached_prompt_tokens': snapshot['counters'].get('cached_prompt_tokens', 0),
+        'failures': failures,
+        'phases': snapshot['histograms'],
+    }
+
+
+def format_phases(phases: Dict[str, Dict[str, Any]]) -> str:
+    parts = []
+    for phase in PHASES:
+        if phase in phases:
+            parts.append(f"{phase} {phases[phase]['mean'] * 1e6:,.1f}us")
+    return ', '.join(parts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agents', nargs='+', choices=list(AGENTS), default=list(AGENTS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[2, 4, 8, 16], help='Operations per expression')
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=list(SHAPES))
+    parser.add_argument('--count', type=int, default=50, help='Expressions per corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--parallel-steps', action='store_true', help='Request all independent operations per call')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated LLM response time in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of scripted calls with a wrong step')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', metavar='PREFIX', help='Record the responses of the live model to PREFIX.<agent>.json')
+    group.add_argument('--replay', metavar='PREFIX', help='Replay responses recorded with --record')
+    args = parser.parse_args()
+
+    print(f"{'agent':<9} {'shape':<9} {'ops':>4} {'depth':>5} {'expr/s':>10} {'calls/expr':>10} {'failed':>6}  "
+          f"mean latency per phase")
+
+    for agent_name in args.agents:
+        for shape in args.shapes:
+            for num_ops in args.sizes:
+                corpus = generate_corpus(num_ops, shape, args.count, args.seed)
+                depth = max(ExpressionPlan.from_expression(expression).depth for expression in corpus)
+                report = benchmark_corpus(args, agent_name, corpus, num_ops)
+
+                line = (f"{agent_name:<9} {shape:<9} {num_ops:>4} {depth:>5} {report['expr_per_s']:>10,.1f} "
+                        f"{report['llm_calls_per_expr']:>10.2f} {report['failures']:>6}  {format_phases(report['phases'])}")
+                if report['prompt_tokens']:   # Live model (--record): share of the prompt tokens served from cache
+                    line += f", cached prompt tokens {report['cached_prompt_tokens'] / report['prompt_tokens']:.0%}"
+                print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare the scalar calculate() tool with the vectorized calculate_batch().
+
+Run from the repository root:
+    python -m benchmarks.calculator_batch_benchmark --size 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.tools.calculator import calculate
+from src.tools.calculator_batch import OPS, calculate_batch, execute_plans_batch
+from src.tools.expression_plan import ExpressionPlan
+
+
+def make_operands(size: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    a = rng.uniform(-1000, 1000, size)
+    b = rng.uniform(-1000, 1000, size)
+    ops = rng.integers(0, len(OPS), size).astype(np.uint8)
+    return a, b, ops
+
+
+def benchmark_scalar(a: np.ndarray, b: np.ndarray, ops: np.ndarray) -> float:
+    a_list, b_list = a.tolist(), b.tolist()
+    op_list = [OPS[code] for code in ops.tolist()]
+
+    start = time.perf_counter()
+    for x, y, op in zip(a_list, b_list, op_list):
+        calculate(x, y, op)
+    return time.perf_counter() - start
+
+
+def benchmark_batch(a: np.ndarray, b: np.ndarray, ops: np.ndarray) -> float:
+    start = time.perf_counter()
+    calculate_batch(a, b, ops)
+    return time.perf_counter() - start
+
+
+def benchmark_plans(num_expressions: int) -> float:
+    expression = '10.3 + 5.44 * 3.1 - 8.776 / 2.2 * 3.44 + 1.23'
+    plans = [ExpressionPlan.from_expression(expression) for _ in range(num_expressions)]
+
+    start = time.perf_counter()
+    execute_plans_batch(plans)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1_000_000, help='Number of operations')
+    parser.add_argument('--expressions', type=int, default=10_000, help='Number of expressions for the plan benchmark')
+    args = parser.parse_args()
+
+    a, b, ops = make_operands(args.size)
+
+    scalar_time = benchmark_scalar(a, b, ops)
+    batch_time = benchmark_batch(a, b, ops)
+
+    print(f"Operations:        {args.size}")
+    print(f"calculate():       {scalar_time:.4f}s  ({args.size / scalar_time:,.0f} ops/s)")
+    print(f"calculate_batch(): {batch_time:.4f}s  ({args.size / batch_time:,.0f} ops/s)")
+    print(f"Speedup:           {scalar_time / batch_time:.1f}x")
+
+    plans_time = benchmark_plans(args.expressions)
+    print(f"execute_plans_batch(): {args.expressions} expressions in {plans_time:.4f}s "
+          f"({args.expressions / plans_time:,.0f} expr/s)")
+
+
+if __name__ == '__main__':
+    main()
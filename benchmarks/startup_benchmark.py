@@ -0,0 +1,69 @@
+"""
+Cold start cost of short-lived invocations: module import times and config loading.
+
+Every measurement runs in a fresh interpreter, as a CLI or serverless invocation would; the median of --repeat
+runs is reported. Config loading is measured three ways: parsing the YAML directly, through load_config_file()
+with the compiled config, and through load_config_file() with the compiled config removed first.
+
+Run from the repository root:
+    python -m benchmarks.startup_benchmark --repeat 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import List
+
+MODULES = [
+    'src.agents.reducing_agent',
+    'src.agents.stepwise_agent',
+    'src.llm.chatgpt',
+    'src.cli',
+    'yaml',
+    'openai',
+]
+
+CONFIG_FILE = 'config/reducing_agent_config.yaml'
+
+TIMED = 'import time; start = time.perf_counter(); {code}; print(time.perf_counter() - start)'
+
+
+def time_in_fresh_process(code: str, setup: str = '') -> float:
+    """Seconds taken by code in a new interpreter, after running setup."""
+    script = f'{setup}\n{TIMED.format(code=code)}'
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def median_ms(code: str, repeat: int, setup: str = '') -> float:
+    return 1000 * statistics.median(time_in_fresh_process(code, setup) for _ in range(repeat))
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per measurement')
+    args = parser.parse_args(argv)
+
+    print('Import times (ms):')
+    for module in MODULES:
+        print(f'  {module:<28} {median_ms(f"import {module}", args.repeat):8.1f}')
+
+    from src.config import compiled_path, load_config_file
+    load_config_file(CONFIG_FILE)   # Make sure the compiled config exists
+
+    yaml_ms = median_ms(f'import yaml; yaml.safe_load(open({CONFIG_FILE!r}))', args.repeat)
+    compiled_ms = median_ms(f'from src.config import load_config_file; load_config_file({CONFIG_FILE!r})',
+                            args.repeat)
+    remove = f'import os; os.remove({compiled_path(CONFIG_FILE)!r})'
+    recompile_ms = median_ms(f'from src.config import load_config_file; load_config_file({CONFIG_FILE!r})',
+                             args.repeat, setup=remove)
+
+    print(f'Config loading (ms), {os.path.basename(CONFIG_FILE)}:')
+    print(f'  yaml.safe_load              {yaml_ms:8.1f}')
+    print(f'  load_config_file, compiled  {compiled_ms:8.1f}')
+    print(f'  load_config_file, compiling {recompile_ms:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
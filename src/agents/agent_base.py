@@ -0,0 +1,459 @@
+import asyncio
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Generator, List, Any, Optional, Tuple, Union
+
+from src.agents.concurrency import gather_with_limit
+from src.agents.utility import validate_expression
+from src.agents.batch import BatchItemResult, BatchReport, DedupStats, run_batch
+from src.agents.metrics import AgentMetrics
+from src.agents.run_state import AgentRunState
+from src.agents.result_cache import ResultCacheBase, create_result_cache, config_fingerprint, normalize_expression
+
+from src.tools.expression_parser import (BinaryOpNode, ExpressionSyntaxError, Node, NumberNode, evaluate_expression,
+                                         parse_expression)
+from src.tools.expression_plan import ExpressionPlan, PlanOperation, Number
+from src.tools.numeric import NumericBackend
+from src.tools.subexpressions import SharedSubexpressions, count_operations, render_node, tree_depth
+from src.llm.llm_base import LLMClientBase, AsyncLLMClientBase
+from src.llm.messages import MessageHistory
+
+EVALUATION_MODES = ('llm', 'local', 'cross_check')
+
+# A prompt for the LLM, and an optional side task to run while the LLM answers (e.g. speculation)
+LLMRequest = Tuple[MessageHistory, Optional[Callable[[], Any]]]
+
+
+class CalculatorAgentBase(ABC):
+    """
+    Functionality shared by the calculator agents: config handling, batch/concurrent entry points
+    and the local evaluation modes.
+    Evaluation modes:
+        'llm': every expression is evaluated by the LLM loop
+        'local': expressions are parsed and evaluated locally; the LLM is only used if parsing fails
+        'cross_check': the LLM loop is run and its answer is checked against the local evaluation
+    """
+    def __init__(self, llm_client: Union[LLMClientBase, AsyncLLMClientBase], config: dict,
+                 result_cache: Optional[ResultCacheBase] = None, metrics: Optional[AgentMetrics] = None) -> None:
+        self.llm_client = llm_client
+
+        # Timings and counters of the agent loop; pass the same instance to the LLM client to include token usage
+        self.metrics = metrics if metrics is not None else AgentMetrics()
+        self.verbose: bool = config.get('verbose', True)   # Print each step (stdout I/O is slow under load)
+
+        # An explicitly given cache (e.g. one shared by several agents) takes precedence over the config
+        self.result_cache = result_cache if result_cache is not None else create_result_cache(config)
+        self.cache_fingerprint: str = config_fingerprint(config)
+
+        self.max_expression_length: int = config['max_expression_length']
+        self.max_llm_calls: int = config['max_llm_calls']
+
+        self.max_concurrency: int = config.get('max_concurrency', 100)
+        self.max_workers: int = config.get('max_workers', 8)
+
+        # run_many(): evaluate the sub-expressions shared across the batch once, then substitute their results
+        self.batch_dedup: bool = config.get('batch_dedup', False)
+
+        # Ask the LLM for all currently independent operations per call, instead of a single one
+        self.parallel_steps: bool = config.get('parallel_steps', False)
+
+        # Check each step proposed by the LLM against an operation plan of the expression
+        self.plan_steps: bool = config.get('plan_steps', False)
+        self.plan_rel_tol: float = config.get('plan_rel_tol', 1e-5)
+
+        # Number type of the calculations (float, decimal or fraction), see NumericBackend
+        self.numeric = NumericBackend.from_config(config)
+
+        self.evaluation_mode: str = config.get('evaluation_mode', 'llm')
+        self.cross_check_rel_tol: float = config.get('cross_check_rel_tol', 1e-6)
+
+        if self.evaluation_mode not in EVALUATION_MODES:
+            raise ValueError(f'Unsupported evaluation_mode: {self.evaluation_mode}. '
+                             f'Supported modes are {", ".join(EVALUATION_MODES)}.')
+
+        # Threads running the side tasks of run() while the blocking LLM call is in flight, created when first needed
+        self._side_executor: Optional[ThreadPoolExecutor] = None
+        self._side_executor_lock = threading.Lock()
+
+    def close(self) -> None:
+        """Release the threads of the agent and the resources of its LLM client."""
+        self._close_side_executor()
+        self.llm_client.close()
+
+    async def aclose(self) -> None:
+        """Coroutine version of close(), for agents with an AsyncLLMClientBase client (run with arun())."""
+        self._close_side_executor()
+        await self.llm_client.aclose()
+
+    def __enter__(self) -> 'CalculatorAgentBase':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def run(self, expression: str, state: Optional[AgentRunState] = None,
+            checkpoint_path: Optional[str] = None) -> Optional[float]:
+        """
+        Run the calculation process for the given expression.
+
+        :param expression: The mathematical expression to evaluate
+        :param state: Run state to resume (e.g. from a failed run); it is updated in place after every LLM call
+        :param checkpoint_path: File the state is saved to after every LLM call, and resumed from if it exists
+        :return: The final result of the calculation, or None if not successful
+        """
+        # Only the generator calls are guarded: a StopIteration raised by the client or a side task is an error
+        steps = self._run_steps(expression, state, checkpoint_path)
+        try:
+            prompt_msg, side_task = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        while True:
+            # The side task runs in a worker thread while this one waits on the LLM
+            side_future = self._side_task_executor().submit(side_task) if side_task is not None else None
+            with self.metrics.timer('llm_call'):
+                response = self.llm_client.run_prompt(prompt_msg)
+                side_result = side_future.result() if side_future is not None else None
+            self.metrics.increment('llm_calls')
+            try:
+                prompt_msg, side_task = steps.send((response, side_result))
+            except StopIteration as stop:
+                return stop.value
+
+    async def arun(self, expression: str, state: Optional[AgentRunState] = None,
+                   checkpoint_path: Optional[str] = None) -> Optional[float]:
+        """
+        Coroutine version of run(), for use with an AsyncLLMClientBase client.
+        While one expression waits on the LLM, the event loop is free to progress other expressions,
+        and the side task of a request runs while the request is in flight.
+        """
+        steps = self._run_steps(expression, state, checkpoint_path)
+        try:
+            prompt_msg, side_task = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        while True:
+            side_result = None
+            with self.metrics.timer('llm_call'):
+                request = asyncio.ensure_future(self.llm_client.run_prompt(prompt_msg))
+                if side_task is not None:
+                    await asyncio.sleep(0)   # Let the request get sent first
+                    side_result = side_task()
+                response = await request
+            self.metrics.increment('llm_calls')
+            try:
+                prompt_msg, side_task = steps.send((response, side_result))
+            except StopIteration as stop:
+                return stop.value
+
+    def _close_side_executor(self) -> None:
+        with self._side_executor_lock:
+            if self._side_executor is not None:
+                self._side_executor.shutdown(wait=False)
+                self._side_executor = None
+
+    def _side_task_executor(self) -> ThreadPoolExecutor:
+        with self._side_executor_lock:
+            if self._side_executor is None:
+                self._side_executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                         thread_name_prefix='agent-side-task')
+            return self._side_executor
+
+    def _run_steps(self, expression: str, state: Optional[AgentRunState],
+                   checkpoint_path: Optional[str]) -> Generator[LLMRequest, Tuple[Any, Any], Optional[float]]:
+        """
+        The calculation process shared by run() and arun(), which only differ in how the LLM is called.
+        It yields (prompt, side task) requests and is sent back (response, result of the side task).
+        """
+        if self.verbose:
+            print(f"Input expression: {expression}")
+
+        # Invalid expressions will raise an exception
+        validate_expression(expression, self.max_expression_length)
+
+        local_result = self._try_local_evaluation(expression)
+        if local_result is not None:
+            return local_result
+
+        cached_result = self._get_cached_result(expression)
+        if cached_result is not None:
+            return cached_result
+
+        state = self._load_state(expression, state, checkpoint_path)
+        if state.is_complete:
+            return state.final_result
+
+        plan = self._create_plan(expression, always=self._needs_plan())
+        if plan is not None:
+            plan.restore(state.resolved_operations)
+
+        final_result = yield from self._llm_steps(expression, state, plan, checkpoint_path)
+
+        self._cross_check(expression, final_result)
+        self._store_result(expression, final_result)
+
+        state.final_result = final_result
+        state.is_complete = True
+        self._checkpoint(state, plan, checkpoint_path)
+
+        return final_result
+
+    @abstractmethod
+    def _llm_steps(self, expression: str, state: AgentRunState, plan: Optional[ExpressionPlan],
+                   checkpoint_path: Optional[str]) -> Generator[LLMRequest, Tuple[Any, Any], Optional[float]]:
+        """
+        The LLM loop of the agent, see _run_steps(); it returns the final result.
+        """
+        pass
+
+    def _needs_plan(self) -> bool:
+        """Whether the run needs the operation plan even if plan_steps is off."""
+        return False
+
+    def _check_llm_calls(self, i: int) -> None:
+        if i >= self.max_llm_calls:
+            raise RuntimeError(f'Max LLM calls reached before final result. Max calls: {self.max_llm_calls}')
+
+    def run_many(self, expressions: List[str], max_workers: Optional[int] = None) -> BatchReport:
+        """
+        Evaluate several expressions over a thread pool. Errors are collected per expression instead of raised.
+
+        :param expressions: The mathematical expressions to evaluate
+        :param max_workers: Number of worker threads (defaults to max_workers from the config)
+        :return: A BatchReport with results in input order, per-item errors and latencies, and throughput
+        """
+        if self.evaluation_mode == 'local' and not self.numeric.is_exact:   # The vectorized calculator is float only
+            return self._run_many_local(expressions, max_workers or self.max_workers)
+
+        if self.batch_dedup:
+            return self._run_many_dedup(expressions, max_workers or self.max_workers)
+
+        return run_batch(self.run, expressions, max_workers or self.max_workers)
+
+    def _run_many_dedup(self, expressions: List[str], max_workers: int) -> BatchReport:
+        """
+        Evaluate a batch after deduplicating the sub-expressions it shares: each shared sub-expression is evaluated
+        once with run(), and its result is substituted into the expressions before they are run. Expressions made
+        of a single shared sub-expression (e.g. duplicates) are not run again. If a shared sub-expression fails,
+        the expressions containing it are run as given, and so are expressions that would exceed
+        max_expression_length after substitution. Per-item latency is that of the expression's own run.
+        """
+        start = time.perf_counter()
+
+        trees: List[Optional[Node]] = []
+        for expression in expressions:
+            try:
+                validate_expression(expression, self.max_expression_length)
+                trees.append(parse_expression(expression, self.numeric.parse))
+            except ValueError:   # Also ExpressionSyntaxError: run() reports the error or falls back to the LLM
+                trees.append(None)
+
+        shared = SharedSubexpressions(trees, self.numeric.format)
+        shared_report = run_batch(self.run, shared.texts(), max_workers)
+        shared_items = dict(zip(shared.subexpressions, shared_report.items))
+        # Results are substituted as text, so only those that parse back to the same number are used
+        values: Dict[str, Number] = {
+            key: item.result for key, item in shared_items.items()
+            if item.ok and item.result is not None
+            and self.numeric.parse(self.numeric.format(item.result)) == item.result}
+
+        cost = tree_depth if self.parallel_steps else count_operations
+        stats = DedupStats(len(shared.subexpressions), 0, 0, 0, 0, 0)
+        for node in shared.subexpressions.values():
+            stats.operations_after += count_operations(node)
+            stats.llm_calls_after += cost(node)
+
+        items: List[Optional[BatchItemResult]] = [None] * len(expressions)
+        pending: List[int] = []
+        texts = list(expressions)
+        for i, tree in enumerate(trees):
+            if tree is not None:
+                rewritten, substitutions = shared.rewrite(i, values)
+                # The whole expression was a shared sub-expression (a bare number is run as given)
+                if isinstance(rewritten, NumberNode) and isinstance(tree, BinaryOpNode):
+                    item = shared_items[shared.key(i, tree)]
+                    items[i] = BatchItemResult(expressions[i], item.result, None, item.latency)
+                elif rewritten is not tree:
+                    text = render_node(rewritten, self.numeric.format)
+                    if len(text) <= self.max_expression_length:
+                        texts[i] = text
+                    else:
+                        rewritten, substitutions = tree, 0
+
+                stats.num_substitutions += substitutions
+                stats.operations_before += count_operations(tree)
+                stats.operations_after += count_operations(rewritten)
+                stats.llm_calls_before += cost(tree)
+                stats.llm_calls_after += cost(rewritten)
+
+            if items[i] is None:
+                pending.append(i)
+
+        report = run_batch(self.run, [texts[i] for i in pending], max_workers)
+        for i, item in zip(pending, report.items):
+            items[i] = BatchItemResult(expressions[i], item.result, item.error, item.latency)
+
+        self.metrics.increment('dedup_substitutions', stats.num_substitutions)
+        self.metrics.increment('dedup_llm_calls_saved', stats.llm_calls_saved)
+        return BatchReport(items, time.perf_counter() - start, max_workers, stats)
+
+    def _run_many_local(self, expressions: List[str], max_workers: int) -> BatchReport:
+        """
+        Evaluate a batch in 'local' mode with the vectorized calculator: the ready operations of all expressions
+        are performed together, one NumPy call per plan level. Expressions that fail validation are reported as
+        errors; expressions that cannot be parsed go through run() (and so the LLM fallback) on the thread pool.
+        Results are looked up in and stored to the result cache. Per-item latency is the average over the
+        vectorized part of the batch.
+        """
+        from src.tools.calculator_batch import execute_plans_batch   # Optional dependency (numpy)
+
+        start = time.perf_counter()
+
+        errors: Dict[int, Exception] = {}
+        cached: Dict[int, Number] = {}
+        plans: Dict[int, ExpressionPlan] = {}
+        fallback: List[int] = []
+
+        for i, expression in enumerate(expressions):
+            try:
+                validate_expression(expression, self.max_expression_length)
+                cached_result = self._get_cached_result(expression)
+                if cached_result is not None:
+                    cached[i] = cached_result
+                    continue
+                plans[i] = ExpressionPlan.from_expression(expression)
+            except ExpressionSyntaxError:
+                fallback.append(i)
+            except ValueError as e:
+                errors[i] = e
+
+        outcomes = dict(zip(plans.keys(), execute_plans_batch(list(plans.values()))))
+        latency = (time.perf_counter() - start) / max(1, len(plans) + len(cached) + len(errors))
+
+        items: List[Optional[BatchItemResult]] = [None] * len(expressions)
+        for i, outcome in outcomes.items():
+            if isinstance(outcome, Exception):
+                items[i] = BatchItemResult(expressions[i], None, outcome, latency)
+            else:
+                items[i] = BatchItemResult(expressions[i], outcome, None, latency)
+                self._store_result(expressions[i], outcome)
+        for i, result in cached.items():
+            items[i] = BatchItemResult(expressions[i], result, None, latency)
+        for i, error in errors.items():
+            items[i] = BatchItemResult(expressions[i], None, error, latency)
+
+        if fallback:
+            fallback_report = run_batch(self.run, [expressions[i] for i in fallback], max_workers)
+            for i, item in zip(fallback, fallback_report.items):
+                items[i] = item
+
+        return BatchReport(items, time.perf_counter() - start, max_workers)
+
+    async def arun_many(self, expressions: List[str], return_exceptions: bool = False) -> List[Any]:
+        """
+        Evaluate several expressions concurrently, with at most max_concurrency runs in flight.
+
+        :param expressions: The mathematical expressions to evaluate
+        :param return_exceptions: If True, a failing expression yields its exception instead of aborting the others
+        :return: The final results, in the same order as the input expressions
+        """
+        return await gather_with_limit(self.arun, expressions, self.max_concurrency, return_exceptions)
+
+    def _try_local_evaluation(self, expression: str) -> Optional[float]:
+        """
+        In 'local' mode, evaluate the (already validated) expression without the LLM.
+
+        :return: The local result, or None if the LLM loop should be run instead
+        """
+        if self.evaluation_mode != 'local':
+            return None
+
+        try:
+            return evaluate_expression(expression, self.numeric.parse, self.numeric.calculate)
+        except ExpressionSyntaxError as e:
+            if self.verbose:
+                print(f"Local evaluation failed ({e}), falling back to the LLM")
+            return None
+
+    def _cross_check(self, expression: str, llm_result: Optional[float]) -> None:
+        """
+        In 'cross_check' mode, raise an error if the LLM result disagrees with the local evaluation.
+        Expressions that cannot be parsed locally are not checked.
+        """
+        if self.evaluation_mode != 'cross_check':
+            return
+
+        try:
+            local_result = evaluate_expression(expression, self.numeric.parse, self.numeric.calculate)
+        except ExpressionSyntaxError:
+            return
+
+        if llm_result is None or not math.isclose(llm_result, local_result, rel_tol=self.cross_check_rel_tol):
+            raise RuntimeError(f'LLM result {llm_result} does not match local evaluation {local_result} '
+                               f'for expression: {expression}')
+
+    def _cache_key(self, kind: str, expression: str) -> str:
+        return f'{kind}:{self.cache_fingerprint}:{normalize_expression(expression, self.numeric)}'
+
+    def _get_cached_result(self, expression: str) -> Optional[float]:
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get(self._cache_key('result', expression))
+
+    def _store_result(self, expression: str, result: Optional[float]) -> None:
+        if self.result_cache is None or result is None:
+            return
+        self.result_cache.set(self._cache_key('result', expression), result)
+
+    def _create_plan(self, expression: str, always: bool = False) -> Optional[ExpressionPlan]:
+        """
+        Create the operation plan used to check the LLM steps, or None if parsing fails.
+
+        :param always: Create the plan even if plan_steps is off (for agents that need it to reduce the expression)
+        """
+        if not (self.plan_steps or always):
+            return None
+
+        try:
+            return ExpressionPlan.from_expression(expression, self.plan_rel_tol, self.numeric)
+        except ExpressionSyntaxError as e:
+            if self.verbose:
+                print(f"Could not create a plan for the expression ({e}), LLM steps will not be checked")
+            return None
+
+    def _match_plan_step(self, plan: ExpressionPlan, a: Number, b: Number, op: str) -> Optional[PlanOperation]:
+        """
+        Find the plan operation for an LLM step, printing a message if the step is rejected.
+        """
+        operation = plan.match(a, b, op)
+        if operation is None and self.verbose:
+            print(f"Rejected step {a} {op} {b}: not a valid next step. "
+                  f"Valid steps: {', '.join(f'{o.operands[0]} {o.op} {o.operands[1]}' for o in plan.ready())}")
+        return operation
+
+    def _load_state(self, expression: str, state: Optional[AgentRunState],
+                    checkpoint_path: Optional[str]) -> AgentRunState:
+        """
+        The state to continue: the given one, else the checkpoint at checkpoint_path, else a new state.
+        """
+        if state is None and checkpoint_path is not None:
+            state = AgentRunState.load(checkpoint_path)
+
+        if state is None:
+            return AgentRunState(type(self).__name__, expression)
+
+        if state.agent != type(self).__name__ or state.expression != expression:
+            raise ValueError(f'Run state of {state.agent} for expression {state.expression} '
+                             f'cannot be resumed by {type(self).__name__} for expression {expression}')
+
+        if self.verbose and state.steps:
+            print(f"Resuming after {len(state.steps)} steps")
+        return state
+
+    def _checkpoint(self, state: AgentRunState, plan: Optional[ExpressionPlan], checkpoint_path: Optional[str]) -> None:
+        if plan is not None:
+            state.resolved_operations = plan.resolved_operations()
+        if checkpoint_path is not None:
+            state.save(checkpoint_path)
@@ -0,0 +1,120 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+
+@dataclass
+class BatchItemResult:
+    expression: str
+    result: Optional[float]
+    error: Optional[Exception]   # The exception raised for this expression, if any
+    latency: float   # Wall time for this expression, in seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class DedupStats:
+    """
+    Effect of evaluating the sub-expressions shared across a batch once (see CalculatorAgentBase.run_many).
+    Operations and LLM calls are counted on the parsed expressions; calls are estimated as one per operation,
+    or one per plan level with parallel_steps.
+    """
+    num_subexpressions: int   # Unique shared sub-expressions, each evaluated once
+    num_substitutions: int   # Occurrences replaced by the result of their sub-expression
+    operations_before: int   # Operations of the expressions as given
+    operations_after: int   # Operations of the rewritten expressions plus those of the shared sub-expressions
+    llm_calls_before: int
+    llm_calls_after: int
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Operations as given per operation actually evaluated."""
+        return self.operations_before / self.operations_after if self.operations_after else 1.0
+
+    @property
+    def llm_calls_saved(self) -> int:
+        return self.llm_calls_before - self.llm_calls_after
+
+    def summary(self) -> str:
+        return (f"Dedup: {self.num_subexpressions} shared sub-expressions replaced {self.num_substitutions} times, "
+                f"{self.operations_before} -> {self.operations_after} operations "
+                f"(ratio {self.dedup_ratio:.2f}), ~{self.llm_calls_saved} LLM calls saved")
+
+
+@dataclass
+class BatchReport:
+    items: List[BatchItemResult]   # Same order as the input expressions
+    total_time: float   # Wall time for the whole batch, in seconds
+    max_workers: int
+    dedup: Optional[DedupStats] = None   # Set if the shared sub-expressions were evaluated once
+
+    results: List[Optional[float]] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.results = [item.result for item in self.items]
+
+    @property
+    def num_succeeded(self) -> int:
+        return sum(1 for item in self.items if item.ok)
+
+    @property
+    def num_failed(self) -> int:
+        return len(self.items) - self.num_succeeded
+
+    @property
+    def errors(self) -> List[BatchItemResult]:
+        return [item for item in self.items if not item.ok]
+
+    @property
+    def throughput(self) -> float:
+        """Expressions processed per second."""
+        return len(self.items) / self.total_time if self.total_time > 0 else 0.0
+
+    def latency_percentile(self, p: float) -> float:
+        """Per-item latency at percentile p (0-100), using nearest-rank."""
+        if not self.items:
+            return 0.0
+        latencies = sorted(item.latency for item in self.items)
+        rank = max(0, min(len(latencies) - 1, int(round(p / 100 * len(latencies))) - 1))
+        return latencies[rank]
+
+    def summary(self) -> str:
+        summary = (f"{len(self.items)} expressions in {self.total_time:.3f}s ({self.throughput:.2f} expr/s, "
+                f"{self.max_workers} workers): {self.num_succeeded} succeeded, {self.num_failed} failed. "
+                f"Latency p50={self.latency_percentile(50):.3f}s, p95={self.latency_percentile(95):.3f}s, "
+                f"max={self.latency_percentile(100):.3f}s")
+        return f"{summary}. {self.dedup.summary()}" if self.dedup is not None else summary
+
+
+def run_batch(run_func: Callable[[str], Optional[float]], expressions: List[str], max_workers: int) -> BatchReport:
+    """
+    Evaluate the expressions over a thread pool, catching errors per expression so that one
+    bad input (validation, calculation, max LLM calls, API error) does not abort the whole batch.
+
+    :param run_func: Function evaluating a single expression (e.g. agent.run)
+    :param expressions: The mathematical expressions to evaluate
+    :param max_workers: Number of worker threads
+    :return: A BatchReport holding per-expression results and timing
+    """
+    if max_workers < 1:
+        raise ValueError(f'max_workers must be at least 1, got {max_workers}')
+
+    def run_one(expression: str) -> BatchItemResult:
+        start = time.perf_counter()
+        try:
+            result = run_func(expression)
+            error = None
+        except Exception as e:
+            result = None
+            error = e
+        return BatchItemResult(expression, result, error, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        items = list(executor.map(run_one, expressions))   # map() keeps the input order
+
+    return BatchReport(items, time.perf_counter() - start, max_workers)
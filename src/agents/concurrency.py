@@ -0,0 +1,63 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+async def gather_with_limit(func: Callable[[T], Awaitable[Any]], items: Iterable[T], max_concurrency: int,
+                            return_exceptions: bool = False) -> List[Any]:
+    """
+    Await func(item) for every item, keeping at most max_concurrency coroutines in flight at once.
+
+    :param func: Coroutine function applied to each item
+    :param items: The inputs to process
+    :param max_concurrency: Upper bound on the number of concurrently running coroutines
+    :param return_exceptions: If True, exceptions are returned in place of results instead of being raised
+    :return: The results (or exceptions), in the same order as the inputs
+    """
+    if max_concurrency < 1:
+        raise ValueError(f'max_concurrency must be at least 1, got {max_concurrency}')
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_limited(item: T) -> Any:
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run_limited(item) for item in items), return_exceptions=return_exceptions)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single execution: while a call for a key is in flight,
+    later callers wait for its result instead of starting their own. The work runs in its own task, so a caller
+    being cancelled does not cancel it for the others.
+    """
+    def __init__(self) -> None:
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._in_flight
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        :return: The result, and whether it was shared with (computed for) an earlier caller
+        """
+        task = self._in_flight.get(key)
+        shared = task is not None
+
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+
+        return await asyncio.shield(task), shared
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()   # Retrieved here, in case every caller was cancelled
@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from src.tools.numeric import decode_number, encode_number
+
+JOB_STATUSES = ('pending', 'leased', 'done', 'failed')
+
+QUEUE_FILE = 'jobs.sqlite'
+
+
+@dataclass
+class Job:
+    job_id: int
+    expression: str
+    attempts: int   # Leases so far, including the current one
+    worker: str = ''   # Worker holding the lease
+
+
+class JobQueue:
+    """
+    Durable queue of expressions to evaluate, in a SQLite file inside a queue directory, shared by any number of
+    worker processes (on this host, or on other hosts mounting the same directory).
+    Workers lease jobs for lease_seconds; a job whose worker died is leased again once its lease expires, so every
+    job is processed at least once, up to max_attempts leases: a job whose lease expires after its last attempt
+    (e.g. it crashes every worker that takes it) is marked failed. Completion is recorded only once per job: the
+    result of a second (duplicate) completion is dropped. Identical expressions are enqueued only once; the input
+    ids of all their records are kept with the job, so results can be joined back to the input.
+    journal_mode 'wal' is fastest, but requires all processes to be on the same host; use 'delete' for a
+    directory shared over a network file system (which must support file locking).
+    """
+    def __init__(self, directory: str, lease_seconds: float = 300.0, max_attempts: int = 3,
+                 journal_mode: str = 'wal') -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        # Transactions are explicit (BEGIN IMMEDIATE), so that a lease is claimed atomically across processes
+        self._conn = sqlite3.connect(os.path.join(directory, QUEUE_FILE), timeout=60.0, isolation_level=None)
+        self._conn.execute(f'PRAGMA journal_mode={journal_mode}')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                           'job_id INTEGER PRIMARY KEY, expression TEXT NOT NULL UNIQUE, '
+                           "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+                           'worker TEXT, lease_expires REAL, result TEXT, error TEXT, llm_calls INTEGER, '
+                           "latency REAL, updated REAL, ids TEXT NOT NULL DEFAULT '[]')")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)')
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')]
+        if 'ids' not in columns:   # Queue created before input ids were kept
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN ids TEXT NOT NULL DEFAULT '[]'")
+
+    def enqueue(self, items: Iterable[Union[str, Tuple[Any, str]]]) -> int:
+        """
+        Add expressions as pending jobs, given as text or as (input id, expression) pairs. Expressions already in
+        the queue are not added again, but the input id is added to the ids of their job. An expression that is
+        not a string raises a ValueError and nothing is added, instead of a job failing at every lease.
+
+        :return: The number of jobs added
+        """
+        before = self._conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            for item in items:
+                item_id, expression = (None, item) if isinstance(item, str) else item
+                if not isinstance(expression, str):
+                    raise ValueError(f'expression must be a string, got: {expression!r}')
+                row = self._conn.execute('SELECT job_id, ids FROM jobs WHERE expression = ?', (expression,)).fetchone()
+                if row is None:
+                    ids = [] if item_id is None else [item_id]
+                    self._conn.execute('INSERT INTO jobs (expression, ids, updated) VALUES (?, ?, ?)',
+                                       (expression, json.dumps(ids), time.time()))
+                elif item_id is not None:
+                    ids = json.loads(row[1])
+                    if item_id not in ids:   # Enqueueing the same input again (e.g. to resume) adds nothing
+                        self._conn.execute('UPDATE jobs SET ids = ? WHERE job_id = ?',
+                                           (json.dumps(ids + [item_id]), row[0]))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        return self._conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] - before
+
+    def lease(self, worker: str, max_jobs: int = 1) -> List[Job]:
+        """
+        Claim up to max_jobs jobs for the worker: pending jobs, and leased jobs whose lease has expired. Expired
+        jobs that have used up their attempts are marked failed instead.
+        """
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._fail_expired(now)
+            rows = self._conn.execute(
+                "SELECT job_id, expression, attempts FROM jobs WHERE status = 'pending' "
+                "OR (status = 'leased' AND lease_expires < ? AND attempts < ?) ORDER BY job_id LIMIT ?",
+                (now, self.max_attempts, max_jobs)).fetchall()
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'leased', attempts = attempts + 1, worker = ?, lease_expires = ?, "
+                "updated = ? WHERE job_id = ?",
+                [(worker, now + self.lease_seconds, now, job_id) for job_id, _, _ in rows])
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        return [Job(job_id, expression, attempts + 1, worker) for job_id, expression, attempts in rows]
+
+    def _fail_expired(self, now: float) -> None:
+        """Mark the jobs whose last lease expired as failed."""
+        self._conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, lease_expires = NULL, updated = ? "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (f'Lease expired on each of {self.max_attempts} attempts (the worker died or stalled)', now, now,
+             self.max_attempts))
+
+    def complete(self, job: Job, result: Any, llm_calls: Optional[int] = None,
+                 latency: Optional[float] = None) -> bool:
+        """
+        Record the result of a job.
+
+        :return: False if the job had already been completed (by a worker whose lease had expired), in which case
+                 the first result is kept
+        """
+        cursor = self._conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, llm_calls = ?, latency = ?, "
+            "lease_expires = NULL, updated = ? WHERE job_id = ? AND status != 'done'",
+            (json.dumps(result, default=encode_number), llm_calls, latency, time.time(), job.job_id))
+        return cursor.rowcount == 1
+
+    def fail(self, job: Job, error: str, retry: bool = True, latency: Optional[float] = None) -> None:
+        """
+        Record a failed attempt. The job is leased again later if retry is set and it has attempts left,
+        otherwise it is marked failed. Nothing is recorded if the lease expired and the job was leased by another
+        worker (or attempt) since.
+        """
+        status = 'pending' if retry and job.attempts < self.max_attempts else 'failed'
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, latency = ?, lease_expires = NULL, updated = ? "
+            "WHERE job_id = ? AND status = 'leased' AND worker = ? AND attempts = ?",
+            (status, error, latency, time.time(), job.job_id, job.worker, job.attempts))
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Number of jobs per status; leased jobs whose lease expired are counted as pending, or as failed if they
+        have no attempts left.
+        """
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        rows = self._conn.execute(
+            "SELECT CASE WHEN status = 'leased' AND lease_expires < ? "
+            "THEN CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END ELSE status END, COUNT(*) "
+            "FROM jobs GROUP BY 1", (time.time(), self.max_attempts)).fetchall()
+        counts.update(rows)
+        return counts
+
+    def results(self) -> Iterator[Dict[str, Any]]:
+        """The finished jobs, in enqueue order."""
+        self._fail_expired(time.time())
+        cursor = self._conn.execute("SELECT job_id, ids, expression, status, result, error, attempts, llm_calls, "
+                                    "latency FROM jobs WHERE status IN ('done', 'failed') ORDER BY job_id")
+        for job_id, ids, expression, status, result, error, attempts, llm_calls, latency in cursor:
+            yield {
+                'job_id': job_id,
+                'ids': json.loads(ids),   # Input ids of the records with this expression
+                'expression': expression,
+                'result': json.loads(result, object_hook=decode_number) if result is not None else None,
+                'error': error if status == 'failed' else None,
+                'attempts': attempts,
+                'llm_calls': llm_calls,
+                'latency_seconds': latency,
+            }
+
+    def close(self) -> None:
+        self._conn.close()
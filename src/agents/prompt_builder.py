@@ -0,0 +1,216 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.agents.tool_call_result import ToolCallResult
+from src.agents.utility import Number
+from src.llm.messages import MessageHistory, PromptPrefix, estimate_message_tokens
+from src.tools.expression_plan import ExpressionPlan
+from src.tools.numeric import DEFAULT_PRECISION, format_number
+
+BUDGET_STRATEGIES = ('sliding_window', 'summarize', 'reduced_form')
+
+PROMPT_LAYOUTS = ('standard', 'prefix_cache')
+
+
+class StepwisePromptBuilder:
+    """
+    Builds the prompts of one StepwiseCalculatorAgent run.
+    The templates are filled in once, steps are appended to a running text instead of being re-joined for every
+    prompt, and token counts are tracked per message. When a prompt exceeds the token budget, one of these
+    strategies is applied:
+        'sliding_window': only the most recent steps (or message exchanges, when appending messages) are kept
+        'summarize': as sliding_window, but the results of the omitted steps are listed in a single short line
+        'reduced_form': the prompt switches to the reduced expression (requires a plan), as in the reducing agent
+    Prompt layouts of fresh prompts (append_messages False):
+        'standard': [system prompt, subsequent prompt with the expression and the steps]
+        'prefix_cache': [system prompt, initial prompt, steps prompt]. The first two messages are the same objects
+                        in every prompt of the run (and the system message in every run of the agent), so the prompt
+                        prefix stays byte-identical and provider-side prompt caching applies; only the last message
+                        changes from call to call.
+    """
+    def __init__(self, expression: str, system_prompt: str, initial_prompt: str, subsequent_prompt: str,
+                 reduced_prompt: str, append_messages: bool, return_tool_call_msgs: bool,
+                 token_budget: Optional[int] = None, budget_strategy: str = 'sliding_window',
+                 plan: Optional[ExpressionPlan] = None, prompt_layout: str = 'standard', steps_prompt: str = '',
+                 prefix: Optional[PromptPrefix] = None, precision: int = DEFAULT_PRECISION) -> None:
+        if budget_strategy not in BUDGET_STRATEGIES:
+            raise ValueError(f'Unsupported prompt budget strategy: {budget_strategy}. '
+                             f'Supported strategies are {", ".join(BUDGET_STRATEGIES)}.')
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f'Unsupported prompt layout: {prompt_layout}. '
+                             f'Supported layouts are {", ".join(PROMPT_LAYOUTS)}.')
+
+        self.system_prompt = system_prompt
+        self.initial_prompt = initial_prompt.replace('{EXPRESSION}', expression)
+
+        # Messages shared by all prompts: the agent's system message, then this run's initial prompt
+        self.prefix = prefix if prefix is not None else PromptPrefix([{"role": "system", "content": system_prompt}])
+        self.run_prefix = PromptPrefix(list(self.prefix.messages) + [{"role": "user", "content": self.initial_prompt}])
+        self.prompt_layout = prompt_layout
+        self.reduced_prompt = reduced_prompt
+        self.append_messages = append_messages
+        self.return_tool_call_msgs = return_tool_call_msgs
+        self.token_budget = token_budget
+        self.budget_strategy = budget_strategy
+        self.plan = plan
+        self.precision = precision   # Significant digits of non-terminating fraction results in the steps
+
+        # The subsequent prompt is split around the steps placeholder once, instead of .replace() on every call
+        if prompt_layout == 'prefix_cache':
+            subsequent_prompt = steps_prompt
+        head, _, tail = subsequent_prompt.replace('{EXPRESSION}', expression).partition('{STEPS_SO_FAR}')
+        self.steps_prefix, self.steps_suffix = head, tail
+
+        self.steps: List[str] = []
+        self.step_results: List[Number] = []
+        self.steps_text = ''
+
+        # Append mode: (number of messages, step results) of each exchange added after the initial prompt
+        self.exchanges: List[Tuple[int, List[Number]]] = []
+        self.omitted_results: List[Number] = []
+        self.has_summary = False
+
+        self.use_reduced_form = False
+
+    def to_state(self) -> Dict[str, Any]:
+        """JSON serializable state of the builder, for checkpoints."""
+        return {
+            'steps': self.steps,
+            'step_results': self.step_results,
+            'exchanges': self.exchanges,
+            'omitted_results': self.omitted_results,
+            'has_summary': self.has_summary,
+            'use_reduced_form': self.use_reduced_form,
+        }
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Continue from a state saved with to_state()."""
+        self.steps = list(state['steps'])
+        self.step_results = list(state['step_results'])
+        self.steps_text = '\n'.join(self.steps)
+        self.exchanges = [(num_messages, list(results)) for num_messages, results in state['exchanges']]
+        self.omitted_results = list(state['omitted_results'])
+        self.has_summary = state['has_summary']
+        self.use_reduced_form = state['use_reduced_form']
+
+    def initial(self) -> MessageHistory:
+        return self.run_prefix.history()
+
+    def next(self, prompt_msg: MessageHistory, result: ToolCallResult, response: Any) -> MessageHistory:
+        """
+        Record the steps of the last response and build the prompt for the next call.
+        """
+        new_results = [step.result for step in result.steps]
+        for step in result.steps:
+            text = step.text(self.precision)   # Step records are only rendered here, once, for the prompts
+            self.steps_text = f'{self.steps_text}\n{text}' if self.steps_text else text
+            self.steps.append(text)
+        self.step_results.extend(new_results)
+
+        if self.use_reduced_form:
+            return self._reduced_prompt()
+
+        if self.append_messages:
+            prompt_msg = self._append_exchange(prompt_msg, result, response, new_results)
+        else:
+            prompt_msg = self._fresh_prompt()
+
+        if self._is_over_budget(prompt_msg.total_tokens):
+            prompt_msg = self._fit_to_budget(prompt_msg)
+
+        return prompt_msg
+
+    def _subsequent_prompt(self, steps_text: str) -> str:
+        return self.steps_prefix + steps_text + self.steps_suffix
+
+    def _append_exchange(self, prompt_msg: MessageHistory, result: ToolCallResult, response: Any,
+                         new_results: List[Number]) -> MessageHistory:
+        num_messages = len(prompt_msg.messages)
+
+        if self.return_tool_call_msgs:
+            prompt_msg.add_generic_message(response)
+
+            for step in result.steps:
+                prompt_msg.add_tool_result_message(step.result, step.call_id)
+
+            # Every tool call in the response needs an answer, including the rejected ones
+            for (reason, tool_call_id) in result.rejected_calls:
+                prompt_msg.add_tool_error_message(reason, tool_call_id)
+
+        prompt_msg.add_user_message(self._subsequent_prompt(self.steps_text))
+
+        self.exchanges.append((len(prompt_msg.messages) - num_messages, new_results))
+        return prompt_msg
+
+    def _fresh_prompt(self, user_prompt: Optional[str] = None) -> MessageHistory:
+        prompt_msg = (self.run_prefix if self.prompt_layout == 'prefix_cache' else self.prefix).history()
+        prompt_msg.add_user_message(user_prompt if user_prompt is not None else self._subsequent_prompt(self.steps_text))
+        return prompt_msg
+
+    def _reduced_prompt(self) -> MessageHistory:
+        # The reduced expression replaces the initial prompt, so only the system message is kept as prefix
+        prompt_msg = self.prefix.history()
+        prompt_msg.add_user_message(self.reduced_prompt.replace('{EXPRESSION}', self.plan.render()))
+        return prompt_msg
+
+    def _is_over_budget(self, tokens: int) -> bool:
+        return self.token_budget is not None and tokens > self.token_budget
+
+    def _fit_to_budget(self, prompt_msg: MessageHistory) -> MessageHistory:
+        if self.budget_strategy == 'reduced_form' and self.plan is not None:
+            self.use_reduced_form = True
+            return self._reduced_prompt()
+
+        summarize = self.budget_strategy == 'summarize'
+
+        if self.append_messages:
+            return self._drop_old_exchanges(prompt_msg, summarize)
+
+        return self._fresh_prompt(self._recent_steps_prompt(summarize))
+
+    def _recent_steps_prompt(self, summarize: bool) -> str:
+        """
+        The subsequent prompt with as many of the most recent steps as fit in the budget (at least one).
+        """
+        prefix = self.run_prefix if self.prompt_layout == 'prefix_cache' else self.prefix
+        available = self.token_budget - sum(prefix.token_counts)
+
+        for omitted in range(len(self.steps)):
+            prompt = self._steps_prompt(omitted, summarize)
+            if estimate_message_tokens({'content': prompt}) <= available:
+                return prompt
+
+        return self._steps_prompt(len(self.steps) - 1, summarize)
+
+    def _steps_prompt(self, omitted: int, summarize: bool) -> str:
+        if omitted == 0:
+            return self._subsequent_prompt(self.steps_text)
+
+        if summarize:
+            header = self._summary(self.step_results[:omitted])
+        else:
+            header = f'({omitted} earlier steps omitted)'
+        return self._subsequent_prompt('\n'.join([header] + self.steps[omitted:]))
+
+    def _drop_old_exchanges(self, prompt_msg: MessageHistory, summarize: bool) -> MessageHistory:
+        """
+        Remove the oldest exchanges (assistant message, tool results, user prompt) until the history fits,
+        always keeping the system message, the initial prompt and the latest exchange.
+        """
+        first = 2 + (1 if self.has_summary else 0)
+
+        while self._is_over_budget(prompt_msg.total_tokens) and len(self.exchanges) > 1:
+            num_messages, results = self.exchanges.pop(0)
+            prompt_msg.remove_messages(first, first + num_messages)
+            self.omitted_results.extend(results)
+
+        if summarize and self.omitted_results:
+            if self.has_summary:
+                prompt_msg.remove_messages(2, 3)
+            prompt_msg.insert_message(2, {"role": "user", "content": self._summary(self.omitted_results)})
+            self.has_summary = True
+
+        return prompt_msg
+
+    @staticmethod
+    def _summary(results: List[Number]) -> str:
+        return f'(Earlier steps omitted. Their results were: {", ".join(format_number(r) for r in results)})'
@@ -1,93 +1,171 @@
 import json
-from typing import List, Tuple, Any, Optional, Union
+from functools import partial
+from typing import Generator, List, Tuple, Any, Optional, Union
 
-from src.agents.tool_call_result import ToolCallResult
-from src.agents.utility import validate_expression, reduce_expression
+from src.agents.tool_call_result import StepRecord, ToolCallResult
+from src.agents.utility import reduce_expression, Number
 
-from src.tools.calculator import calculate
-from src.llm.llm_base import LLMClientBase
-from src.llm.chatgpt import MessageHistory
+from src.agents.agent_base import CalculatorAgentBase, LLMRequest
+from src.agents.metrics import AgentMetrics
+from src.agents.run_state import AgentRunState
+from src.agents.result_cache import ResultCacheBase
+from src.agents.speculation import SPECULATION_MODES, Speculation, speculate
+from src.tools.expression_plan import ExpressionPlan
 
+from src.llm.llm_base import LLMClientBase, AsyncLLMClientBase
+from src.llm.messages import MessageHistory, PromptPrefix
 
-class ReducingCalculatorAgent:
+
+class ReducingCalculatorAgent(CalculatorAgentBase):
     """
    Implements a calculator agent by iteratively calling an LLM client with a prompt that contains.
    1) a reduced form of the expression (operations replaced by previous results)
    At each call, the LLM will output the function arguments for calculate(a, b, op) to perform the next step
    When the LLM determines that the final step has been reached, the agent will return the final result.
     """
-    def __init__(self, llm_client: LLMClientBase, config: dict) -> None:
-        self.llm_client = llm_client
-
-        self.max_expression_length: int = config['max_expression_length']
+    def __init__(self, llm_client: Union[LLMClientBase, AsyncLLMClientBase], config: dict,
+                 result_cache: Optional[ResultCacheBase] = None, metrics: Optional[AgentMetrics] = None) -> None:
+        super().__init__(llm_client, config, result_cache, metrics)
 
-        self.system_prompt: str = config['system_prompt']
+        self.system_prompt: str = config['parallel_steps_system_prompt' if self.parallel_steps else 'system_prompt']
         self.prompt: str = config['prompt']
-        self.max_llm_calls: int = config['max_llm_calls']
-
-    def run(self, expression: str) -> Optional[float]:
-        """
-       Run the reducing calculation process for the given expression.
-
-       :param expression: The mathematical expression to evaluate
-       :return: The final result of the calculation, or None if not successful
-       """
 
-        print(f"Input expression: {expression}")
+        # The system message is built once and shared by every prompt, so the prompt prefix stays byte-identical
+        # across calls and expressions (provider-side prompt caching); the prompt template is split only once
+        self.prompt_prefix = PromptPrefix([{"role": "system", "content": self.system_prompt}])
+        self.prompt_head, _, self.prompt_tail = self.prompt.partition('{EXPRESSION}')
+        self.cache_steps: bool = (config.get('result_cache') or {}).get('cache_steps', False)
 
-        # Invalid expressions will raise an exception
-        validate_expression(expression, self.max_expression_length)
+        # Compute the expected next steps locally while the LLM answers, see speculation.py
+        self.speculation: str = config.get('speculation', 'none')
+        if self.speculation not in SPECULATION_MODES:
+            raise ValueError(f'Unsupported speculation mode: {self.speculation}. '
+                             f'Supported modes are {", ".join(SPECULATION_MODES)}.')
 
-        steps: List[str] = []
-        final_result: Optional[float] = None
+    def _llm_steps(self, expression: str, state: AgentRunState, plan: Optional[ExpressionPlan],
+                   checkpoint_path: Optional[str]) -> Generator[LLMRequest, Tuple[Any, Any], Optional[float]]:
+        """
+        Prompt the LLM with the reduced expression until the final step, see CalculatorAgentBase._run_steps().
+        The plan holds the parsed expression; steps are applied to it instead of rewriting the text.
+        """
+        expression = state.remaining_expression or expression
+        next_prompt: Optional[MessageHistory] = None
         i = 1
 
         while True:
-            # print(f'\n ================ iteration {i} ================ \n')
-
-            prompt_msg = self._prepare_next_prompt(expression)
-
-            # print('\n----- prompt_msg -----\n')
-            # print(prompt_msg)
-
-            response = self.llm_client.run_prompt(prompt_msg)
-
-            result = self._process_tool_calls(response.tool_calls, expression)
+            # Steps already solved for this (reduced) expression are replayed without calling the LLM
+            calls = self._get_cached_steps(expression)
+
+            speculation = None
+            if calls is None:
+                if next_prompt is None:
+                    with self.metrics.timer('prompt_build'):
+                        next_prompt = self._prepare_next_prompt(expression)
+                prompt_msg, next_prompt = next_prompt, None
+
+                speculate_task = partial(self._speculate, plan) if self.speculation != 'none' else None
+                response, speculation = yield prompt_msg, speculate_task
+                state.llm_calls += 1
+
+                calls = self._response_calls(response, plan, speculation)
+                if calls is None:   # No valid step: ask again right away
+                    self._check_llm_calls(i)
+                    i += 1
+                    continue
+                result = self._apply_calls(calls, expression, plan, speculation)
+                self._store_steps(expression, calls, result)
+            else:
+                result = self._apply_calls(calls, expression, plan)
 
             expression = result.remaining_expression
+            state.remaining_expression = expression
+            state.steps.extend(result.steps)
 
-            print(f"Call {i}: {'    ,   '.join(result.call_steps)} --> remaining expression: {expression}")
+            if self.verbose:
+                steps_text = '    ,   '.join(step.text(self.numeric.precision) for step in result.steps)
+                print(f"Call {i}: {steps_text} --> remaining expression: {expression}")
 
             if result.is_final_step:
-                final_result = result.results[-1][0]   # Last result --> first element in the tuple
-                # print(f"Final result: {final_result}")
-                break
+                return result.final_result
 
-            steps.extend(result.call_steps)
+            self._checkpoint(state, plan, checkpoint_path)
 
-            if i >= self.max_llm_calls:
-                raise RuntimeError(f'Max LLM calls reached before final result. Max calls: {self.max_llm_calls}')
+            # The prompt built while waiting for the LLM is used if its expected steps were taken
+            if speculation is not None and expression == speculation.next_expression:
+                next_prompt = speculation.next_prompt
 
+            self._check_llm_calls(i)
             i += 1
 
-        return final_result
+    def _needs_plan(self) -> bool:
+        return True   # The plan reduces the expression
+
+    def _speculate(self, plan: Optional[ExpressionPlan]) -> Optional[Speculation]:
+        """
+        Compute the expected next steps locally, and build the prompt that would follow them.
+        """
+        if self.speculation == 'none' or plan is None:
+            return None
 
-    def _process_tool_calls(self, tool_calls: List[Any], expression: str) -> ToolCallResult:
+        with self.metrics.timer('speculate'):
+            speculation = speculate(plan, self.numeric, self.parallel_steps)
+            if speculation is not None:
+                speculation.next_prompt = self._prepare_next_prompt(speculation.next_expression)
+        return speculation
+
+    def _response_calls(self, response: Any, plan: Optional[ExpressionPlan],
+                        speculation: Optional[Speculation]) -> Optional[List[Tuple[Number, Number, str, bool, str]]]:
+        """
+        The calls of an LLM response, checked against the speculated steps.
+        A response without any valid next step is replaced by the speculated calls in 'local' mode,
+        and discarded in 'reprompt' mode.
+
+        :return: The calls to apply, or None if the LLM should be prompted again
+        """
+        if speculation is None:
+            return self._parse_tool_calls(response.tool_calls)
+
+        try:
+            calls = self._parse_tool_calls(response.tool_calls)
+        except RuntimeError:
+            calls = []
+
+        matched = [plan.match(a, b, op) for (a, b, op, _, _) in calls]
+        if matched and all(o is not None and o.op_id in speculation.op_ids for o in matched):
+            self.metrics.increment('speculation_hits')
+            return calls
+
+        self.metrics.increment('speculation_misses')
+        if any(o is not None for o in matched):
+            return calls   # Valid steps, just not the expected ones
+        if self.speculation == 'local':
+            self.metrics.increment('speculation_local_steps')
+            return speculation.calls
+        return None
+
+    def _process_tool_calls(self, tool_calls: List[Any], expression: str,
+                            plan: Optional[ExpressionPlan] = None) -> ToolCallResult:
         """
         Process the tool calls returned by the LLM and perform the calculations.
 
         :param tool_calls: A list of tool calls from the LLM response
         :param expression: The current expression being evaluated
+        :param plan: If given, calls that are not valid next steps of the plan are rejected instead of applied
         :return: A ToolCallResult object containing the results, step information, and reduced expression
         """
+        return self._apply_calls(self._parse_tool_calls(tool_calls), expression, plan)
+
+    def _parse_tool_calls(self, tool_calls: List[Any]) -> List[Tuple[Number, Number, str, bool, str]]:
+        """
+        Extract the calculate arguments from the tool calls returned by the LLM.
+
+        :param tool_calls: A list of tool calls from the LLM response
+        :return: A list of (a, b, op, is_final_step, tool_call_id) tuples
+        """
         if not tool_calls:
             raise RuntimeError("Error: Expected a tool call but received none.")
 
-        function_call_result_message = []
-
-        results: List[Tuple[float, str]] = []
-        is_final_step = False
-        call_steps: List[str] = []
+        calls: List[Tuple[Number, Number, str, bool, str]] = []
 
         # Handle the potential case of multiple tool calls returned by the LLM
         for tool_call in tool_calls:
@@ -102,34 +180,84 @@ class ReducingCalculatorAgent:
             except (KeyError, ValueError, json.JSONDecodeError) as e:
                 raise RuntimeError(f"Invalid tool call arguments format: {function_call.arguments}. \n error: {e}")
 
-            result = calculate(a, b, op)
-
-            expression = reduce_expression(expression, a, b, op, result)
-
-            # If expression not found before final step --> Error
+            calls.append((a, b, op, is_final_step, tool_call.id))
 
-            step = f"{a} {op} {b} = {result}"
-            call_steps.append(step)
+        return calls
 
-            results.append((result, tool_call.id))
-
-            function_call_result_message.append({
-                "role": "tool",
-                "content": json.dumps({"result": result}),
-                "tool_call_id": tool_call.id
-            })
+    def _apply_calls(self, calls: List[Tuple[Number, Number, str, bool, str]], expression: str,
+                     plan: Optional[ExpressionPlan] = None,
+                     speculation: Optional[Speculation] = None) -> ToolCallResult:
+        """
+        Perform the calculations of the given calls and reduce the expression with their results.
 
-        return ToolCallResult(results, is_final_step, call_steps, expression)
+        :param calls: A list of (a, b, op, is_final_step, tool_call_id) tuples
+        :param expression: The current expression being evaluated
+        :param plan: The parsed expression. Calls that are not valid next steps of the plan are rejected,
+                     and the others are applied to it. Without a plan, the expression text is reduced with a regex.
+        :param speculation: The speculated steps; if exactly these are applied, their pre-rendered expression is used
+        :return: A ToolCallResult object containing the results, step information, and reduced expression
+        """
+        steps: List[StepRecord] = []
+        is_final_step = False
+        rejected_calls: List[Tuple[str, str]] = []
+        resolved_ids = set()
+
+        for (a, b, op, call_is_final_step, tool_call_id) in calls:
+            operation = None
+            if plan is not None:
+                operation = self._match_plan_step(plan, a, b, op)
+                if operation is None:
+                    rejected_calls.append((f"{a} {op} {b} is not a valid next step", tool_call_id))
+                    continue
+
+            # A matched step is performed on the exact operands of the plan, not on the (rounded) ones of the LLM
+            x, y = operation.operands if operation is not None else (a, b)
+            with self.metrics.timer('calculate'):
+                result = self.numeric.calculate(x, y, op)
+
+            with self.metrics.timer('reduce'):
+                if operation is not None:
+                    plan.resolve(operation.op_id, result)
+                    resolved_ids.add(operation.op_id)
+                    is_final_step = plan.is_complete   # The plan decides when the calculation is complete
+                else:
+                    # Expressions that could not be parsed fall back to regex based reduction
+                    expression = reduce_expression(expression, a, b, op, result, self.numeric.format)
+                    is_final_step = call_is_final_step
+
+            steps.append(StepRecord(a, b, op, result, tool_call_id))
+
+        # Render the text form only once per response, for the next prompt
+        if speculation is not None and resolved_ids == speculation.op_ids:
+            expression = speculation.next_expression
+        elif plan is not None:
+            with self.metrics.timer('reduce'):
+                expression = plan.render()
+
+        return ToolCallResult(steps, is_final_step, expression, rejected_calls)
+
+    def _get_cached_steps(self, expression: str) -> Optional[List[Tuple[Number, Number, str, bool, str]]]:
+        if self.result_cache is None or not self.cache_steps:
+            return None
+        return self.result_cache.get(self._cache_key('step', expression))
+
+    def _store_steps(self, expression: str, calls: List[Tuple[Number, Number, str, bool, str]],
+                     result: ToolCallResult) -> None:
+        """
+        Remember the calls the LLM made for this expression. Calls that did not reduce the expression
+        (and so were probably wrong) are not cached.
+        """
+        if self.result_cache is None or not self.cache_steps:
+            return
+        if result.is_final_step or result.remaining_expression != expression:
+            self.result_cache.set(self._cache_key('step', expression), calls)
 
     def _prepare_next_prompt(self, expression: str) -> MessageHistory:
         """
         Prepare the prompt for the next iteration of the calculation process.
         """
-        prompt = self.prompt.replace('{EXPRESSION}', expression)
-
-        prompt_msg = MessageHistory()
-        prompt_msg.add_system_message(self.system_prompt)
-        prompt_msg.add_user_message(prompt)
+        prompt_msg = self.prompt_prefix.history()
+        prompt_msg.add_user_message(self.prompt_head + expression + self.prompt_tail)
 
         return prompt_msg
 
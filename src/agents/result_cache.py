@@ -0,0 +1,212 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from src.tools.expression_parser import ExpressionSyntaxError, parse_number, tokenize
+from src.tools.numeric import NumericBackend, decode_number, encode_number
+
+# Config keys that only change how an agent runs (credentials, output, concurrency, limits, storage), not what
+# the LLM is asked or what an agent may answer. All other keys are part of the cache fingerprint, so that prompt
+# options added later are covered without being listed here.
+RUNTIME_CONFIG_KEYS = ('api_key', 'openai_key_env_var', 'verbose', 'max_concurrency', 'max_workers',
+                       'max_queue_depth', 'max_llm_calls', 'max_expression_length', 'batch_dedup', 'result_cache',
+                       'rate_limit', 'jobs', 'prompt_cache_key', 'http')
+
+
+def normalize_expression(expression: str, numeric: Optional[NumericBackend] = None) -> str:
+    """
+    Canonical text form of an expression, used as a cache key. Whitespace is removed and numbers are
+    rewritten in a canonical form, so that e.g. '2.50 +  03' and '2.5+3' map to the same key.
+
+    :param numeric: Backend the expression is evaluated with. Numbers are canonicalized in its type, so that
+                    literals which only differ beyond float precision keep different keys with exact backends.
+    """
+    try:
+        tokens = tokenize(expression)
+    except ExpressionSyntaxError:
+        return ''.join(expression.split())
+
+    if numeric is None:
+        return ''.join(repr(parse_number(text)) if kind == 'num' else text for kind, text in tokens)
+    return ''.join(numeric.format(numeric.parse(text)) if kind == 'num' else text for kind, text in tokens)
+
+
+def config_fingerprint(config: dict) -> str:
+    """
+    Hash of the config without its RUNTIME_CONFIG_KEYS (model, routing, numeric backend, prompts, prompt layout
+    and budget, speculation, ...), so that results from different models, number types or prompts are never
+    mixed up in a shared cache. Of the HTTP options, only the API endpoint is relevant.
+    """
+    relevant = {key: value for key, value in config.items() if key not in RUNTIME_CONFIG_KEYS}
+    relevant['base_url'] = (config.get('http') or {}).get('base_url')
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class ResultCacheBase(ABC):
+    """
+    Key-value cache for agent results. Values must be JSON serializable (Decimal and Fraction numbers included).
+    Implementations must be thread safe, since agents may be driven from a thread pool.
+    """
+    def __init__(self, max_size: int, ttl_seconds: Optional[float]) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if the key is missing or expired."""
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'size': len(self),
+        }
+
+    def _is_expired(self, created: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+
+class LRUResultCache(ResultCacheBase):
+    """
+    In-memory cache with least-recently-used eviction once max_size entries are held.
+    """
+    def __init__(self, max_size: int = 10000, ttl_seconds: Optional[float] = None) -> None:
+        super().__init__(max_size, ttl_seconds)
+        self._entries: 'OrderedDict[str, Tuple[Any, float]]' = OrderedDict()   # key -> (value, created time)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and self._is_expired(entry[1]):
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteResultCache(ResultCacheBase):
+    """
+    On-disk cache backed by a SQLite file, so results survive restarts and can be shared between processes.
+    Eviction is least-recently-used, based on the last access time of each entry. To avoid counting rows on every
+    insert, the size limit is enforced every max_size / 100 inserts, so the table may briefly overshoot by 1%.
+    """
+    def __init__(self, path: str, max_size: int = 1000000, ttl_seconds: Optional[float] = None) -> None:
+        super().__init__(max_size, ttl_seconds)
+        self.path = path
+        self._lock = threading.Lock()
+        self._check_interval = max(1, max_size // 100)
+        self._sets_since_check = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS results '
+                           '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute('SELECT value, created FROM results WHERE key = ?', (key,)).fetchone()
+
+            if row is not None and self._is_expired(row[1]):
+                self._conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                self.evictions += 1
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+            self.hits += 1
+            return json.loads(row[0], object_hook=decode_number)
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                               (key, json.dumps(value, default=encode_number), now, now))
+
+            self._sets_since_check += 1
+            if self._sets_since_check < self._check_interval:
+                return
+            self._sets_since_check = 0
+
+            excess = self._count() - self.max_size
+            if excess > 0:
+                self._conn.execute('DELETE FROM results WHERE key IN '
+                                   '(SELECT key FROM results ORDER BY accessed LIMIT ?)', (excess,))
+                self.evictions += excess
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._count()
+
+    def _count(self) -> int:
+        return self._conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def create_result_cache(config: dict) -> Optional[ResultCacheBase]:
+    """
+    Create the cache described by the 'result_cache' section of an agent config, or None if caching is disabled.
+    Example:
+        result_cache:
+          backend: sqlite    # none | memory | sqlite
+          path: results_cache.sqlite
+          max_size: 100000
+          ttl_seconds: 86400
+    """
+    cache_config = config.get('result_cache') or {}
+    backend = cache_config.get('backend', 'none')
+
+    if backend == 'none':
+        return None
+    elif backend == 'memory':
+        return LRUResultCache(cache_config.get('max_size', 10000), cache_config.get('ttl_seconds'))
+    elif backend == 'sqlite':
+        return SQLiteResultCache(cache_config['path'], cache_config.get('max_size', 1000000),
+                                 cache_config.get('ttl_seconds'))
+    else:
+        raise ValueError(f'Unsupported result cache backend: {backend}. Supported backends are none, memory, sqlite.')
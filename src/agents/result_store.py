@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+STORE_VERSION = 1
+
+# Status codes of the stored results
+STATUS_OK = 0
+STATUS_INVALID = 1   # The expression failed validation or could not be evaluated (ValueError)
+STATUS_ARITHMETIC_ERROR = 2   # E.g. division by zero
+STATUS_ERROR = 3   # Any other error (API errors, max LLM calls, cross-check mismatches, ...)
+STATUSES = ('ok', 'invalid', 'arithmetic_error', 'error')
+
+# Fixed-width columns: file name and dtype. Expression texts are stored back to back in EXPRESSIONS_FILE,
+# each ending at its expression_end offset.
+COLUMNS = {
+    'result': np.float64,   # NaN if there is no result
+    'status': np.uint8,
+    'llm_calls': np.int32,
+    'latency': np.float64,   # Seconds
+    'expression_hash': np.uint64,
+    'expression_end': np.uint64,
+}
+EXPRESSIONS_FILE = 'expressions.txt'
+INDEX_FILES = ('index_hash', 'index_row')
+META_FILE = 'meta.json'
+
+
+def status_code(error: Optional[BaseException]) -> int:
+    if error is None:
+        return STATUS_OK
+    if isinstance(error, ArithmeticError):
+        return STATUS_ARITHMETIC_ERROR
+    if isinstance(error, ValueError):
+        return STATUS_INVALID
+    return STATUS_ERROR
+
+
+def expression_key(expression: str) -> str:
+    """
+    Key of an expression in the store: its text without whitespace, so that e.g. '2.5 + 3' and '2.5+3' are
+    found by each other. Numbers are not canonicalized as in the result cache, which would take most of the
+    time of an append.
+    """
+    return ''.join(expression.split())
+
+
+def expression_hash(expression: str) -> int:
+    """64 bit hash of the expression key."""
+    digest = hashlib.blake2b(expression_key(expression).encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class ColumnarResultStore:
+    """
+    Append-only store of batch results in a directory of columnar files (one raw NumPy array per column), read
+    through memory maps: lookups and aggregations over tens of millions of rows only touch the pages they need,
+    without creating Python objects per row. Results are stored as float64 (exact numbers are converted).
+
+    Expressions are found through a hash index: the (expression hash, row) pairs sorted by hash, searched with
+    binary search. Rows appended since the index was last built (at most index_tail_fraction of the store) are
+    found by scanning their hash column. An expression stored several times maps to its latest row.
+
+    Appended rows are buffered and written every flush_rows rows, on flush() and on close(). A row is durable
+    once meta.json counts it; rows written after the last meta update (e.g. by a crashed process) are discarded
+    when the store is opened again. A store must only have one writer at a time.
+    """
+    def __init__(self, directory: str, flush_rows: int = 10000, index_tail_fraction: float = 0.1) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.flush_rows = flush_rows
+        self.index_tail_fraction = index_tail_fraction
+
+        meta_path = os.path.join(directory, META_FILE)
+        meta = {'version': STORE_VERSION, 'rows': 0, 'indexed_rows': 0, 'expression_bytes': 0}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['version'] != STORE_VERSION:
+                raise ValueError(f'Unsupported result store version {meta["version"]} in {directory}')
+
+        self.num_rows: int = meta['rows']
+        self.indexed_rows: int = meta['indexed_rows']
+        self._expression_bytes: int = meta['expression_bytes']
+        self._truncate()
+
+        self._pending: List[tuple] = []
+        self._maps: Dict[str, np.ndarray] = {}   # Memory maps of the committed rows, reopened after each flush
+
+        # An index written by a flush that was not committed covers other rows: build it again
+        index_size = self.indexed_rows * np.dtype(np.uint64).itemsize
+        if any(not os.path.exists(self._path(name)) or os.path.getsize(self._path(name)) != index_size
+               for name in INDEX_FILES):
+            self._build_index()
+            self._write_meta()
+
+    def __len__(self) -> int:
+        return self.num_rows + len(self._pending)
+
+    def __enter__(self) -> 'ColumnarResultStore':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _truncate(self) -> None:
+        """Cut the files back to the committed rows, dropping a partially written flush."""
+        sizes = {name: self.num_rows * np.dtype(dtype).itemsize for name, dtype in COLUMNS.items()}
+        sizes[EXPRESSIONS_FILE] = self._expression_bytes
+        for name, size in sizes.items():
+            with open(self._path(name), 'ab') as f:
+                if f.tell() != size:
+                    f.truncate(size)
+
+    def append(self, expression: str, result: Optional[Any], error: Optional[BaseException] = None,
+               llm_calls: Optional[int] = None, latency: Optional[float] = None) -> None:
+        """
+        Add the outcome of one expression; its status code is derived from the error (see status_code()).
+        Rows are converted to column values here, so that a bad row fails on its own instead of in flush():
+        an expression that is not a string (e.g. a number in JSONL input) is stored as text with the invalid
+        status, and a result that is not a number as NaN.
+        """
+        status = status_code(error)
+        if not isinstance(expression, str):
+            expression, status = str(expression), STATUS_INVALID
+        try:
+            value = np.nan if result is None else float(result)
+        except (TypeError, ValueError):
+            value = np.nan
+
+        self._pending.append((expression, value, status, int(llm_calls or 0), float(latency or 0.0)))
+        if len(self._pending) >= self.flush_rows:
+            self.flush()
+
+    def append_many(self, rows: Iterable[Sequence[Any]]) -> None:
+        """Append (expression, result, error, llm_calls, latency) rows, e.g. from the items of a BatchReport."""
+        for row in rows:
+            self.append(*row)
+
+    def flush(self) -> None:
+        """Write the buffered rows and commit them."""
+        if not self._pending:
+            return
+
+        pending = self._pending
+        encoded = [row[0].encode('utf-8', 'surrogatepass') for row in pending]
+        ends = self._expression_bytes + np.cumsum([len(text) for text in encoded], dtype=np.uint64)
+        columns = {
+            'result': np.array([row[1] for row in pending], dtype=np.float64),
+            'status': np.array([row[2] for row in pending], dtype=np.uint8),
+            'llm_calls': np.array([row[3] for row in pending], dtype=np.int32),
+            'latency': np.array([row[4] for row in pending], dtype=np.float64),
+            'expression_hash': np.array([expression_hash(row[0]) for row in pending], dtype=np.uint64),
+            'expression_end': ends,
+        }
+        self._pending = []   # Only once all columns are built: a failure above keeps the buffered rows
+
+        for name, values in columns.items():
+            with open(self._path(name), 'ab') as f:
+                f.write(values.tobytes())
+        with open(self._path(EXPRESSIONS_FILE), 'ab') as f:
+            f.write(b''.join(encoded))
+
+        self.num_rows += len(pending)
+        self._expression_bytes = int(ends[-1])
+        self._maps = {}
+
+        if self.num_rows - self.indexed_rows > self.index_tail_fraction * self.num_rows:
+            self._build_index()
+        self._write_meta()
+
+    def _write_meta(self) -> None:
+        meta = {'version': STORE_VERSION, 'rows': self.num_rows, 'indexed_rows': self.indexed_rows,
+                'expression_bytes': self._expression_bytes}
+        temp_path = self._path(META_FILE + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self._path(META_FILE))   # Atomic: readers see the old or the new row count
+
+    def _build_index(self) -> None:
+        """Sort the (hash, row) pairs of all committed rows; equal hashes stay in row order."""
+        hashes = self.column('expression_hash')
+        order = np.argsort(hashes, kind='stable')
+        for name, values in zip(INDEX_FILES, (hashes[order], order.astype(np.int64))):
+            temp_path = self._path(name + '.tmp')
+            values.tofile(temp_path)
+            os.replace(temp_path, self._path(name))
+        self.indexed_rows = self.num_rows
+        self._maps = {}
+
+    def _map(self, name: str, dtype: Any, length: int) -> np.ndarray:
+        if name not in self._maps:
+            self._maps[name] = np.memmap(self._path(name), dtype=dtype, mode='r', shape=(length,)) if length \
+                else np.empty(0, dtype=dtype)   # Zero-length files cannot be memory mapped
+        return self._maps[name]
+
+    def column(self, name: str) -> np.ndarray:
+        """Read-only memory map of a column over the committed rows (call flush() first to include buffered rows)."""
+        if name not in COLUMNS:
+            raise ValueError(f'Unknown column: {name}. Columns are {", ".join(COLUMNS)}.')
+        return self._map(name, COLUMNS[name], self.num_rows)
+
+    def expression(self, row: int) -> str:
+        ends = self.column('expression_end')
+        start = int(ends[row - 1]) if row > 0 else 0
+        text = bytes(self._map(EXPRESSIONS_FILE, np.uint8, self._expression_bytes)[start:int(ends[row])])
+        return text.decode('utf-8', 'surrogatepass')
+
+    def record(self, row: int) -> Dict[str, Any]:
+        result = float(self.column('result')[row])
+        return {
+            'row': row,
+            'expression': self.expression(row),
+            'result': None if np.isnan(result) else result,
+            'status': STATUSES[self.column('status')[row]],
+            'llm_calls': int(self.column('llm_calls')[row]),
+            'latency_seconds': float(self.column('latency')[row]),
+        }
+
+    def lookup(self, expressions: Sequence[str]) -> np.ndarray:
+        """
+        Latest row of each expression, or -1 for expressions that are not stored. Buffered rows are flushed first.
+        """
+        self.flush()
+        rows = np.full(len(expressions), -1, dtype=np.int64)
+        if not expressions or not self.num_rows:
+            return rows
+
+        hashes = np.array([expression_hash(expression) for expression in expressions], dtype=np.uint64)
+        index_hash = self._map(INDEX_FILES[0], np.uint64, self.indexed_rows)
+        index_row = self._map(INDEX_FILES[1], np.int64, self.indexed_rows)
+        starts = np.searchsorted(index_hash, hashes, side='left')
+        stops = np.searchsorted(index_hash, hashes, side='right')
+        tail_hashes = self.column('expression_hash')[self.indexed_rows:]
+
+        for i, expression in enumerate(expressions):
+            # Candidates in row order: the indexed rows with this hash, then the rows appended since
+            candidates = list(index_row[starts[i]:stops[i]])
+            candidates.extend(self.indexed_rows + np.flatnonzero(tail_hashes == hashes[i]))
+            key = expression_key(expression)
+            for row in reversed(candidates):
+                if expression_key(self.expression(int(row))) == key:   # Rules out hash collisions
+                    rows[i] = row
+                    break
+        return rows
+
+    def get(self, expression: str) -> Optional[Dict[str, Any]]:
+        """The latest record of the expression, or None if it is not stored."""
+        row = int(self.lookup([expression])[0])
+        return self.record(row) if row >= 0 else None
+
+    def summary(self) -> Dict[str, Any]:
+        """Aggregates over all rows, computed on the memory-mapped columns."""
+        self.flush()
+        status_counts = np.bincount(self.column('status'), minlength=len(STATUSES))
+        latency = self.column('latency')
+        llm_calls = self.column('llm_calls')
+        return {
+            'rows': self.num_rows,
+            **{status: int(count) for status, count in zip(STATUSES, status_counts)},
+            'llm_calls': int(llm_calls.sum(dtype=np.int64)),
+            'mean_llm_calls': float(llm_calls.mean()) if self.num_rows else 0.0,
+            'latency_p50_seconds': float(np.percentile(latency, 50)) if self.num_rows else 0.0,
+            'latency_p95_seconds': float(np.percentile(latency, 95)) if self.num_rows else 0.0,
+            'latency_max_seconds': float(latency.max()) if self.num_rows else 0.0,
+        }
+
+    def close(self) -> None:
+        self.flush()
+        self._maps = {}
@@ -0,0 +1,63 @@
+import json
+import os
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.agents.tool_call_result import StepRecord
+from src.agents.utility import Number
+from src.llm.messages import message_to_dict
+from src.tools.numeric import decode_number, encode_number
+
+STATE_VERSION = 2   # 2: steps are saved as step records instead of text
+
+
+@dataclass
+class AgentRunState:
+    """
+    Progress of one agent run, updated after every LLM call. It holds everything needed to continue the run
+    (resolved plan operations, reduced expression, next prompt), so a run that failed on an API error or hit
+    max_llm_calls can be resumed and only pay for the remaining steps. Serializable to JSON, for checkpoints
+    (Decimal and Fraction numbers included).
+    """
+    agent: str   # Class name of the agent that created the state
+    expression: str   # The original expression
+    remaining_expression: str = ''   # Reducing agent: expression of the next prompt ('' before the first step)
+    steps: List[StepRecord] = field(default_factory=list)   # Every step performed so far
+    resolved_operations: List[Tuple[int, Number]] = field(default_factory=list)   # (op_id, result), see ExpressionPlan
+    messages: List[Any] = field(default_factory=list)   # Stepwise agent: messages of the next prompt
+    prompt_state: Dict[str, Any] = field(default_factory=dict)   # Stepwise agent: state of the prompt builder
+    llm_calls: int = 0   # LLM calls over all attempts
+    final_result: Optional[Number] = None
+    is_complete: bool = False
+    version: int = STATE_VERSION
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {f.name: getattr(self, f.name) for f in fields(self)}
+        # The prompt may hold message objects returned by the API
+        data['messages'] = [message_to_dict(msg) for msg in self.messages]
+        data['steps'] = [step.to_list() for step in self.steps]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'AgentRunState':
+        if data.get('version') != STATE_VERSION:
+            raise ValueError(f"Unsupported run state version: {data.get('version')}")
+        state = cls(**data)
+        state.resolved_operations = [(op_id, result) for op_id, result in state.resolved_operations]
+        state.steps = [StepRecord.from_list(step) for step in state.steps]
+        return state
+
+    def save(self, path: str) -> None:
+        """Write the state to path atomically, so an interrupted save never leaves a truncated checkpoint."""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, default=encode_number)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['AgentRunState']:
+        """Load a checkpoint, or return None if there is none at path."""
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls.from_dict(json.load(f, object_hook=decode_number))
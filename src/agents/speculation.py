@@ -0,0 +1,44 @@
+from dataclasses import dataclass
+from typing import Any, FrozenSet, List, Optional, Tuple
+
+from src.tools.expression_plan import ExpressionPlan, Number
+from src.tools.numeric import NumericBackend
+
+# none: steps are only checked once the LLM answers
+# reprompt: a response without any valid next step is discarded and the LLM is asked again at once
+# local: a response without any valid next step is replaced by the locally computed steps
+SPECULATION_MODES = ('none', 'reprompt', 'local')
+
+
+@dataclass
+class Speculation:
+    """
+    The next steps of a plan, computed locally before (or while) the LLM answers.
+    """
+    calls: List[Tuple[Number, Number, str, bool, str]]   # The expected (a, b, op, is_final_step, tool_call_id) calls
+    op_ids: FrozenSet[int]   # Plan operations of the expected calls
+    next_expression: str   # The expression once the expected calls are applied, i.e. the text of the next prompt
+    next_prompt: Any = None   # The next prompt, built by the agent while it waits for the LLM
+
+
+def speculate(plan: ExpressionPlan, numeric: NumericBackend, parallel_steps: bool) -> Optional[Speculation]:
+    """
+    The steps the LLM is expected to return next: every ready operation in parallel step mode, otherwise the
+    leftmost one (operation ids follow the order of the operations in the expression).
+
+    :return: The speculation, or None if there is nothing left to calculate or a step fails (e.g. division by zero)
+    """
+    ready = sorted(plan.ready(), key=lambda o: o.op_id)
+    if not ready:
+        return None
+
+    operations = ready if parallel_steps else ready[:1]
+    try:
+        resolved = [(o.op_id, numeric.calculate(o.operands[0], o.operands[1], o.op)) for o in operations]
+    except ArithmeticError:
+        return None
+
+    is_final_step = sum(1 for o in plan.operations if not o.is_resolved) == len(operations)
+    calls = [(o.operands[0], o.operands[1], o.op, is_final_step, f'local_{o.op_id}') for o in operations]
+
+    return Speculation(calls, frozenset(o.op_id for o in operations), plan.render_after(resolved))
@@ -1,15 +1,20 @@
 import json
-from typing import List, Tuple, Any, Optional
+from typing import Generator, List, Tuple, Any, Optional, Union
 
-from src.agents.tool_call_result import ToolCallResult
-from src.agents.utility import validate_expression
+from src.agents.tool_call_result import StepRecord, ToolCallResult
 
-from src.tools.calculator import calculate
-from src.llm.llm_base import LLMClientBase
-from src.llm.chatgpt import MessageHistory
+from src.agents.agent_base import CalculatorAgentBase, LLMRequest
+from src.agents.prompt_builder import StepwisePromptBuilder, BUDGET_STRATEGIES, PROMPT_LAYOUTS
+from src.agents.metrics import AgentMetrics
+from src.agents.run_state import AgentRunState
+from src.agents.result_cache import ResultCacheBase
+from src.tools.expression_plan import ExpressionPlan
 
+from src.llm.llm_base import LLMClientBase, AsyncLLMClientBase
+from src.llm.messages import MessageHistory, PromptPrefix
 
-class StepwiseCalculatorAgent:
+
+class StepwiseCalculatorAgent(CalculatorAgentBase):
     """
    Implements a calculator agent by iteratively calling an LLM client with a prompt that contains.
    1) the full original expression
@@ -17,82 +22,92 @@ class StepwiseCalculatorAgent:
    At each call, the LLM will output the function arguments for calculate(a, b, op) to perform the next step
    When the LLM determines that the final step has been reached, the agent will return the final result.
    """
-    def __init__(self, llm_client: LLMClientBase, config: dict) -> None:
-        self.llm_client = llm_client
-
-        self.max_expression_length: int = config['max_expression_length']
+    def __init__(self, llm_client: Union[LLMClientBase, AsyncLLMClientBase], config: dict,
+                 result_cache: Optional[ResultCacheBase] = None, metrics: Optional[AgentMetrics] = None) -> None:
+        super().__init__(llm_client, config, result_cache, metrics)
 
-        self.system_prompt: str = config['system_prompt']
+        self.system_prompt: str = config['parallel_steps_system_prompt' if self.parallel_steps else 'system_prompt']
         self.subsequent_prompt: str = config['subsequent_prompt']
         self.initial_prompt: str = config['initial_prompt']
 
-        self.max_llm_calls: int = config['max_llm_calls']
+        self.reduced_prompt: str = config.get('reduced_prompt', '')
+
         self.return_tool_call_msgs: bool = config['return_tool_call_msgs']
         self.append_messages: bool = config['append_messages']
 
-    def run(self, expression: str) -> Optional[float]:
-        """
-        Run the stepwise calculation process for the given expression.
+        # Estimated prompt size above which the budget strategy is applied (None: unlimited)
+        self.prompt_token_budget: Optional[int] = config.get('prompt_token_budget')
+        self.prompt_budget_strategy: str = config.get('prompt_budget_strategy', 'sliding_window')
 
-        :param expression: The mathematical expression to evaluate
-        :return: The final result of the calculation, or None if not successful
-        """
-        print(f"Input expression: {expression}")
+        if self.prompt_budget_strategy not in BUDGET_STRATEGIES:
+            raise ValueError(f'Unsupported prompt_budget_strategy: {self.prompt_budget_strategy}. '
+                             f'Supported strategies are {", ".join(BUDGET_STRATEGIES)}.')
 
-        # Invalid expressions will raise an exception
-        validate_expression(expression, self.max_expression_length)
+        # Message layout of fresh prompts, see StepwisePromptBuilder
+        self.prompt_layout: str = config.get('prompt_layout', 'standard')
+        self.steps_prompt: str = config.get('steps_prompt', '')
 
-        initial_prompt = self.initial_prompt.replace('{EXPRESSION}', expression)
+        if self.prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f'Unsupported prompt_layout: {self.prompt_layout}. '
+                             f'Supported layouts are {", ".join(PROMPT_LAYOUTS)}.')
 
-        prompt_msg = MessageHistory()
-        prompt_msg.add_system_message(self.system_prompt)
-        prompt_msg.add_user_message(initial_prompt)
+        # The system message is built once and shared by the prompts of every run
+        self.prompt_prefix = PromptPrefix([{"role": "system", "content": self.system_prompt}])
+
+    def _llm_steps(self, expression: str, state: AgentRunState, plan: Optional[ExpressionPlan],
+                   checkpoint_path: Optional[str]) -> Generator[LLMRequest, Tuple[Any, Any], Optional[float]]:
+        """
+        Prompt the LLM with the expression and the steps so far until the final step,
+        see CalculatorAgentBase._run_steps().
+        """
+        prompt_builder = self._create_prompt_builder(expression, plan)
+        with self.metrics.timer('prompt_build'):
+            if state.messages:
+                prompt_builder.restore(state.prompt_state)
+                prompt_msg = MessageHistory(state.messages)
+            else:
+                prompt_msg = prompt_builder.initial()
 
-        steps: List[str] = []
-        final_result: Optional[float] = None
         i = 1
 
         while True:
-            # print(f'\n ================ iteration {i} ================ \n')
-
-            # print('\n----- prompt_msg -----\n')
-            # print(prompt_msg)
+            response, _ = yield prompt_msg, None
+            state.llm_calls += 1
 
-            response = self.llm_client.run_prompt(prompt_msg)
+            result = self._process_tool_calls(response.tool_calls, plan)
+            state.steps.extend(result.steps)
 
-            result = self._process_tool_calls(response.tool_calls)
-
-            print(f"Call {i}: {'    ,   '.join(result.call_steps)}")
+            if self.verbose:
+                steps_text = '    ,   '.join(step.text(self.numeric.precision) for step in result.steps)
+                print(f"Call {i}: {steps_text}")
 
             if result.is_final_step:
-                final_result = result.results[-1][0]   # Last result --> first element in the tuple
-                # print(f"Final result: {final_result}")
-                break
-
-            steps.extend(result.call_steps)
+                return result.final_result
 
-            prompt_msg = self._prepare_next_prompt(prompt_msg, expression, steps, result.results, response)
+            with self.metrics.timer('prompt_build'):
+                prompt_msg = prompt_builder.next(prompt_msg, result, response)
 
-            if i >= self.max_llm_calls:
-                raise RuntimeError(f'Max LLM calls reached before final result. Max calls: {self.max_llm_calls}')
+            state.messages = prompt_msg.get_messages()
+            state.prompt_state = prompt_builder.to_state()
+            self._checkpoint(state, plan, checkpoint_path)
 
+            self._check_llm_calls(i)
             i += 1
 
-        return final_result
-
-    def _process_tool_calls(self, tool_calls: List[Any]) -> ToolCallResult:
+    def _process_tool_calls(self, tool_calls: List[Any], plan: Optional[ExpressionPlan] = None) -> ToolCallResult:
         """
         Process the tool calls returned by the LLM and perform the calculations.
 
         :param tool_calls: A list of tool calls from the LLM response
+        :param plan: If given, calls that are not valid next steps of the plan are rejected instead of performed
         :return: A ToolCallResult object containing the results and step information
         """
         if not tool_calls:
             raise RuntimeError("Error: Expected a tool call but received none.")
 
-        results: List[Tuple[float, str]] = []
+        steps: List[StepRecord] = []
         is_final_step = False
-        call_steps: List[str] = []
+        rejected_calls: List[Tuple[str, str]] = []
 
         # Handle the potential case of multiple tool calls returned by the LLM
         for tool_call in tool_calls:
@@ -103,46 +118,46 @@ class StepwiseCalculatorAgent:
                 a = func_args['a']
                 b = func_args['b']
                 op = func_args['op']
-                is_final_step = func_args['is_final_step']
+                call_is_final_step = func_args['is_final_step']
             except (KeyError, ValueError, json.JSONDecodeError) as e:
                 raise RuntimeError(f"Invalid tool call arguments format: {function_call.arguments}. \n error: {e}")
 
-            result = calculate(a, b, op)
-
-            step = f"{a} {op} {b} = {result}"
-            call_steps.append(step)
-
-            results.append((result, tool_call.id))
-
-        return ToolCallResult(results, is_final_step, call_steps, '')
-
-    def _prepare_next_prompt(self, prompt_msg: MessageHistory, expression: str, steps: List[str],
-                             results: List[Tuple[float, str]], response: Any) -> MessageHistory:
-        """
-        Prepare the prompt for the next iteration of the calculation process. Several variants are possible.
-        """
-        steps_so_far = '\n'.join(steps)
-        next_prompt = self.subsequent_prompt.replace('{EXPRESSION}', expression)
-        next_prompt = next_prompt.replace('{STEPS_SO_FAR}', steps_so_far)
-
-        # print(next_prompt)
+            operation = None
+            if plan is not None:
+                operation = self._match_plan_step(plan, a, b, op)
+                if operation is None:
+                    rejected_calls.append((f"{a} {op} {b} is not a valid next step", tool_call.id))
+                    continue
 
-        # Append messages to the current history
-        if self.append_messages:
-            if self.return_tool_call_msgs:
-                prompt_msg.add_generic_message(response)
+            # A matched step is performed on the exact operands of the plan, not on the (rounded) ones of the LLM
+            x, y = operation.operands if operation is not None else (a, b)
+            with self.metrics.timer('calculate'):
+                result = self.numeric.calculate(x, y, op)
 
-                for (result, tool_call_id) in results:
-                    prompt_msg.add_tool_result_message(result, tool_call_id)
+            # With a plan, the plan decides when the calculation is complete
+            if operation is not None:
+                plan.resolve(operation.op_id, result)
+                is_final_step = plan.is_complete
+            else:
+                is_final_step = call_is_final_step
 
-            prompt_msg.add_user_message(next_prompt)
+            steps.append(StepRecord(a, b, op, result, tool_call.id))
 
-        # Fresh message history for the next iteration
-        else:
-            prompt_msg = MessageHistory()
-            prompt_msg.add_system_message(self.system_prompt)
-            prompt_msg.add_user_message(next_prompt)
+        return ToolCallResult(steps, is_final_step, '', rejected_calls)
 
-        return prompt_msg
+    def _needs_plan(self) -> bool:
+        # Exact backends take the operands of each step from the plan, the LLM only sees rounded intermediate results
+        return self.numeric.is_exact or self._needs_plan_for_prompts()
 
+    def _needs_plan_for_prompts(self) -> bool:
+        return self.prompt_token_budget is not None and self.prompt_budget_strategy == 'reduced_form'
 
+    def _create_prompt_builder(self, expression: str, plan: Optional[ExpressionPlan]) -> StepwisePromptBuilder:
+        """
+        Create the builder preparing the prompts of one run. Several variants are possible, see the config.
+        """
+        return StepwisePromptBuilder(expression, self.system_prompt, self.initial_prompt, self.subsequent_prompt,
+                                     self.reduced_prompt, self.append_messages, self.return_tool_call_msgs,
+                                     self.prompt_token_budget, self.prompt_budget_strategy, plan,
+                                     self.prompt_layout, self.steps_prompt, self.prompt_prefix,
+                                     self.numeric.precision)
@@ -1,10 +1,54 @@
-from dataclasses import dataclass
-from typing import List, Tuple
+from dataclasses import dataclass, field
+from typing import Any, List, Tuple
+
+from src.tools.numeric import DEFAULT_PRECISION, Number, format_number
+
+
+class StepRecord:
+    """
+    One performed calculation step. Slotted, since one is created per step of every expression; the text form
+    ('a op b = result') is only rendered when a prompt or a log needs it.
+    The operands are the ones proposed by the LLM, the result is calculated on the exact operands of the plan.
+    """
+    __slots__ = ('a', 'b', 'op', 'result', 'call_id')
+
+    def __init__(self, a: Number, b: Number, op: str, result: Number, call_id: str) -> None:
+        self.a = a
+        self.b = b
+        self.op = op
+        self.result = result
+        self.call_id = call_id
+
+    def text(self, precision: int = DEFAULT_PRECISION) -> str:
+        return f"{self.a} {self.op} {self.b} = {format_number(self.result, precision)}"
+
+    def to_list(self) -> List[Any]:
+        """Compact JSON form, reversed by from_list()."""
+        return [self.a, self.b, self.op, self.result, self.call_id]
+
+    @classmethod
+    def from_list(cls, data: List[Any]) -> 'StepRecord':
+        return cls(*data)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, StepRecord):
+            return NotImplemented
+        return self.to_list() == other.to_list()
+
+    def __repr__(self) -> str:
+        return f'StepRecord({self.a!r}, {self.b!r}, {self.op!r}, {self.result!r}, {self.call_id!r})'
+
+    def __str__(self) -> str:
+        return self.text()
 
 
 @dataclass
 class ToolCallResult:
-    results: List[Tuple[float, str]]    # [(result, tool_call_id)]
+    steps: List[StepRecord]   # The performed steps, in the order of the tool calls
     is_final_step: bool
-    call_steps: List[str]
     remaining_expression: str
+    rejected_calls: List[Tuple[str, str]] = field(default_factory=list)    # [(reason, tool_call_id)]
+
+    @property
+    def final_result(self) -> Number:
+        return self.steps[-1].result
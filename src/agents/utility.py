@@ -1,7 +1,7 @@
 import re
-from typing import Union
+from typing import Callable
 
-Number = Union[int, float]
+from src.tools.numeric import Number, format_number
 
 
 def validate_expression(expression: str, max_expression_length: int) -> bool:
@@ -20,15 +20,20 @@ def float_to_str(f: float) -> str:
     return f'{f: g}'
 
 
-def create_number_pattern(num: Union[int, float]) -> str:
+def create_number_pattern(num: Number, to_str: Callable[[Number], str] = format_number) -> str:
     if isinstance(num, int):
         return r'\b' + str(num) + r'\b'
     else:
         # Handle both integer and decimal representations
-        return r'\b' + float_to_str(num).replace('.', r'\.?') + r'\b'
+        return r'\b' + re.escape(to_str(num)).replace(r'\.', r'\.?') + r'\b'
 
 
-def reduce_expression(expression: str, a: Number, b: Number, op: str, result: Number) -> str:
-    pattern = create_number_pattern(a) + r'\s*' + re.escape(op) + r'\s*' + create_number_pattern(b)
-    new_expression = re.sub(pattern, float_to_str(result), expression, count=1)
+def reduce_expression(expression: str, a: Number, b: Number, op: str, result: Number,
+                      to_str: Callable[[Number], str] = format_number) -> str:
+    """
+    Replace the first occurrence of 'a op b' in the expression text by the result.
+    Numbers are written with to_str, which must round-trip exactly for the operands to be found in the text.
+    """
+    pattern = create_number_pattern(a, to_str) + r'\s*' + re.escape(op) + r'\s*' + create_number_pattern(b, to_str)
+    new_expression = re.sub(pattern, to_str(result), expression, count=1)
     return new_expression
@@ -0,0 +1,323 @@
+"""
+Evaluate a stream of expressions with a calculator agent, writing one JSON result per line as each completes.
+
+Input is read line by line from a file or stdin, as plain text (one expression per line; blank lines and lines
+starting with '#' are skipped) or JSONL ({"expression": ..., "id": ...}). Expressions flow through a bounded
+pipeline (read and validate, evaluate on a thread pool, emit), so memory use does not depend on the input size:
+at most --max-in-flight expressions are held at any time, and reading pauses while they are being evaluated.
+
+With --store, results are also appended to a columnar result store (see ColumnarResultStore), which can be
+queried and aggregated without loading the results into Python objects.
+
+Run from the repository root:
+    python -m src.cli --agent reducing expressions.txt > results.jsonl
+    python -m src.cli --agent reducing expressions.txt --store results_dir > /dev/null
+    echo "2 * (3 + 4)" | python -m src.cli --evaluation-mode local
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, Optional, TextIO, Tuple
+
+from src.agents.agent_base import CalculatorAgentBase
+from src.agents.metrics import AgentMetrics
+from src.agents.run_state import AgentRunState
+from src.agents.utility import validate_expression
+from src.config import load_config_file
+from src.llm.llm_base import AsyncLLMClientBase, LLMClientBase
+from src.tools.numeric import to_json
+
+CONFIG_FILES = {
+    'reducing': 'config/reducing_agent_config.yaml',
+    'stepwise': 'config/stepwise_agent_config.yaml',
+}
+
+INPUT_FORMATS = ('auto', 'text', 'jsonl')
+
+
+def load_config(agent_name: str, path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Load the agent config, with the API key taken from the environment variable named in the config.
+    """
+    config = load_config_file(path or CONFIG_FILES[agent_name])
+
+    config.setdefault('api_key', os.environ.get(config.get('openai_key_env_var', '')))
+    config.setdefault('tool_call_required', 'required')
+    config['verbose'] = False   # stdout carries the results
+    return config
+
+
+class UnavailableLLMClient(LLMClientBase):
+    """Stands in for the LLM when no API key is set, so that 'local' mode works offline."""
+    def run_prompt(self, msg_history):
+        raise RuntimeError('No API key set, the LLM is unavailable')
+
+
+class AsyncUnavailableLLMClient(AsyncLLMClientBase):
+    """UnavailableLLMClient for agents run with arun(), e.g. by the service."""
+    async def run_prompt(self, msg_history):
+        raise RuntimeError('No API key set, the LLM is unavailable')
+
+
+def create_agent(agent_name: str, config: Dict[str, Any], client_name: str = 'chatgpt') -> CalculatorAgentBase:
+    metrics = AgentMetrics()   # Shared by the client and the agent, for the token usage in the summary
+
+    if client_name == 'scripted':
+        from src.llm.scripted import ScriptedCalculatorClient
+        client = ScriptedCalculatorClient(parallel_steps=config.get('parallel_steps', False))
+    elif not config['api_key']:
+        if config.get('evaluation_mode', 'llm') != 'local':
+            raise SystemExit(f"No API key: set the {config.get('openai_key_env_var')} environment variable")
+        client = UnavailableLLMClient()
+    else:
+        from src.llm.routing import create_llm_client
+        client = create_llm_client(config, metrics)
+
+    if agent_name == 'stepwise':
+        from src.agents.stepwise_agent import StepwiseCalculatorAgent
+        return StepwiseCalculatorAgent(client, config, metrics=metrics)
+
+    from src.agents.reducing_agent import ReducingCalculatorAgent
+    return ReducingCalculatorAgent(client, config, metrics=metrics)
+
+
+def parse_line(line: str, input_format: str = 'auto') -> Optional[Tuple[Any, str]]:
+    """
+    Parse one input line into (id, expression), or None for lines to skip.
+    Plain text lines have no id. JSON lines must be objects with a string 'expression' field; 'id' is optional.
+    """
+    text = line.strip()
+    if not text or (input_format != 'jsonl' and text.startswith('#')):
+        return None
+
+    if input_format == 'jsonl' or (input_format == 'auto' and text.startswith('{')):
+        record = json.loads(text)
+        if not isinstance(record, dict):
+            raise ValueError(f'Expected a JSON object, got: {text}')
+        expression = record['expression']
+        if not isinstance(expression, str):
+            raise ValueError(f'expression must be a string, got: {json.dumps(expression)}')
+        return record.get('id'), expression
+
+    return None, text
+
+
+class StreamPipeline:
+    """
+    Bounded pipeline: the caller's thread reads and validates, a thread pool evaluates, and a writer thread emits
+    the results. A semaphore bounds the expressions in flight (read but not yet written), so a slow LLM applies
+    back-pressure to reading instead of growing queues. With ordered=True, results are written in input order
+    (completed results wait in a buffer, also bounded by max_in_flight).
+    """
+    def __init__(self, agent: CalculatorAgentBase, output: TextIO, max_workers: int = 8,
+                 max_in_flight: int = 64, ordered: bool = False, input_format: str = 'auto',
+                 store: Optional[Any] = None) -> None:
+        if input_format not in INPUT_FORMATS:
+            raise ValueError(f'Unsupported input format: {input_format}. '
+                             f'Supported formats are {", ".join(INPUT_FORMATS)}.')
+
+        self.agent = agent
+        self.output = output
+        self.max_workers = max_workers
+        self.ordered = ordered
+        self.input_format = input_format
+        self.store = store   # Optional ColumnarResultStore, appended to by the writer thread
+
+        self._slots = threading.BoundedSemaphore(max(max_in_flight, max_workers))
+        self._results: queue.Queue = queue.Queue()
+        self._writer_error: Optional[BaseException] = None   # Raised by run() once the writer thread is done
+
+        self.num_items = 0
+        self.num_errors = 0
+
+    def run(self, lines: Iterable[str]) -> Dict[str, Any]:
+        """
+        Process all lines and return a summary (count, errors, elapsed seconds, throughput).
+        If writing a result fails (e.g. the output is closed), reading stops and the error is raised.
+        """
+        start = time.perf_counter()
+        writer = threading.Thread(target=self._write_results, daemon=True)
+        writer.start()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for index, record in self._read(lines):
+                self._slots.acquire()   # Blocks while max_in_flight expressions are being evaluated or written
+                if self._writer_error is not None:
+                    self._slots.release()
+                    break
+                if 'error' in record:
+                    self._results.put((index, record))
+                else:
+                    executor.submit(self._evaluate, index, record)
+
+        self._results.put(None)
+        writer.join()
+        if self._writer_error is not None:
+            raise self._writer_error
+
+        elapsed = time.perf_counter() - start
+        return {
+            'count': self.num_items,
+            'errors': self.num_errors,
+            'elapsed_seconds': elapsed,
+            'expressions_per_second': self.num_items / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def _read(self, lines: Iterable[str]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Parse and validate stage: invalid lines become error records without being evaluated.
+        """
+        index = 0
+        for line in lines:
+            item_id, expression = None, line.strip()
+            try:
+                parsed = parse_line(line, self.input_format)
+                if parsed is None:
+                    continue
+                item_id, expression = parsed
+                validate_expression(expression, self.agent.max_expression_length)
+                record: Dict[str, Any] = {'index': index, 'id': item_id, 'expression': expression}
+            except (ValueError, KeyError, TypeError) as e:
+                record = {'index': index, 'id': item_id, 'expression': expression, 'error': _describe(e),
+                          'exception': e}
+
+            yield index, record
+            index += 1
+
+    def _evaluate(self, index: int, record: Dict[str, Any]) -> None:
+        # A run state counts the LLM calls of the expression, for the result store
+        state = AgentRunState(type(self.agent).__name__, record['expression']) if self.store is not None else None
+        start = time.perf_counter()
+        try:
+            if state is not None:
+                record['result'] = self.agent.run(record['expression'], state=state)
+            else:
+                record['result'] = self.agent.run(record['expression'])
+        except Exception as e:
+            record['error'] = _describe(e)
+            record['exception'] = e
+        record['latency_seconds'] = time.perf_counter() - start
+        if state is not None:
+            record['llm_calls'] = state.llm_calls
+        self._results.put((index, record))
+
+    def _write_results(self) -> None:
+        pending: Dict[int, Dict[str, Any]] = {}
+        next_index = 0
+
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+            if self._writer_error is not None:
+                self._slots.release()   # Results are dropped after a failure, but their slots must be given back
+                continue
+            index, record = item
+
+            try:
+                if not self.ordered:
+                    self._emit(record)
+                    continue
+
+                pending[index] = record
+                while next_index in pending:
+                    self._emit(pending.pop(next_index))
+                    next_index += 1
+            except Exception as e:
+                self._writer_error = e
+                for _ in pending:   # Buffered results will not be written either
+                    self._slots.release()
+                pending.clear()
+
+    def _emit(self, record: Dict[str, Any]) -> None:
+        try:
+            self._write_record(record)
+        finally:
+            self._slots.release()
+
+    def _write_record(self, record: Dict[str, Any]) -> None:
+        output: Dict[str, Any] = {'index': record['index']}
+        if record['id'] is not None:
+            output['id'] = record['id']
+        output['expression'] = record['expression']
+        output['result'] = to_json(record.get('result'))   # Exact (decimal, fraction) results as text
+        output['error'] = record.get('error')
+        if 'latency_seconds' in record:
+            output['latency_seconds'] = record['latency_seconds']
+
+        self.output.write(json.dumps(output) + '\n')
+        self.output.flush()
+        if self.store is not None:
+            self.store.append(record['expression'], record.get('result'), record.get('exception'),
+                              record.get('llm_calls'), record.get('latency_seconds'))
+
+        self.num_items += 1
+        if output['error'] is not None:
+            self.num_errors += 1
+
+
+def _describe(error: Exception) -> str:
+    return f'{type(error).__name__}: {error}'
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m src.cli', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='?', default='-', help="Input file, or '-' for stdin (default)")
+    parser.add_argument('-o', '--output', default='-', help="Output JSONL file, or '-' for stdout (default)")
+    parser.add_argument('--agent', choices=list(CONFIG_FILES), default='reducing')
+    parser.add_argument('--config', help='Config file (default: config/<agent>_agent_config.yaml)')
+    parser.add_argument('--format', choices=INPUT_FORMATS, default='auto', help='Input format')
+    parser.add_argument('--client', choices=('chatgpt', 'scripted'), default='chatgpt',
+                        help='LLM client; scripted answers offline with correct steps (for testing)')
+    parser.add_argument('--evaluation-mode', choices=('llm', 'local', 'cross_check'),
+                        help='Override evaluation_mode from the config')
+    parser.add_argument('--workers', type=int, help='Evaluation threads (default: max_workers from the config)')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='Max expressions read but not yet written')
+    parser.add_argument('--ordered', action='store_true', help='Write results in input order')
+    parser.add_argument('--summary', action='store_true', help='Print a summary to stderr when done')
+    parser.add_argument('--store', help='Also append the results to the columnar result store in this directory')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.agent, args.config)
+    if args.evaluation_mode:
+        config['evaluation_mode'] = args.evaluation_mode
+    agent = create_agent(args.agent, config, args.client)
+
+    store = None
+    if args.store:
+        from src.agents.result_store import ColumnarResultStore   # Optional dependency (numpy)
+        store = ColumnarResultStore(args.store)
+
+    input_file = sys.stdin if args.input == '-' else open(args.input)
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        pipeline = StreamPipeline(agent, output_file, max_workers=args.workers or agent.max_workers,
+                                  max_in_flight=args.max_in_flight, ordered=args.ordered, input_format=args.format,
+                                  store=store)
+        summary = pipeline.run(input_file)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+        if store is not None:
+            store.close()
+        agent.close()
+
+    if args.summary:
+        for name in ('prompt_tokens', 'cached_prompt_tokens', 'completion_tokens'):
+            if name in agent.metrics.counters:
+                summary[name] = agent.metrics.counters[name]
+        print(json.dumps(summary), file=sys.stderr)
+
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Loading of the agent config files.
+
+Parsing the YAML configs (and importing yaml) takes far longer than the rest of a short CLI run's startup, so a
+config is parsed and validated only once per version of the file: the result is kept in memory, and compiled with
+marshal (the serialization of Python bytecode files, built in and fast to load) to a __pycache__ directory next to
+the file. Both are keyed on the modification time and size of the file, so edits are picked up. The cached config
+itself is frozen: every call returns a new copy, which callers are free to modify.
+"""
+import marshal
+import os
+from typing import Any, Dict, Optional, Tuple
+
+COMPILED_CONFIG_VERSION = 1
+
+REQUIRED_KEYS = ('model', 'max_llm_calls', 'max_expression_length', 'tool_definitions')
+
+# path -> (mtime_ns, size, marshaled config)
+_compiled: Dict[str, Tuple[int, int, bytes]] = {}
+
+
+def load_config_file(path: str) -> Dict[str, Any]:
+    """
+    Load and validate a config file, from the compiled cache when the file has not changed.
+
+    :param path: Path of a YAML config file
+    :return: The config, as a new dict
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _compiled.get(path)
+    if cached is None or cached[:2] != version:
+        data = _read_compiled(path, version)
+        if data is None:
+            data = _compile(path)
+            _write_compiled(path, version, data)
+        cached = (*version, data)
+        _compiled[path] = cached
+
+    return marshal.loads(cached[2])
+
+
+def validate_config(config: Any, path: str = '<config>') -> None:
+    """
+    Check the structure shared by all agent configs; the agents validate the values of their own options.
+    """
+    if not isinstance(config, dict):
+        raise ValueError(f'{path}: expected a mapping at the top level, got {type(config).__name__}')
+
+    missing = [key for key in REQUIRED_KEYS if key not in config]
+    if missing:
+        raise ValueError(f'{path}: missing required keys: {", ".join(missing)}')
+
+    for key in ('max_llm_calls', 'max_expression_length'):
+        if not isinstance(config[key], int) or config[key] < 1:
+            raise ValueError(f'{path}: {key} must be a positive integer, got {config[key]!r}')
+
+    if 'system_prompt' not in config and 'parallel_steps_system_prompt' not in config:
+        raise ValueError(f'{path}: missing the system prompt')
+
+
+def compiled_path(path: str) -> str:
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, '__pycache__', f'{name}.marshal')
+
+
+def clear_cache() -> None:
+    """Forget the configs loaded by this process (the compiled files are kept)."""
+    _compiled.clear()
+
+
+def _compile(path: str) -> bytes:
+    import yaml   # Only needed when the compiled config is missing or out of date
+
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)   # The libyaml parser, if available
+    with open(path) as f:
+        config = yaml.load(f, Loader=loader)
+
+    validate_config(config, path)
+    try:
+        return marshal.dumps(config)
+    except ValueError:
+        raise ValueError(f'{path}: only plain values (mappings, lists, strings, numbers, booleans, null) '
+                         f'are supported') from None
+
+
+def _read_compiled(path: str, version: Tuple[int, int]) -> Optional[bytes]:
+    try:
+        with open(compiled_path(path), 'rb') as f:
+            header, data = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return data if header == (COMPILED_CONFIG_VERSION, *version) else None
+
+
+def _write_compiled(path: str, version: Tuple[int, int], data: bytes) -> None:
+    """Write the compiled config atomically; failures (e.g. a read-only directory) only cost the cache."""
+    target = compiled_path(path)
+    tmp_path = f'{target}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(((COMPILED_CONFIG_VERSION, *version), data), f)
+        os.replace(tmp_path, target)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
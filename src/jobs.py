@@ -0,0 +1,193 @@
+"""
+Evaluate large corpora with several worker processes sharing a durable job queue.
+
+Expressions are added to a SQLite queue in a directory, then evaluated by worker processes, each with its own warm
+LLM client and agent (and a thread pool of max_workers for concurrent LLM calls). Workers lease jobs from the
+queue as they go, so the work is spread over them dynamically; more workers can join at any time, also from other
+hosts pointing at the same directory (set jobs.journal_mode to 'delete' for network file systems). A job whose
+worker dies is leased again when its lease expires (at-least-once); a duplicate completion does not overwrite the
+first result. Interrupted runs are resumed by starting the workers again.
+
+Run from the repository root:
+    python -m src.jobs enqueue queue_dir expressions.txt
+    python -m src.jobs work queue_dir --processes 8 --agent reducing
+    python -m src.jobs status queue_dir
+    python -m src.jobs export queue_dir -o results.jsonl   # With the input ids of each expression
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.agents.job_queue import Job, JobQueue
+from src.agents.run_state import AgentRunState
+from src.cli import CONFIG_FILES, create_agent, load_config, parse_line
+from src.tools.numeric import to_json
+
+
+def open_queue(directory: str, config: Dict[str, Any]) -> JobQueue:
+    jobs_config = config.get('jobs') or {}
+    return JobQueue(directory, lease_seconds=jobs_config.get('lease_seconds', 300.0),
+                    max_attempts=jobs_config.get('max_attempts', 3),
+                    journal_mode=jobs_config.get('journal_mode', 'wal'))
+
+
+def read_expressions(lines: Iterable[str], input_format: str = 'auto') -> Iterator[Tuple[Any, str]]:
+    """
+    (input id, expression) of each record; the id is None for plain text input and JSONL records without one.
+    A record that cannot be parsed (see parse_line()) raises a ValueError naming its line.
+    """
+    for line_number, line in enumerate(lines, 1):
+        try:
+            parsed = parse_line(line, input_format)
+        except (ValueError, KeyError) as e:
+            raise ValueError(f'Line {line_number}: {type(e).__name__}: {e}') from e
+        if parsed is not None:
+            yield parsed
+
+
+def run_job(agent: Any, job: Job) -> Tuple[Any, Optional[Exception], int, float]:
+    """
+    Evaluate one job: (result, error, LLM calls, latency).
+    """
+    state = AgentRunState(type(agent).__name__, job.expression)
+    start = time.perf_counter()
+    try:
+        result, error = agent.run(job.expression, state=state), None
+    except Exception as e:
+        result, error = None, e
+    return result, error, state.llm_calls, time.perf_counter() - start
+
+
+def work(queue_dir: str, agent_name: str = 'reducing', config_path: Optional[str] = None,
+         client_name: str = 'chatgpt', max_jobs: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Worker loop: lease jobs and evaluate them until the queue has no pending or leased jobs left.
+
+    :param max_jobs: Stop after this many jobs (None: until the queue is drained)
+    :return: Counts of the jobs this worker completed, failed, released for retry, and completed twice
+    """
+    config = load_config(agent_name, config_path)
+    agent = create_agent(agent_name, config, client_name)
+    queue = open_queue(queue_dir, config)
+    poll_interval = (config.get('jobs') or {}).get('poll_interval', 1.0)
+
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    summary = {'worker': worker, 'completed': 0, 'failed': 0, 'retried': 0, 'duplicates': 0}
+    processed = 0
+
+    with ThreadPoolExecutor(max_workers=agent.max_workers) as executor:
+        while max_jobs is None or processed < max_jobs:
+            batch_size = agent.max_workers if max_jobs is None else min(agent.max_workers, max_jobs - processed)
+            jobs = queue.lease(worker, batch_size)
+            if not jobs:
+                counts = queue.counts()
+                if not counts['pending'] and not counts['leased']:
+                    break
+                time.sleep(poll_interval)   # Jobs leased by other workers may still come back
+                continue
+
+            outcomes = executor.map(lambda job: run_job(agent, job), jobs)
+            for job, (result, error, llm_calls, latency) in zip(jobs, outcomes):
+                if error is None:
+                    summary['completed' if queue.complete(job, result, llm_calls, latency) else 'duplicates'] += 1
+                    continue
+
+                # Invalid expressions and arithmetic errors would fail again; API errors and the like are retried
+                retry = not isinstance(error, (ValueError, ArithmeticError))
+                queue.fail(job, f'{type(error).__name__}: {error}', retry, latency)
+                summary['retried' if retry and job.attempts < queue.max_attempts else 'failed'] += 1
+            processed += len(jobs)
+
+    agent.close()
+    queue.close()
+    return summary
+
+
+def run_workers(queue_dir: str, processes: int, agent_name: str = 'reducing', config_path: Optional[str] = None,
+                client_name: str = 'chatgpt') -> List[Dict[str, Any]]:
+    """
+    Run work() in the given number of worker processes and wait for the queue to be drained.
+    """
+    if processes < 1:
+        raise ValueError(f'processes must be at least 1, got {processes}')
+
+    # Fresh interpreters: no state (open connections, threads) is inherited from the parent
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        futures = [executor.submit(work, queue_dir, agent_name, config_path, client_name) for _ in range(processes)]
+        return [future.result() for future in futures]
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m src.jobs', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--agent', choices=list(CONFIG_FILES), default='reducing')
+    parser.add_argument('--config', help='Config file (default: config/<agent>_agent_config.yaml)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='Add the expressions of a file (or stdin) to the queue')
+    enqueue.add_argument('queue_dir')
+    enqueue.add_argument('input', nargs='?', default='-', help="Input file, or '-' for stdin (default)")
+    enqueue.add_argument('--format', choices=('auto', 'text', 'jsonl'), default='auto', help='Input format')
+
+    work_command = commands.add_parser('work', help='Evaluate the queued jobs')
+    work_command.add_argument('queue_dir')
+    work_command.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    work_command.add_argument('--client', choices=('chatgpt', 'scripted'), default='chatgpt',
+                              help='LLM client; scripted answers offline with correct steps (for testing)')
+
+    status = commands.add_parser('status', help='Print the number of jobs per status')
+    status.add_argument('queue_dir')
+
+    export = commands.add_parser('export', help='Write the results of the finished jobs as JSON lines')
+    export.add_argument('queue_dir')
+    export.add_argument('-o', '--output', default='-', help="Output JSONL file, or '-' for stdout (default)")
+
+    args = parser.parse_args(argv)
+    config = load_config(args.agent, args.config)
+
+    if args.command == 'work':
+        for summary in run_workers(args.queue_dir, args.processes, args.agent, args.config, args.client):
+            print(json.dumps(summary), file=sys.stderr)
+        args.command = 'status'
+
+    queue = open_queue(args.queue_dir, config)
+    try:
+        if args.command == 'enqueue':
+            input_file = sys.stdin if args.input == '-' else open(args.input)
+            try:
+                added = queue.enqueue(read_expressions(input_file, args.format))
+            except ValueError as e:   # Nothing was enqueued
+                print(f'Invalid input: {e}', file=sys.stderr)
+                return 1
+            finally:
+                if input_file is not sys.stdin:
+                    input_file.close()
+            print(json.dumps({'added': added, **queue.counts()}))
+
+        elif args.command == 'status':
+            print(json.dumps(queue.counts()))
+
+        elif args.command == 'export':
+            output_file = sys.stdout if args.output == '-' else open(args.output, 'w')
+            try:
+                for record in queue.results():
+                    record['result'] = to_json(record['result'])
+                    output_file.write(json.dumps(record) + '\n')
+            finally:
+                if output_file is not sys.stdout:
+                    output_file.close()
+    finally:
+        queue.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
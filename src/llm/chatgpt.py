@@ -1,68 +1,150 @@
-import openai
-import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Union, Literal
 
-from src.llm.llm_base import LLMClientBase
+from src.llm.llm_base import LLMClientBase, AsyncLLMClientBase
+# The message types live in the lightweight messages module (no openai import); re-exported here for existing imports
+from src.llm.messages import (MessageHistory, PromptPrefix, estimate_message_tokens, estimate_tokens,
+                              tool_result_content)
+from src.llm.resilience import LatencyTracker, RetryPolicy, acall_hedged, call_hedged, create_http_client
 
 
-class MessageHistory:
-    def __init__(self, messages: Optional[List[Any]] = None) -> None:
-        self.messages = messages or []
+class ChatGPTError(Exception):
+    """Base class for ChatGPT client errors."""
+    pass
 
-    def add_system_message(self, content: str) -> None:
-        self.messages.append({"role": "system", "content": content})
 
-    def add_user_message(self, content: str) -> None:
-        self.messages.append({"role": "user", "content": content})
+class _ChatGPTClientBase:
+    """
+    Configuration shared by the sync and async ChatGPT clients: the SDK client with a pooled HTTP connection,
+    retry of transient failures and hedging, configured by the 'http' section of the config.
+    """
+    def __init__(self, config: dict, metrics: Optional[Any], async_client: bool) -> None:
+        import openai   # Imported on first use, so that offline clients and local mode never load the SDK
 
-    def add_assistant_message(self, content: str) -> None:
-        self.messages.append({"role": "assistant", "content": content})
+        http_config: dict = config.get('http') or {}
 
-    def add_tool_result_message(self, result: Union[int, float], tool_call_id: str) -> None:
-        self.messages.append({
-            "role": "tool",
-            "content": json.dumps({"result": result}),
-            "tool_call_id": tool_call_id
-        })
+        # Retries are done by the RetryPolicy below, not by the openai package
+        client_class = openai.AsyncOpenAI if async_client else openai.OpenAI
+        self.client = client_class(api_key=config['api_key'], base_url=http_config.get('base_url') or None,
+                                   http_client=create_http_client(http_config, async_client=async_client),
+                                   max_retries=0)
+        self.metrics = metrics   # Optional AgentMetrics, receives the token usage of each completion
 
-    def add_generic_message(self, msg: Any) -> None:
-        self.messages.append(msg)
+        self.model: str = config['model']
+        self.tool_definitions: List[Dict] = config['tool_definitions']
+        self.tool_call_required: Literal['none', 'auto', 'required'] = config['tool_call_required']
 
-    def get_messages(self):
-        return self.messages
+        # Requests sharing a static prefix are routed to the same provider-side prompt cache
+        self.prompt_cache_key: Any = config.get('prompt_cache_key') or openai.NOT_GIVEN
 
-    # def __str__(self):
-    #     return str(self.messages)
+        # In parallel step mode the model may return several independent calculate calls per response
+        self.parallel_tool_calls: bool = config.get('parallel_steps', False)
 
-    def __repr__(self) -> str:
-        return str(self.messages)
+        self.retry_policy = RetryPolicy.from_config(http_config)
 
+        # Hedging: a duplicate request is sent when a request takes longer than the p95 latency
+        self.hedge: bool = http_config.get('hedge', False)
+        self.latency_tracker = LatencyTracker(min_samples=http_config.get('hedge_min_samples', 20))
 
-class ChatGPTError(Exception):
-    """Base class for ChatGPT client errors."""
-    pass
+    def _completion_args(self, msg_history: MessageHistory) -> Dict[str, Any]:
+        import openai
 
+        return dict(
+            model=self.model,
+            messages=msg_history.get_messages(),
+            tools=self.tool_definitions,
+            tool_choice=self.tool_call_required,
+            parallel_tool_calls=True if self.parallel_tool_calls else openai.NOT_GIVEN,
+            prompt_cache_key=self.prompt_cache_key,
+        )
 
-class ChatGPTClient(LLMClientBase):
-    def __init__(self, config: dict):
-        self.client = openai.OpenAI(api_key=config['api_key'])
+    def _response(self, completion: Any) -> Any:
+        if self.metrics is not None and getattr(completion, 'usage', None) is not None:
+            self.metrics.record_usage(completion.usage)
+        return completion.choices[0].message
 
-        self.model: str = config['model']
-        self.tool_definitions: List[Dict] = config['tool_definitions']
-        self.tool_call_required: Literal['none', 'auto', 'required'] = config['tool_call_required']
+    def _on_retry(self, error: Exception, delay: float) -> None:
+        if self.metrics is not None:
+            self.metrics.increment('llm_retries')
+
+    def _on_hedge(self) -> None:
+        if self.metrics is not None:
+            self.metrics.increment('llm_hedges')
+
+
+class ChatGPTClient(_ChatGPTClientBase, LLMClientBase):
+    """
+    Client of the chat completions API, with a pooled HTTP connection, retry of transient failures
+    (honoring Retry-After) and optional hedging of slow requests, configured by the 'http' section of the config.
+    """
+    def __init__(self, config: dict, metrics: Optional[Any] = None):
+        super().__init__(config, metrics, async_client=False)
+
+        http_config: dict = config.get('http') or {}
+        self._hedge_executor = ThreadPoolExecutor(max_workers=http_config.get('max_connections', 100),
+                                                  thread_name_prefix='llm-hedge') if self.hedge else None
+
+    def close(self) -> None:
+        """Release the hedging threads and the pooled connections."""
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)   # A slower duplicate request may still be finishing
+        self.client.close()
 
     def run_prompt(self, msg_history: MessageHistory) -> Any:
+        import openai
+
+        try:
+            completion = self.retry_policy.call(lambda: self._hedged_request(msg_history), on_retry=self._on_retry)
+        except openai.OpenAIError as e:
+            raise ChatGPTError(f"API error: {str(e)}") from e
+        except Exception as e:
+            raise ChatGPTError(f"Unexpected error: {str(e)}") from e
+
+        return self._response(completion)
+
+    def _hedged_request(self, msg_history: MessageHistory) -> Any:
+        delay = self.latency_tracker.hedge_delay() if self.hedge else None
+        return call_hedged(lambda: self._request(msg_history), delay, self._hedge_executor, on_hedge=self._on_hedge)
+
+    def _request(self, msg_history: MessageHistory) -> Any:
+        start = time.perf_counter()
+        completion = self.client.chat.completions.create(**self._completion_args(msg_history))
+        self.latency_tracker.observe(time.perf_counter() - start)
+        return completion
+
+
+class AsyncChatGPTClient(_ChatGPTClientBase, AsyncLLMClientBase):
+    """
+    Non-blocking counterpart of ChatGPTClient, backed by openai.AsyncOpenAI.
+    A single instance can serve many concurrent agent runs on one event loop.
+    """
+    def __init__(self, config: dict, metrics: Optional[Any] = None):
+        super().__init__(config, metrics, async_client=True)
+
+    async def aclose(self) -> None:
+        """Release the pooled connections."""
+        await self.client.close()
+
+    async def run_prompt(self, msg_history: MessageHistory) -> Any:
+        import openai
+
         try:
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=msg_history.get_messages(),
-                tools=self.tool_definitions,
-                tool_choice=self.tool_call_required,
-            )
+            completion = await self.retry_policy.acall(lambda: self._hedged_request(msg_history),
+                                                       on_retry=self._on_retry)
         except openai.OpenAIError as e:
             raise ChatGPTError(f"API error: {str(e)}") from e
         except Exception as e:
             raise ChatGPTError(f"Unexpected error: {str(e)}") from e
 
-        response = completion.choices[0].message
-        return response
+        return self._response(completion)
+
+    async def _hedged_request(self, msg_history: MessageHistory) -> Any:
+        delay = self.latency_tracker.hedge_delay() if self.hedge else None
+        return await acall_hedged(lambda: self._request(msg_history), delay, on_hedge=self._on_hedge)
+
+    async def _request(self, msg_history: MessageHistory) -> Any:
+        start = time.perf_counter()
+        completion = await self.client.chat.completions.create(**self._completion_args(msg_history))
+        self.latency_tracker.observe(time.perf_counter() - start)
+        return completion
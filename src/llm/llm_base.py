@@ -6,3 +6,34 @@ class LLMClientBase(ABC):
     def run_prompt(self, msg_history):
         """Abstract method that should be implemented by child classes to run a prompt."""
         pass
+
+    def close(self):
+        """Release the threads and connections of the client, if it has any."""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncLLMClientBase(ABC):
+    @abstractmethod
+    async def run_prompt(self, msg_history):
+        """Abstract coroutine that should be implemented by child classes to run a prompt without blocking."""
+        pass
+
+    def close(self):
+        """Release the threads of the client, if it has any."""
+        pass
+
+    async def aclose(self):
+        """Release the threads and connections of the client, if it has any; connections are closed on the loop."""
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
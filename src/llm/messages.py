@@ -0,0 +1,165 @@
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from src.tools.numeric import Number, format_number
+
+
+CHARS_PER_TOKEN = 4   # Rough average for English text and numbers with OpenAI tokenizers
+MESSAGE_OVERHEAD_TOKENS = 4   # Role and separators added by the chat format
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token count estimate, good enough for budgeting prompt sizes."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_message_tokens(msg: Any) -> int:
+    """
+    Estimate the tokens of a message, either a dict or a message object returned by the API (with tool calls).
+    """
+    if isinstance(msg, dict):
+        return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(msg.get('content') or '')
+
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(getattr(msg, 'content', None) or '')
+    for tool_call in getattr(msg, 'tool_calls', None) or []:
+        tokens += estimate_tokens(tool_call.function.name) + estimate_tokens(tool_call.function.arguments)
+    return tokens
+
+
+def tool_result_content(result: Number) -> str:
+    """JSON content of a tool result message. Exact (Decimal, Fraction) results are written as JSON numbers too."""
+    if isinstance(result, (int, float)):
+        return json.dumps({"result": result})
+    return f'{{"result": {format_number(result)}}}'
+
+
+class PromptPrefix:
+    """
+    Static leading messages (e.g. the system prompt) shared by every prompt of an agent, built once with their
+    token counts. Every prompt starts with the very same message objects, so the serialized prefix is
+    byte-identical across calls and expressions, as provider-side prompt caching requires.
+    The shared message dicts must never be modified.
+    """
+    def __init__(self, messages: List[Dict[str, Any]]) -> None:
+        self.messages = tuple(messages)
+        self.token_counts = tuple(estimate_message_tokens(msg) for msg in self.messages)
+
+    def history(self) -> 'MessageHistory':
+        """A new history starting with the prefix messages."""
+        return MessageHistory.from_prefix(self)
+
+
+class MessageHistory:
+    def __init__(self, messages: Optional[List[Any]] = None) -> None:
+        self.messages = messages or []
+        self.token_counts: List[int] = [estimate_message_tokens(msg) for msg in self.messages]   # Per message
+
+    @classmethod
+    def from_prefix(cls, prefix: PromptPrefix) -> 'MessageHistory':
+        history = cls.__new__(cls)
+        history.messages = list(prefix.messages)
+        history.token_counts = list(prefix.token_counts)
+        return history
+
+    def _append(self, msg: Any) -> None:
+        self.messages.append(msg)
+        self.token_counts.append(estimate_message_tokens(msg))
+
+    def add_system_message(self, content: str) -> None:
+        self._append({"role": "system", "content": content})
+
+    def add_user_message(self, content: str) -> None:
+        self._append({"role": "user", "content": content})
+
+    def add_assistant_message(self, content: str) -> None:
+        self._append({"role": "assistant", "content": content})
+
+    def add_tool_result_message(self, result: Number, tool_call_id: str) -> None:
+        self._append({
+            "role": "tool",
+            "content": tool_result_content(result),
+            "tool_call_id": tool_call_id
+        })
+
+    def add_tool_error_message(self, error: str, tool_call_id: str) -> None:
+        self._append({
+            "role": "tool",
+            "content": json.dumps({"error": error}),
+            "tool_call_id": tool_call_id
+        })
+
+    def add_generic_message(self, msg: Any) -> None:
+        self._append(msg)
+
+    def insert_message(self, index: int, msg: Any) -> None:
+        self.messages.insert(index, msg)
+        self.token_counts.insert(index, estimate_message_tokens(msg))
+
+    def remove_messages(self, start: int, end: int) -> None:
+        """Remove the messages in [start, end)."""
+        del self.messages[start:end]
+        del self.token_counts[start:end]
+
+    def get_messages(self):
+        return self.messages
+
+    @property
+    def total_tokens(self) -> int:
+        """Estimated prompt size of the whole history."""
+        return sum(self.token_counts)
+
+    # def __str__(self):
+    #     return str(self.messages)
+
+    def __repr__(self) -> str:
+        return str(self.messages)
+
+
+@dataclass
+class FunctionCall:
+    name: str
+    arguments: str   # JSON encoded arguments, as returned by the API
+
+
+@dataclass
+class ToolCall:
+    id: str
+    function: FunctionCall
+    type: str = 'function'
+
+
+@dataclass
+class AssistantMessage:
+    """
+    Minimal stand-in for the message object returned by the chat completions API,
+    used by the offline clients (replayed and scripted responses).
+    """
+    content: Optional[str] = None
+    tool_calls: List[ToolCall] = field(default_factory=list)
+    role: str = 'assistant'
+
+
+def message_to_dict(msg: Any) -> Dict[str, Any]:
+    """
+    Plain dict form of a message: either a dict already, or a message object returned by the API or an offline client.
+    """
+    if isinstance(msg, dict):
+        return msg
+
+    result: Dict[str, Any] = {'role': getattr(msg, 'role', 'assistant'), 'content': getattr(msg, 'content', None)}
+    tool_calls = getattr(msg, 'tool_calls', None)
+    if tool_calls:
+        result['tool_calls'] = [{
+            'id': tool_call.id,
+            'type': getattr(tool_call, 'type', 'function'),
+            'function': {'name': tool_call.function.name, 'arguments': tool_call.function.arguments},
+        } for tool_call in tool_calls]
+    return result
+
+
+def message_from_dict(data: Dict[str, Any]) -> AssistantMessage:
+    tool_calls = [ToolCall(tool_call['id'], FunctionCall(tool_call['function']['name'], tool_call['function']['arguments']),
+                           tool_call.get('type', 'function'))
+                  for tool_call in data.get('tool_calls') or []]
+    return AssistantMessage(data.get('content'), tool_calls, data.get('role', 'assistant'))
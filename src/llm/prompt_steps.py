@@ -0,0 +1,106 @@
+import json
+import re
+from typing import Any, List, Optional
+
+from src.tools.expression_parser import ExpressionSyntaxError
+from src.tools.expression_plan import ExpressionPlan, Number
+
+# A calculation step as listed in the prompts of the stepwise agent: 'a op b = result'
+STEP_PATTERN = re.compile(r'^\s*(\S+) ([-+*/]) (\S+) = (\S+)\s*$', re.MULTILINE)
+
+# Candidate expressions: runs of the characters allowed in an expression
+EXPRESSION_PATTERN = re.compile(r'[\d\s+\-*/().]+')
+
+TOOL_CALL_ARGUMENTS = ('a', 'b', 'op', 'is_final_step')
+
+
+def _to_number(text: str) -> Number:
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def last_user_message(msg_history: Any) -> str:
+    """
+    Content of the last user turn. Consecutive user messages (e.g. the initial prompt followed by the steps prompt
+    of the prefix_cache layout) are joined.
+    """
+    contents: List[str] = []
+    for msg in reversed(msg_history.get_messages()):
+        if isinstance(msg, dict) and msg.get('role') == 'user':
+            contents.append(msg['content'])
+        elif contents:
+            break
+    return '\n'.join(reversed(contents))
+
+
+def plan_from_prompt(prompt: str) -> Optional[ExpressionPlan]:
+    """
+    Recover the state of the calculation from a prompt of either agent: the expression in the prompt is parsed,
+    and the steps already listed in it (stepwise agent) are resolved.
+
+    :return: The plan, or None if no expression could be parsed from the prompt
+    """
+    steps = STEP_PATTERN.findall(prompt)
+    text = STEP_PATTERN.sub('', prompt)
+
+    plan = None
+    candidates = sorted((m.strip().rstrip('.').strip() for m in EXPRESSION_PATTERN.findall(text)),
+                        key=len, reverse=True)
+    for candidate in candidates:
+        if not re.search(r'\d', candidate):
+            continue
+        try:
+            plan = ExpressionPlan.from_expression(candidate)
+            break
+        except (ExpressionSyntaxError, ZeroDivisionError):
+            continue
+
+    if plan is None:
+        return None
+
+    for (a, op, b, result) in steps:
+        try:
+            operation = plan.match(_to_number(a), _to_number(b), op)
+            if operation is not None:
+                plan.resolve(operation.op_id, _to_number(result))
+        except ValueError:
+            continue
+
+    return plan
+
+
+def check_tool_calls(tool_calls: Optional[List[Any]], plan: Optional[ExpressionPlan] = None) -> Optional[str]:
+    """
+    Check the tool calls of a response, as the agents will process them: the arguments must be valid JSON with
+    all calculate arguments, and (given the plan of the prompt) every step must be a valid next operation.
+
+    :return: Why the response is invalid, or None if it is valid
+    """
+    if not tool_calls:
+        return 'no tool call'
+
+    claimed = set()
+    for tool_call in tool_calls:
+        arguments = tool_call.function.arguments
+        try:
+            args = json.loads(arguments)
+        except (TypeError, ValueError):
+            return f'invalid arguments: {arguments}'
+        if not isinstance(args, dict) or any(name not in args for name in TOOL_CALL_ARGUMENTS):
+            return f'invalid arguments: {arguments}'
+        a, b, op = args['a'], args['b'], args['op']
+
+        if plan is None:
+            continue
+
+        try:
+            operation = plan.match(a, b, op)
+        except TypeError:
+            return f'invalid operands: {a} {op} {b}'
+        if operation is None or operation.op_id in claimed:
+            return f'{a} {op} {b} is not a valid next step'
+        claimed.add(operation.op_id)
+
+    return None
@@ -0,0 +1,305 @@
+import asyncio
+import collections
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Optional
+
+from src.llm.llm_base import AsyncLLMClientBase, LLMClientBase
+
+# Priority classes, most urgent first. A class is only served while all more urgent classes are empty.
+PRIORITIES = {'interactive': 0, 'default': 1, 'batch': 2}
+
+
+class TokenBucket:
+    """
+    Budget refilled continuously at rate_per_minute, holding at most capacity. Not thread-safe on its own.
+    """
+    def __init__(self, rate_per_minute: float, capacity: float, now: float) -> None:
+        self.rate = rate_per_minute / 60.0   # Per second
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until amount is available (after refill())."""
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def consume(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)   # Requests larger than the bucket only have to wait for a full one
+
+
+class _Request:
+    __slots__ = ('tokens', 'tenant', 'priority', 'enqueued', 'granted', 'wake')
+
+    def __init__(self, tokens: float, tenant: str, priority: int, enqueued: float,
+                 wake: Optional[Callable[[], None]] = None) -> None:
+        self.tokens = tokens
+        self.tenant = tenant
+        self.priority = priority
+        self.enqueued = enqueued
+        self.granted = False
+        self.wake = wake   # Async waiters: resolves their future from the granting thread
+
+
+class RateLimitScheduler:
+    """
+    Admission of LLM calls within requests-per-minute and tokens-per-minute budgets (token buckets), shared by all
+    the clients using one API key, so that bursts are spread out instead of being answered with 429 errors.
+    Waiting calls are served by priority class, and round robin across tenants (e.g. batches or users) within a
+    class, so one large batch cannot starve the others. Within a tenant, calls are served in arrival order, and a
+    call waits for the budget of the one ahead of it, so large prompts are not overtaken indefinitely.
+    Both threads (acquire) and coroutines (aacquire) can wait on the same scheduler.
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 burst_seconds: float = 10.0, metrics: Optional[Any] = None,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        self.metrics = metrics
+        now = clock()
+
+        # The buckets hold burst_seconds worth of their per-minute budget
+        self.request_bucket = TokenBucket(requests_per_minute, max(1.0, requests_per_minute * burst_seconds / 60),
+                                          now) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute, max(1.0, tokens_per_minute * burst_seconds / 60),
+                                        now) if tokens_per_minute else None
+
+        # priority -> tenant -> waiting requests; tenants rotate to the end after being served
+        self._queues: Dict[int, 'collections.OrderedDict[str, Deque[_Request]]'] = {}
+        self._lock = threading.Lock()
+        self._granted = threading.Condition(self._lock)
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.num_granted = 0
+        self.num_waited = 0   # Calls that could not start immediately
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def acquire(self, tokens: float = 0, tenant: str = 'default', priority: str = 'default') -> float:
+        """
+        Block until a call of the given estimated tokens may start.
+
+        :return: Seconds waited
+        """
+        request = self._enqueue(tokens, tenant, priority)
+        try:
+            with self._lock:
+                while True:
+                    wait = self._dispatch()
+                    if request.granted:
+                        break
+                    self._granted.wait(timeout=wait)
+        finally:
+            self._cancel(request)
+        return self.clock() - request.enqueued
+
+    async def aacquire(self, tokens: float = 0, tenant: str = 'default', priority: str = 'default') -> float:
+        """
+        Coroutine version of acquire(): waits without blocking the event loop.
+
+        :return: Seconds waited
+        """
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        request = self._enqueue(tokens, tenant, priority, wake)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._dispatch()
+                    if request.granted:
+                        break
+                try:
+                    await asyncio.wait_for(asyncio.shield(granted), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._cancel(request)
+        return self.clock() - request.enqueued
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'granted': self.num_granted,
+                'waited': self.num_waited,
+                'mean_wait_seconds': self.wait_seconds / self.num_granted if self.num_granted else 0.0,
+                'max_wait_seconds': self.max_wait_seconds,
+            }
+
+    def _enqueue(self, tokens: float, tenant: str, priority: str,
+                 wake: Optional[Callable[[], None]] = None) -> _Request:
+        if priority not in PRIORITIES:
+            raise ValueError(f'Unsupported priority: {priority}. Supported priorities are {", ".join(PRIORITIES)}.')
+
+        request = _Request(tokens, tenant, PRIORITIES[priority], self.clock(), wake)
+        with self._lock:
+            tenants = self._queues.setdefault(request.priority, collections.OrderedDict())
+            tenants.setdefault(tenant, collections.deque()).append(request)
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        self._set_gauge()
+        return request
+
+    def _cancel(self, request: _Request) -> None:
+        """Remove a request that stopped waiting without being granted (e.g. a cancelled coroutine)."""
+        if request.granted:
+            return
+        with self._lock:
+            if request.granted:
+                return
+            tenants = self._queues[request.priority]
+            tenants[request.tenant].remove(request)
+            if not tenants[request.tenant]:
+                del tenants[request.tenant]
+            self.queue_depth -= 1
+        self._set_gauge()
+
+    def _dispatch(self) -> Optional[float]:
+        """
+        Grant the waiting requests the budgets allow, in priority and round robin order (with the lock held).
+
+        :return: Seconds until the next request can be granted, or None if none is waiting
+        """
+        now = self.clock()
+        for bucket in (self.request_bucket, self.token_bucket):
+            if bucket is not None:
+                bucket.refill(now)
+
+        granted_any = False
+        while True:
+            request = self._next_request()
+            if request is None:
+                wait = None
+                break
+
+            wait = max(self.request_bucket.time_until(1) if self.request_bucket else 0.0,
+                       self.token_bucket.time_until(request.tokens) if self.token_bucket else 0.0)
+            if wait > 0:
+                break
+
+            if self.request_bucket:
+                self.request_bucket.consume(1)
+            if self.token_bucket:
+                self.token_bucket.consume(request.tokens)
+            self._grant(request, now)
+            granted_any = True
+
+        if granted_any:
+            self._granted.notify_all()
+            self._set_gauge()
+        return wait
+
+    def _next_request(self) -> Optional[_Request]:
+        for priority in sorted(self._queues):
+            tenants = self._queues[priority]
+            if tenants:
+                return next(iter(tenants.values()))[0]
+        return None
+
+    def _grant(self, request: _Request, now: float) -> None:
+        tenants = self._queues[request.priority]
+        queue = tenants[request.tenant]
+        queue.popleft()
+        if queue:
+            tenants.move_to_end(request.tenant)   # Round robin: the other tenants of this class go first
+        else:
+            del tenants[request.tenant]
+
+        request.granted = True
+        self.queue_depth -= 1
+        self.num_granted += 1
+
+        wait = now - request.enqueued
+        if wait > 0:
+            self.num_waited += 1
+        self.wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        if self.metrics is not None:
+            self.metrics.observe('rate_limit_wait', wait)
+
+        if request.wake is not None:
+            request.wake()
+
+    def _set_gauge(self) -> None:
+        if self.metrics is not None:
+            self.metrics.set_gauge('rate_limit_queue_depth', self.queue_depth)
+
+
+class RateLimitedClient(LLMClientBase):
+    """
+    Waits for the shared rate-limit budget before each call of the wrapped client. The tokens of a call are
+    estimated from the prompt, plus the expected completion tokens.
+    """
+    def __init__(self, client: LLMClientBase, scheduler: RateLimitScheduler, completion_tokens: int = 100,
+                 tenant: str = 'default', priority: str = 'default') -> None:
+        self.client = client
+        self.scheduler = scheduler
+        self.completion_tokens = completion_tokens
+        self.tenant = tenant
+        self.priority = priority
+
+    def run_prompt(self, msg_history: Any) -> Any:
+        self.scheduler.acquire(estimate_call_tokens(msg_history, self.completion_tokens), self.tenant, self.priority)
+        return self.client.run_prompt(msg_history)
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class AsyncRateLimitedClient(AsyncLLMClientBase):
+    """
+    Coroutine version of RateLimitedClient, over an AsyncLLMClientBase client.
+    """
+    def __init__(self, client: AsyncLLMClientBase, scheduler: RateLimitScheduler, completion_tokens: int = 100,
+                 tenant: str = 'default', priority: str = 'default') -> None:
+        self.client = client
+        self.scheduler = scheduler
+        self.completion_tokens = completion_tokens
+        self.tenant = tenant
+        self.priority = priority
+
+    async def run_prompt(self, msg_history: Any) -> Any:
+        await self.scheduler.aacquire(estimate_call_tokens(msg_history, self.completion_tokens),
+                                      self.tenant, self.priority)
+        return await self.client.run_prompt(msg_history)
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+def estimate_call_tokens(msg_history: Any, completion_tokens: int) -> int:
+    """Tokens a call counts against the tokens-per-minute budget: the estimated prompt plus the completion."""
+    total_tokens = getattr(msg_history, 'total_tokens', None)
+    return (total_tokens or 0) + completion_tokens
+
+
+# Schedulers shared by all clients of one API key and model in this process, see shared_scheduler()
+_schedulers: Dict[str, RateLimitScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def shared_scheduler(key: str, rate_config: dict, metrics: Optional[Any] = None) -> RateLimitScheduler:
+    """
+    The scheduler of the given key (API key variable and model), created from the 'rate_limit' config section
+    on first use.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = RateLimitScheduler(
+                requests_per_minute=rate_config.get('requests_per_minute'),
+                tokens_per_minute=rate_config.get('tokens_per_minute'),
+                burst_seconds=rate_config.get('burst_seconds', 10.0), metrics=metrics)
+        return scheduler
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Literal, Optional
+
+from src.llm.llm_base import LLMClientBase
+from src.llm.messages import message_from_dict, message_to_dict
+
+
+class ReplayMissError(RuntimeError):
+    """Raised in replay mode when no response was recorded for a prompt."""
+    pass
+
+
+def hash_messages(msg_history: Any) -> str:
+    """
+    Stable hash of the messages of a prompt, used as the key of recorded responses.
+    """
+    messages = [message_to_dict(msg) for msg in msg_history.get_messages()]
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+
+
+class RecordReplayClient(LLMClientBase):
+    """
+    Records the responses of another client to a JSON file, keyed by the hash of the prompt messages,
+    and replays them later without calling the LLM. This makes agent runs reproducible and free, so they can be
+    used for offline benchmarks and regression tests.
+    Modes:
+        'record': call the wrapped client and store every response
+        'replay': only return stored responses; unknown prompts raise a ReplayMissError
+        'auto': replay stored responses, and record the ones that are missing
+    """
+    def __init__(self, path: str, mode: Literal['record', 'replay', 'auto'] = 'replay',
+                 client: Optional[LLMClientBase] = None, autosave: bool = True) -> None:
+        if mode not in ('record', 'replay', 'auto'):
+            raise ValueError(f'Unsupported mode: {mode}. Supported modes are record, replay, auto.')
+        if mode != 'replay' and client is None:
+            raise ValueError(f'A client to record from is required in {mode} mode')
+
+        self.path = path
+        self.mode = mode
+        self.client = client
+        self.autosave = autosave
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._responses: Dict[str, Dict[str, Any]] = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self._responses = json.load(f)
+
+    def run_prompt(self, msg_history: Any) -> Any:
+        key = hash_messages(msg_history)
+
+        # The counters are updated under the lock too: agents may share the client across threads
+        with self._lock:
+            data = self._responses.get(key) if self.mode != 'record' else None
+            if data is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if data is not None:
+            return message_from_dict(data)
+        if self.mode == 'replay':
+            raise ReplayMissError(f'No recorded response for prompt {key}')
+
+        response = self.client.run_prompt(msg_history)
+
+        with self._lock:
+            self._responses[key] = message_to_dict(response)
+        if self.autosave:
+            self.save()
+
+        return response
+
+    def save(self) -> None:
+        with self._lock:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._responses, f)
+            os.replace(tmp_path, self.path)
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+
+    def __len__(self) -> int:
+        return len(self._responses)
@@ -0,0 +1,208 @@
+import asyncio
+import collections
+import math
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, Optional, TypeVar
+
+T = TypeVar('T')
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+
+def create_http_client(http_config: dict, async_client: bool = False) -> Any:
+    """
+    HTTP client for openai.OpenAI / openai.AsyncOpenAI with the pool size, keep-alive and timeouts of the config.
+    """
+    import openai
+
+    HTTPLimits = type(openai.DEFAULT_CONNECTION_LIMITS)   # Limits class of the HTTP library used by the openai package
+    limits = HTTPLimits(max_connections=http_config.get('max_connections', 100),
+                        max_keepalive_connections=http_config.get('max_keepalive_connections', 20),
+                        keepalive_expiry=http_config.get('keepalive_expiry', 30.0))
+    timeout = openai.Timeout(http_config.get('timeout', 60.0), connect=http_config.get('connect_timeout', 5.0))
+
+    if async_client:
+        return openai.DefaultAsyncHttpxClient(limits=limits, timeout=timeout)
+    return openai.DefaultHttpxClient(limits=limits, timeout=timeout)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Delay requested by the server in the Retry-After (or retry-after-ms) header of an error response, if any.
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms is not None:
+        try:
+            return max(float(retry_after_ms) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get('retry-after')
+    if retry_after is None:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Retry of transient API failures (rate limits, server errors, timeouts, connection errors) with exponential
+    backoff and full jitter. When the server sends a Retry-After header, that delay is used instead.
+    """
+    def __init__(self, max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+
+    @classmethod
+    def from_config(cls, http_config: dict) -> 'RetryPolicy':
+        return cls(max_retries=http_config.get('max_retries', 4),
+                   backoff_base=http_config.get('backoff_base', 0.5),
+                   backoff_max=http_config.get('backoff_max', 30.0))
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        openai = sys.modules.get('openai')
+        if openai is None:   # Not imported yet, so the error cannot come from the API client
+            return False
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES
+        return False
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """Seconds to wait before retry number attempt (0 based)."""
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, func: Callable[[], T], on_retry: Optional[Callable[[Exception, float], None]] = None) -> T:
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.delay(attempt, e)
+                if on_retry is not None:
+                    on_retry(e, delay)
+                self.sleep(delay)
+                attempt += 1
+
+    async def acall(self, func: Callable[[], Awaitable[T]],
+                    on_retry: Optional[Callable[[Exception, float], None]] = None) -> T:
+        attempt = 0
+        while True:
+            try:
+                return await func()
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.delay(attempt, e)
+                if on_retry is not None:
+                    on_retry(e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent requests, giving the delay after which a request is hedged (the p95 latency).
+    """
+    def __init__(self, window: int = 200, min_samples: int = 20, percentile: float = 95) -> None:
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self._latencies: Deque[float] = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self) -> Optional[float]:
+        """The p95 latency, or None while too few requests have been observed."""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, math.ceil(self.percentile / 100 * len(latencies)) - 1)]
+
+
+def call_hedged(func: Callable[[], T], delay: Optional[float], executor: Executor,
+                on_hedge: Optional[Callable[[], None]] = None) -> T:
+    """
+    Call func; if it has not returned after delay seconds, call it a second time concurrently and return the first
+    successful result. The slower request is left to finish in the background.
+    """
+    if delay is None:
+        return func()
+
+    primary = executor.submit(func)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    if on_hedge is not None:
+        on_hedge()
+    pending = {primary, executor.submit(func)}
+
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+async def acall_hedged(func: Callable[[], Awaitable[T]], delay: Optional[float],
+                       on_hedge: Optional[Callable[[], None]] = None) -> T:
+    """
+    Coroutine version of call_hedged(). The slower request is cancelled.
+    """
+    if delay is None:
+        return await func()
+
+    primary = asyncio.ensure_future(func())
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+
+    if on_hedge is not None:
+        on_hedge()
+    pending = {primary, asyncio.ensure_future(func())}
+
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,204 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Union
+
+from src.llm.llm_base import AsyncLLMClientBase, LLMClientBase
+from src.llm.prompt_steps import check_tool_calls, last_user_message, plan_from_prompt
+from src.llm.rate_limit import AsyncRateLimitedClient, RateLimitedClient, shared_scheduler
+from src.tools.expression_plan import ExpressionPlan
+
+
+@dataclass
+class ModelStats:
+    calls: int = 0
+    valid: int = 0
+    invalid: int = 0   # Responses failing validation
+    errors: int = 0   # Exceptions (API errors)
+    success_rate: float = 1.0   # Decayed average of valid responses, optimistic at first
+    latency: Optional[float] = None   # Decayed average of the response time, in seconds
+
+
+@dataclass
+class ModelRoute:
+    name: str
+    client: Union[LLMClientBase, AsyncLLMClientBase]
+    cost: float   # Relative cost of one call
+
+
+class _RouterBase:
+    """
+    Routing decisions and statistics shared by the sync and async routing clients.
+    Models are ordered from cheapest to strongest. Each call starts at the model with the lowest expected cost,
+    escalating along the list while responses fail validation. The expected cost of starting at model i is
+        E_i = c_i + (1 - p_i) * E_(i+1),    c_i = cost_i + latency_weight * latency_i
+    where p_i is the recent success rate of model i, so a cheap model that keeps failing stops being tried first.
+    Every probe_interval calls start at the cheapest model anyway, so that its statistics can recover.
+    """
+    def __init__(self, routes: Sequence[ModelRoute], latency_weight: float = 0.0, stats_decay: float = 0.9,
+                 probe_interval: int = 20, validate_steps: bool = True, metrics: Optional[Any] = None) -> None:
+        if not routes:
+            raise ValueError('At least one model route is required')
+
+        self.routes = list(routes)
+        self.latency_weight = latency_weight
+        self.stats_decay = stats_decay
+        self.probe_interval = probe_interval
+        self.validate_steps = validate_steps
+        self.metrics = metrics
+
+        self.stats = {route.name: ModelStats() for route in self.routes}
+        self.num_calls = 0
+        self._lock = threading.Lock()
+
+    def _route_order(self) -> List[ModelRoute]:
+        with self._lock:
+            self.num_calls += 1
+            if self.probe_interval and self.num_calls % self.probe_interval == 0:
+                return self.routes
+
+            expected_costs = [0.0] * len(self.routes)
+            next_cost = 0.0
+            for i in reversed(range(len(self.routes))):
+                stats = self.stats[self.routes[i].name]
+                cost = self.routes[i].cost + self.latency_weight * (stats.latency or 0.0)
+                next_cost = cost + (1 - stats.success_rate) * next_cost
+                expected_costs[i] = next_cost
+
+        start = min(range(len(self.routes)), key=lambda i: (expected_costs[i], i))
+        return self.routes[start:]
+
+    def _plan(self, msg_history: Any) -> Optional[ExpressionPlan]:
+        return plan_from_prompt(last_user_message(msg_history)) if self.validate_steps else None
+
+    def _record(self, route: ModelRoute, latency: float, valid: Optional[bool]) -> None:
+        """Record one call: valid is None for an exception."""
+        with self._lock:
+            stats = self.stats[route.name]
+            stats.calls += 1
+            if valid is None:
+                stats.errors += 1
+            elif valid:
+                stats.valid += 1
+            else:
+                stats.invalid += 1
+
+            d = self.stats_decay
+            stats.success_rate = d * stats.success_rate + (1 - d) * (1.0 if valid else 0.0)
+            if valid is not None:
+                stats.latency = latency if stats.latency is None else d * stats.latency + (1 - d) * latency
+
+    def _on_escalate(self) -> None:
+        if self.metrics is not None:
+            self.metrics.increment('routing_escalations')
+
+    def close(self) -> None:
+        for route in self.routes:
+            route.client.close()
+
+
+class RoutingClient(_RouterBase, LLMClientBase):
+    """
+    Sends each prompt to the cheapest suitable model first, and escalates to a stronger model only when the
+    response fails validation: missing tool calls, tool call arguments that are not valid JSON, or steps that are
+    not valid next operations of the expression in the prompt (the steps that would not reduce the expression or
+    would give a result disagreeing with the local evaluation). If every model fails, the last response is
+    returned, and the agent handles it as usual.
+    """
+    def run_prompt(self, msg_history: Any) -> Any:
+        plan = self._plan(msg_history)
+        response, error = None, None
+
+        for n, route in enumerate(self._route_order()):
+            if n > 0:
+                self._on_escalate()
+
+            start = time.perf_counter()
+            try:
+                response = route.client.run_prompt(msg_history)
+            except Exception as e:
+                self._record(route, time.perf_counter() - start, None)
+                error = e
+                continue
+
+            valid = check_tool_calls(response.tool_calls, plan) is None
+            self._record(route, time.perf_counter() - start, valid)
+            if valid:
+                return response
+
+        if response is not None:
+            return response
+        raise error
+
+
+class AsyncRoutingClient(_RouterBase, AsyncLLMClientBase):
+    """
+    Coroutine version of RoutingClient, over AsyncLLMClientBase clients.
+    """
+    async def run_prompt(self, msg_history: Any) -> Any:
+        plan = self._plan(msg_history)
+        response, error = None, None
+
+        for n, route in enumerate(self._route_order()):
+            if n > 0:
+                self._on_escalate()
+
+            start = time.perf_counter()
+            try:
+                response = await route.client.run_prompt(msg_history)
+            except Exception as e:
+                self._record(route, time.perf_counter() - start, None)
+                error = e
+                continue
+
+            valid = check_tool_calls(response.tool_calls, plan) is None
+            self._record(route, time.perf_counter() - start, valid)
+            if valid:
+                return response
+
+        if response is not None:
+            return response
+        raise error
+
+    async def aclose(self) -> None:
+        for route in self.routes:
+            await route.client.aclose()
+
+
+def create_llm_client(config: dict, metrics: Optional[Any] = None,
+                      async_client: bool = False) -> Union[LLMClientBase, AsyncLLMClientBase]:
+    """
+    The ChatGPT client for the config: a routing client over the models of the 'routing' section if any,
+    otherwise a single client for 'model'. With a 'rate_limit' budget, every model's client waits for the
+    scheduler shared by all clients of the same API key and model.
+    """
+    routing_config = config.get('routing') or {}
+    models = routing_config.get('models') or []
+    if not models:
+        return _create_model_client(config, metrics, async_client)
+
+    routes = [ModelRoute(entry['model'],
+                         _create_model_client(dict(config, model=entry['model']), metrics, async_client),
+                         entry.get('cost', 1.0))
+              for entry in models]
+    router_class = AsyncRoutingClient if async_client else RoutingClient
+    return router_class(routes, latency_weight=routing_config.get('latency_weight', 0.0),
+                        stats_decay=routing_config.get('stats_decay', 0.9),
+                        probe_interval=routing_config.get('probe_interval', 20),
+                        validate_steps=routing_config.get('validate_steps', True), metrics=metrics)
+
+
+def _create_model_client(config: dict, metrics: Optional[Any],
+                         async_client: bool) -> Union[LLMClientBase, AsyncLLMClientBase]:
+    from src.llm.chatgpt import AsyncChatGPTClient, ChatGPTClient
+    client = (AsyncChatGPTClient if async_client else ChatGPTClient)(config, metrics)
+
+    rate_config = config.get('rate_limit') or {}
+    if not (rate_config.get('requests_per_minute') or rate_config.get('tokens_per_minute')):
+        return client
+
+    # Provider limits apply per API key and model
+    scheduler = shared_scheduler(f"{config.get('openai_key_env_var')}:{config['model']}", rate_config, metrics)
+    client_class = AsyncRateLimitedClient if async_client else RateLimitedClient
+    return client_class(client, scheduler, completion_tokens=rate_config.get('completion_tokens', 100),
+                        tenant=rate_config.get('tenant', 'default'), priority=rate_config.get('priority', 'default'))
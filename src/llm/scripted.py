@@ -0,0 +1,59 @@
+import json
+import random
+import threading
+import time
+from typing import Any, Optional
+
+from src.llm.llm_base import LLMClientBase
+from src.llm.messages import AssistantMessage, FunctionCall, ToolCall
+from src.llm.prompt_steps import last_user_message, plan_from_prompt
+from src.tools.expression_plan import PlanOperation
+
+
+class ScriptedCalculatorClient(LLMClientBase):
+    """
+    Offline stand-in for the LLM, which answers the prompts of both calculator agents with correct tool calls.
+    The expression is taken from the last user message (the steps listed by the stepwise agent are applied to it),
+    and the next ready operation of its plan is returned, or all ready operations when parallel_steps is set.
+    Used to benchmark the agent loop without network calls; latency simulates the response time of the API and
+    error_rate the fraction of calls returning a wrong step.
+    """
+    def __init__(self, parallel_steps: bool = False, latency: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None) -> None:
+        self.parallel_steps = parallel_steps
+        self.latency = latency
+        self.error_rate = error_rate
+
+        self.num_calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def run_prompt(self, msg_history: Any) -> AssistantMessage:
+        with self._lock:
+            self.num_calls += 1
+            call_id = self.num_calls
+            make_error = self.error_rate > 0 and self._rng.random() < self.error_rate
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        plan = plan_from_prompt(last_user_message(msg_history))
+        if plan is None or plan.is_complete:
+            return AssistantMessage(content='There is no calculation left to perform.')
+
+        operations = plan.ready() if self.parallel_steps else plan.ready()[:1]
+        is_final_step = sum(1 for operation in plan.operations if not operation.is_resolved) == 1
+
+        tool_calls = []
+        for i, operation in enumerate(operations):
+            arguments = self._arguments(operation, is_final_step, wrong=make_error and i == 0)
+            tool_calls.append(ToolCall(f'call_{call_id}_{i}', FunctionCall('calculate', json.dumps(arguments))))
+
+        return AssistantMessage(tool_calls=tool_calls)
+
+    @staticmethod
+    def _arguments(operation: PlanOperation, is_final_step: bool, wrong: bool = False) -> dict:
+        a, b = operation.operands
+        if wrong:
+            a = a + 1
+        return {'a': a, 'b': b, 'op': operation.op, 'is_final_step': is_final_step}
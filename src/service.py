@@ -0,0 +1,333 @@
+"""
+HTTP service exposing the calculator agents.
+
+    POST /evaluate        {"expression": "2 * (3 + 4)", "agent": "reducing"}
+    POST /evaluate/batch  {"expressions": ["2 * (3 + 4)", "1 + 2"], "agent": "stepwise"}
+    GET  /metrics         Prometheus text format (?format=json for JSON)
+    GET  /health
+
+Configs and LLM clients are loaded once and kept warm. Concurrent requests for the same expression are coalesced
+into a single agent run. Admission control: each agent runs at most max_concurrency expressions at once, with at
+most max_queue_depth more waiting; beyond that, requests are rejected with 503 and a Retry-After header.
+
+Run from the repository root:
+    python -m src.service --port 8080
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from src.agents.agent_base import CalculatorAgentBase
+from src.agents.concurrency import SingleFlight
+from src.agents.metrics import AgentMetrics
+from src.agents.result_cache import normalize_expression
+from src.tools.numeric import to_json
+
+MAX_BODY_BYTES = 1 << 20
+
+STATUS_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                  413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error',
+                  503: 'Service Unavailable'}
+
+
+class OverloadedError(Exception):
+    """Raised when admitting a request would exceed the max queue depth."""
+    pass
+
+
+class AgentEndpoint:
+    """
+    One agent with its admission control: at most max_concurrency runs at once, max_queue_depth waiting.
+    """
+    def __init__(self, agent: CalculatorAgentBase, max_concurrency: int, max_queue_depth: int) -> None:
+        self.agent = agent
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.pending = 0   # Admitted runs, waiting or running
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def admit(self, count: int = 1) -> None:
+        if self.pending + count > self.max_concurrency + self.max_queue_depth:
+            raise OverloadedError(f'Too many expressions in flight ({self.pending})')
+        self.pending += count
+
+    def release(self, count: int = 1) -> None:
+        """Give back admitted runs that were not started."""
+        self.pending -= count
+
+    async def run(self, expression: str) -> Optional[float]:
+        """Run an admitted expression, once a run slot is free."""
+        try:
+            async with self._semaphore:
+                return await self.agent.arun(expression)
+        finally:
+            self.pending -= 1
+
+
+class CalculatorService:
+    """
+    Evaluation logic of the service, independent of the HTTP layer.
+    """
+    def __init__(self, endpoints: Dict[str, AgentEndpoint], metrics: Optional[AgentMetrics] = None,
+                 default_agent: Optional[str] = None) -> None:
+        self.endpoints = endpoints
+        self.metrics = metrics if metrics is not None else AgentMetrics()
+        self.default_agent = default_agent or next(iter(endpoints))
+        self._single_flight = SingleFlight()
+
+    def _endpoint(self, agent_name: Optional[str]) -> Tuple[str, AgentEndpoint]:
+        name = agent_name or self.default_agent
+        if name not in self.endpoints:
+            raise ValueError(f'Unknown agent: {name}. Available agents are {", ".join(self.endpoints)}.')
+        return name, self.endpoints[name]
+
+    async def aclose(self) -> None:
+        """Release the threads and connections of the agents and their LLM clients."""
+        for endpoint in self.endpoints.values():
+            await endpoint.agent.aclose()
+
+    async def evaluate(self, expression: str, agent_name: Optional[str] = None,
+                       reserved: Optional[Set[Tuple[str, str]]] = None) -> Dict[str, Any]:
+        """
+        Evaluate one expression. Raises OverloadedError if it cannot be admitted, and the agent's exception if
+        the run fails.
+
+        :param reserved: Keys of the runs already admitted for this expression's batch. A new run takes its
+                         admission from here; a reservation that is not needed (the run was started by another
+                         request in the meantime) is released.
+        """
+        name, endpoint = self._endpoint(agent_name)
+        if not isinstance(expression, str):
+            raise ValueError('expression must be a string')
+
+        key = (name, normalize_expression(expression, endpoint.agent.numeric))
+        is_reserved = reserved is not None and key in reserved
+        if is_reserved:
+            reserved.discard(key)
+        if key in self._single_flight:
+            if is_reserved:
+                endpoint.release()
+        elif not is_reserved:
+            try:
+                endpoint.admit()
+            except OverloadedError:
+                self.metrics.increment('rejected')
+                raise
+        self._update_gauges()
+
+        try:
+            result, coalesced = await self._single_flight.do(key, lambda: endpoint.run(expression))
+        finally:
+            self._update_gauges()
+
+        if coalesced:
+            self.metrics.increment('coalesced')
+        return {'expression': expression, 'result': to_json(result), 'coalesced': coalesced}
+
+    async def evaluate_batch(self, expressions: List[str], agent_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Evaluate several expressions; failures are reported per expression.
+        The whole batch is rejected (OverloadedError) if its new runs cannot all be admitted.
+        """
+        name, endpoint = self._endpoint(agent_name)
+        if not isinstance(expressions, list):
+            raise ValueError('expressions must be a list')
+
+        # The new runs of the batch are admitted together, before any of them starts, so that a batch is never
+        # partially rejected by requests arriving while its items are scheduled
+        keys = {(name, normalize_expression(e, endpoint.agent.numeric)) for e in expressions if isinstance(e, str)}
+        reserved = {key for key in keys if key not in self._single_flight}
+        try:
+            endpoint.admit(len(reserved))
+        except OverloadedError:
+            self.metrics.increment('rejected', len(expressions))
+            raise
+
+        async def evaluate_item(expression: str) -> Dict[str, Any]:
+            try:
+                return await self.evaluate(expression, name, reserved)
+            except Exception as e:
+                return {'expression': expression, 'result': None, 'error': f'{type(e).__name__}: {e}'}
+
+        try:
+            return list(await asyncio.gather(*(evaluate_item(expression) for expression in expressions)))
+        finally:
+            endpoint.release(len(reserved))   # Reservations of items that did not get to start a run
+
+    def _update_gauges(self) -> None:
+        self.metrics.set_gauge('runs_in_flight', len(self._single_flight))
+        for name, endpoint in self.endpoints.items():
+            self.metrics.set_gauge(f'{name}_pending', endpoint.pending)
+
+
+class HTTPServer:
+    """
+    Minimal HTTP/1.1 server (JSON requests and responses, keep-alive) on top of asyncio streams.
+    """
+    def __init__(self, service: CalculatorService) -> None:
+        self.service = service
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080) -> asyncio.AbstractServer:
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'Malformed request line'}, keep_alive=False)
+                    break
+
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length') or 0)
+                    if length < 0:
+                        raise ValueError(f'negative length {length}')
+                except ValueError as e:
+                    await self._respond(writer, 400, {'error': f'Invalid Content-Length: {e}'}, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {'error': 'Request body too large'}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                status, payload, extra_headers = await self._route(method, target, body)
+                await self._respond(writer, status, payload, keep_alive, extra_headers)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, target: str, body: bytes) -> Tuple[int, Any, Dict[str, str]]:
+        url = urlsplit(target)
+        start = time.perf_counter()
+        self.service.metrics.increment('http_requests')
+
+        try:
+            if url.path == '/health':
+                return 200, {'status': 'ok'}, {}
+
+            if url.path == '/metrics':
+                if parse_qs(url.query).get('format') == ['json']:
+                    return 200, self.service.metrics.snapshot(), {}
+                return 200, self.service.metrics.to_prometheus(), {'Content-Type': 'text/plain; version=0.0.4'}
+
+            if url.path not in ('/evaluate', '/evaluate/batch'):
+                return 404, {'error': f'Not found: {url.path}'}, {}
+            if method != 'POST':
+                return 405, {'error': 'Use POST'}, {'Allow': 'POST'}
+
+            try:
+                request = json.loads(body)
+                if not isinstance(request, dict):
+                    raise ValueError('Request body must be a JSON object')
+            except ValueError as e:
+                return 400, {'error': f'Invalid JSON: {e}'}, {}
+
+            try:
+                if url.path == '/evaluate':
+                    return 200, await self.service.evaluate(request.get('expression'), request.get('agent')), {}
+                results = await self.service.evaluate_batch(request.get('expressions'), request.get('agent'))
+                return 200, {'results': results}, {}
+            except OverloadedError as e:
+                return 503, {'error': str(e)}, {'Retry-After': '1'}
+            except (ValueError, ArithmeticError) as e:   # Invalid expression, division by zero
+                return 422, {'error': f'{type(e).__name__}: {e}'}, {}
+            except Exception as e:
+                return 500, {'error': f'{type(e).__name__}: {e}'}, {}
+        finally:
+            self.service.metrics.observe('http_request', time.perf_counter() - start)
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool,
+                       extra_headers: Optional[Dict[str, str]] = None) -> None:
+        headers = {'Content-Type': 'application/json'}
+        headers.update(extra_headers or {})
+
+        data = (payload if isinstance(payload, str) else json.dumps(payload)).encode()
+        head = [f'HTTP/1.1 {status} {STATUS_REASONS.get(status, "")}',
+                f'Content-Length: {len(data)}',
+                f'Connection: {"keep-alive" if keep_alive else "close"}']
+        head.extend(f'{name}: {value}' for name, value in headers.items())
+
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + data)
+        await writer.drain()
+
+
+def create_service(agent_names: List[str], metrics: Optional[AgentMetrics] = None) -> CalculatorService:
+    """
+    Build the agents from their configs, each with a warm async LLM client, sharing one AgentMetrics.
+    """
+    from src.agents.reducing_agent import ReducingCalculatorAgent
+    from src.agents.stepwise_agent import StepwiseCalculatorAgent
+    from src.cli import AsyncUnavailableLLMClient, load_config
+    from src.llm.routing import create_llm_client
+
+    agent_classes = {'reducing': ReducingCalculatorAgent, 'stepwise': StepwiseCalculatorAgent}
+    metrics = metrics if metrics is not None else AgentMetrics()
+    endpoints: Dict[str, AgentEndpoint] = {}
+
+    for name in agent_names:
+        config = load_config(name)
+        if config['api_key']:
+            client = create_llm_client(config, metrics, async_client=True)
+        elif config.get('evaluation_mode', 'llm') == 'local':
+            client = AsyncUnavailableLLMClient()   # The agents are run with arun()
+        else:
+            raise SystemExit(f"No API key: set the {config.get('openai_key_env_var')} environment variable")
+
+        agent = agent_classes[name](client, config, metrics=metrics)
+        endpoints[name] = AgentEndpoint(agent, config.get('max_concurrency', 100), config.get('max_queue_depth', 1000))
+
+    return CalculatorService(endpoints, metrics)
+
+
+async def serve(host: str, port: int, agent_names: List[str]) -> None:
+    service = create_service(agent_names)
+    try:
+        server = await HTTPServer(service).start(host, port)
+        print(f'Serving on http://{host}:{server.sockets[0].getsockname()[1]}')
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='python -m src.service', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--agents', nargs='+', choices=('reducing', 'stepwise'), default=['reducing', 'stepwise'],
+                        help='Agents to serve; the first one is the default')
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, args.agents))
+
+
+if __name__ == '__main__':
+    main()
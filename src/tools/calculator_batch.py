@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from typing import Any, List, Union
+
+import numpy as np
+
+from src.tools.calculator import calculate
+from src.tools.expression_plan import ExpressionPlan
+
+Number = Union[int, float]
+
+OPS = ('+', '-', '*', '/')
+
+# Per-element error codes reported by calculate_batch
+ERROR_NONE = 0
+ERROR_ZERO_DIVISION = 1
+ERROR_UNSUPPORTED_OP = 2
+
+
+@dataclass
+class BatchCalculation:
+    results: np.ndarray   # float64, NaN where the element failed
+    errors: np.ndarray    # uint8 error code per element (ERROR_*)
+
+    @property
+    def num_errors(self) -> int:
+        return int(np.count_nonzero(self.errors))
+
+    def error_message(self, i: int) -> str:
+        """Human readable error for element i, matching the messages of calculate()."""
+        code = self.errors[i]
+        if code == ERROR_NONE:
+            return ''
+        elif code == ERROR_ZERO_DIVISION:
+            return 'Division by zero is not allowed.'
+        else:
+            return 'Unsupported operation. Supported operations are +, -, *, /.'
+
+
+def encode_ops(op_array: Any) -> np.ndarray:
+    """
+    Convert an array of operation strings ('+', '-', '*', '/') into uint8 codes (indices into OPS).
+    Unsupported operations are encoded as len(OPS). Arrays that are already integer coded are returned as is.
+    """
+    ops = np.asarray(op_array)
+    if ops.dtype.kind in 'iu':
+        return ops.astype(np.uint8, copy=False)
+
+    codes = np.full(ops.shape, len(OPS), dtype=np.uint8)
+    for code, op in enumerate(OPS):
+        codes[ops == op] = code
+    return codes
+
+
+def calculate_batch(a_array: Any, b_array: Any, op_array: Any) -> BatchCalculation:
+    """
+    Vectorized version of calculate(a, b, op), applied element-wise to whole arrays.
+    Instead of raising, failing elements (division by zero, unsupported operation) are masked out:
+    their result is NaN and their error code is set.
+
+    :param a_array: First operands
+    :param b_array: Second operands
+    :param op_array: Operations, as strings or as codes from encode_ops()
+    :return: A BatchCalculation holding the results and per-element error codes
+    """
+    a = np.asarray(a_array, dtype=np.float64)
+    b = np.asarray(b_array, dtype=np.float64)
+    ops = encode_ops(op_array)
+
+    if not (a.shape == b.shape == ops.shape):
+        raise ValueError(f'Shape mismatch: a {a.shape}, b {b.shape}, op {ops.shape}')
+
+    results = np.full(a.shape, np.nan)
+    errors = np.zeros(a.shape, dtype=np.uint8)
+
+    mask = ops == 0
+    np.add(a, b, out=results, where=mask)
+    mask = ops == 1
+    np.subtract(a, b, out=results, where=mask)
+    mask = ops == 2
+    np.multiply(a, b, out=results, where=mask)
+
+    mask = ops == 3
+    zero_division = mask & (b == 0)
+    np.divide(a, b, out=results, where=mask & ~zero_division)
+    errors[zero_division] = ERROR_ZERO_DIVISION
+
+    errors[ops >= len(OPS)] = ERROR_UNSUPPORTED_OP
+
+    return BatchCalculation(results, errors)
+
+
+def execute_plans_batch(plans: List[ExpressionPlan]) -> List[Union[Number, Exception]]:
+    """
+    Evaluate many expression plans together: each round, the ready operations of all plans are performed with a
+    single calculate_batch call, so the number of NumPy calls is the depth of the deepest plan.
+    Operations on two integers are performed with the scalar calculate() instead, so that integer results stay
+    exact integers (as with ExpressionPlan.execute()); float64 would round them beyond 2 ** 53. Operations with a
+    float operand give the same result either way.
+
+    :param plans: The plans to evaluate (they are resolved in place)
+    :return: The result of each plan, or the exception describing why it failed
+    """
+    outcomes: List[Union[Number, Exception, None]] = [plan.result for plan in plans]
+    active = [i for i, plan in enumerate(plans) if not plan.is_complete]
+
+    while active:
+        ready = []
+        for i in active:
+            for operation in plans[i].ready():
+                a, b = operation.operands
+                if type(a) is int and type(b) is int:
+                    try:
+                        plans[i].resolve(operation.op_id, calculate(a, b, operation.op))
+                    except (ZeroDivisionError, ValueError) as e:
+                        outcomes[i] = e
+                        break
+                else:
+                    ready.append((i, operation))
+
+        a = np.fromiter((operation.operands[0] for _, operation in ready), dtype=np.float64, count=len(ready))
+        b = np.fromiter((operation.operands[1] for _, operation in ready), dtype=np.float64, count=len(ready))
+        ops = np.fromiter((OPS.index(operation.op) for _, operation in ready), dtype=np.uint8, count=len(ready))
+
+        batch = calculate_batch(a, b, ops)
+
+        for n, ((i, operation), result, error) in enumerate(zip(ready, batch.results.tolist(), batch.errors.tolist())):
+            if isinstance(outcomes[i], Exception):
+                continue
+            if error == ERROR_ZERO_DIVISION:
+                outcomes[i] = ZeroDivisionError(f'{batch.error_message(n)} (a = {operation.operands[0]}, b = 0)')
+            elif error != ERROR_NONE:
+                outcomes[i] = ValueError(batch.error_message(n))
+            else:
+                plans[i].resolve(operation.op_id, result)
+
+        active = [i for i in active if not isinstance(outcomes[i], Exception) and not plans[i].is_complete]
+
+    return [outcome if isinstance(outcome, Exception) else plan.result for outcome, plan in zip(outcomes, plans)]
@@ -0,0 +1,163 @@
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Tuple, Union
+
+from src.tools.calculator import calculate
+
+Number = Union[int, float]
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|(\S))')
+
+
+class ExpressionSyntaxError(ValueError):
+    """Raised when an expression cannot be parsed."""
+    pass
+
+
+@dataclass(frozen=True)
+class NumberNode:
+    value: Number
+
+
+@dataclass(frozen=True)
+class BinaryOpNode:
+    op: str
+    left: 'Node'
+    right: 'Node'
+
+
+Node = Union[NumberNode, BinaryOpNode]
+
+
+def parse_number(text: str) -> Number:
+    return float(text) if '.' in text else int(text)
+
+
+def tokenize(expression: str) -> List[Tuple[str, str]]:
+    """
+    Split an expression into ('num', text) and ('op', char) tokens.
+    Only digits, '.', whitespace, + - * / and parentheses are accepted.
+    """
+    tokens: List[Tuple[str, str]] = []
+    pos = 0
+    expression = expression.rstrip()
+
+    while pos < len(expression):
+        match = TOKEN_PATTERN.match(expression, pos)
+        number, symbol = match.group(1), match.group(2)
+
+        if number is not None:
+            tokens.append(('num', number))
+        elif symbol in '+-*/()':
+            tokens.append(('op', symbol))
+        else:
+            raise ExpressionSyntaxError(f"Unexpected character '{symbol}' at position {match.start(2)}")
+
+        pos = match.end()
+
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent parser implementing the usual precedence rules:
+        expr   := term (('+' | '-') term)*
+        term   := factor (('*' | '/') factor)*
+        factor := ('+' | '-') factor | NUMBER | '(' expr ')'
+    """
+    def __init__(self, tokens: List[Tuple[str, str]], number_parser: Callable[[str], Number] = parse_number) -> None:
+        self.tokens = tokens
+        self.number_parser = number_parser
+        self.pos = 0
+
+    def peek(self) -> Tuple[str, str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else ('end', '')
+
+    def take(self) -> Tuple[str, str]:
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self) -> Node:
+        if not self.tokens:
+            raise ExpressionSyntaxError("Empty expression")
+
+        node = self.expr()
+
+        if self.peek()[0] != 'end':
+            raise ExpressionSyntaxError(f"Unexpected token '{self.peek()[1]}' after end of expression")
+
+        return node
+
+    def expr(self) -> Node:
+        node = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            op = self.take()[1]
+            node = BinaryOpNode(op, node, self.term())
+        return node
+
+    def term(self) -> Node:
+        node = self.factor()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            op = self.take()[1]
+            node = BinaryOpNode(op, node, self.factor())
+        return node
+
+    def factor(self) -> Node:
+        kind, text = self.take()
+
+        if kind == 'num':
+            return NumberNode(self.number_parser(text))
+
+        if text in ('+', '-'):
+            operand = self.factor()
+            if text == '+':
+                return operand
+            if isinstance(operand, NumberNode):
+                return NumberNode(-operand.value)   # Fold negative literals such as '-5'
+            return BinaryOpNode('-', NumberNode(0), operand)
+
+        if text == '(':
+            node = self.expr()
+            if self.take() != ('op', ')'):
+                raise ExpressionSyntaxError("Missing closing parenthesis")
+            return node
+
+        if kind == 'end':
+            raise ExpressionSyntaxError("Unexpected end of expression")
+
+        raise ExpressionSyntaxError(f"Unexpected token '{text}'")
+
+
+def parse_expression(expression: str, number_parser: Callable[[str], Number] = parse_number) -> Node:
+    """
+    Parse an expression into a tree of NumberNode / BinaryOpNode objects.
+
+    :param expression: The mathematical expression to parse
+    :param number_parser: Converts the number literals, e.g. to Decimal (int or float by default)
+    :return: The root node of the expression tree
+    """
+    return _Parser(tokenize(expression), number_parser).parse()
+
+
+def evaluate(node: Node, step_func: Callable[[Number, Number, str], Number] = calculate) -> Number:
+    """
+    Evaluate an expression tree with the calculate tool.
+    """
+    if isinstance(node, NumberNode):
+        return node.value
+
+    return step_func(evaluate(node.left, step_func), evaluate(node.right, step_func), node.op)
+
+
+def evaluate_expression(expression: str, number_parser: Callable[[str], Number] = parse_number,
+                        step_func: Callable[[Number, Number, str], Number] = calculate) -> Number:
+    """
+    Parse and evaluate an expression locally, without calling an LLM.
+
+    :param expression: The mathematical expression to evaluate
+    :param number_parser: Converts the number literals, e.g. to Decimal (int or float by default)
+    :param step_func: Function performing a single operation, calculate(a, b, op) by default
+    :return: The result of the expression
+    """
+    return evaluate(parse_expression(expression, number_parser), step_func)
@@ -0,0 +1,238 @@
+import math
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.tools.expression_parser import BinaryOpNode, Node, NumberNode, parse_expression
+from src.tools.numeric import NumericBackend, Number
+
+COMMUTATIVE_OPS = ('+', '*')
+
+PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2}
+
+
+@dataclass
+class PlanOperation:
+    op_id: int
+    op: str
+    operands: List[Optional[Number]]   # [a, b]; None until the operation producing it is resolved
+    level: int   # 0 for operations on two literals, otherwise 1 + the level of the deepest input
+    parent: Optional[int] = None   # Operation consuming this result, None for the root
+    parent_slot: int = 0   # Operand position (0: a, 1: b) of this result in the parent
+    result: Optional[Number] = None
+    inputs: Tuple[Optional[int], Optional[int]] = (None, None)   # Operations producing the operands, None for literals
+
+    @property
+    def is_ready(self) -> bool:
+        return self.result is None and self.operands[0] is not None and self.operands[1] is not None
+
+    @property
+    def is_resolved(self) -> bool:
+        return self.result is not None
+
+
+class ExpressionPlan:
+    """
+    Dependency graph of the calculate operations needed to evaluate an expression.
+    An operation is ready once both of its operands are known; all ready operations are independent of each other,
+    so they can be performed in the same round (or the same LLM call). Steps proposed by the LLM can be checked
+    against the ready set with match(), which rejects invalid or out-of-order steps.
+    The ready set is maintained incrementally, so resolving a step does not rescan the expression, and the
+    partially evaluated expression is only rendered back to text when render() is called.
+    Numbers are of the type of the numeric backend the expression was parsed with (float by default).
+    """
+    def __init__(self, root: Node, rel_tol: float = 1e-5, numeric: Optional[NumericBackend] = None) -> None:
+        self.rel_tol = rel_tol
+        self.numeric = numeric if numeric is not None else NumericBackend()
+        self.operations: List[PlanOperation] = []   # Topologically sorted (inputs before the operations using them)
+        self.literal_result: Optional[Number] = root.value if isinstance(root, NumberNode) else None
+
+        if isinstance(root, BinaryOpNode):
+            self._add_operation(root)
+
+        # Ready operation ids, in plan order (dict used as an insertion ordered set)
+        self._ready: Dict[int, None] = {o.op_id: None for o in self.operations if o.is_ready}
+        self._rendered: Optional[str] = None
+
+        self.levels: List[List[int]] = [[] for _ in range(1 + max((o.level for o in self.operations), default=-1))]
+        for operation in self.operations:
+            self.levels[operation.level].append(operation.op_id)
+
+    @classmethod
+    def from_expression(cls, expression: str, rel_tol: float = 1e-5,
+                        numeric: Optional[NumericBackend] = None) -> 'ExpressionPlan':
+        numeric = numeric if numeric is not None else NumericBackend()
+        return cls(parse_expression(expression, numeric.parse), rel_tol, numeric)
+
+    def _add_operation(self, node: BinaryOpNode) -> int:
+        """
+        Add the operations of the subtree in post-order, so that inputs always come before the operations using them.
+        """
+        child_ids: List[Optional[int]] = []
+        operands: List[Optional[Number]] = []
+
+        for child in (node.left, node.right):
+            if isinstance(child, NumberNode):
+                child_ids.append(None)
+                operands.append(child.value)
+            else:
+                child_ids.append(self._add_operation(child))
+                operands.append(None)
+
+        op_id = len(self.operations)
+        level = max((self.operations[c].level + 1 for c in child_ids if c is not None), default=0)
+        self.operations.append(PlanOperation(op_id, node.op, operands, level, inputs=(child_ids[0], child_ids[1])))
+
+        for slot, child_id in enumerate(child_ids):
+            if child_id is not None:
+                self.operations[child_id].parent = op_id
+                self.operations[child_id].parent_slot = slot
+
+        return op_id
+
+    @property
+    def num_operations(self) -> int:
+        return len(self.operations)
+
+    @property
+    def depth(self) -> int:
+        """Number of rounds needed when all ready operations are performed together."""
+        return len(self.levels)
+
+    @property
+    def is_complete(self) -> bool:
+        return not self.operations or self.operations[-1].is_resolved   # The root is always resolved last
+
+    @property
+    def result(self) -> Optional[Number]:
+        if not self.operations:
+            return self.literal_result
+        return self.operations[-1].result
+
+    def ready(self) -> List[PlanOperation]:
+        return [self.operations[op_id] for op_id in self._ready]
+
+    def match(self, a: Number, b: Number, op: str) -> Optional[PlanOperation]:
+        """
+        Find the ready operation corresponding to the step 'a op b' proposed by the LLM.
+        Operands are compared with a relative tolerance, since the LLM sees rounded intermediate results.
+
+        :return: The matching operation, or None if the step is not valid at this point
+        """
+        for operation in self.ready():
+            if operation.op != op:
+                continue
+            x, y = operation.operands
+            if self._close(a, x) and self._close(b, y):
+                return operation
+            if op in COMMUTATIVE_OPS and self._close(a, y) and self._close(b, x):
+                return operation
+        return None
+
+    def resolve(self, op_id: int, result: Number) -> None:
+        operation = self.operations[op_id]
+        if not operation.is_ready:
+            raise ValueError(f'Operation {op_id} is not ready to be resolved')
+
+        operation.result = result
+        del self._ready[op_id]
+        self._rendered = None
+
+        if operation.parent is not None:
+            parent = self.operations[operation.parent]
+            parent.operands[operation.parent_slot] = result
+            if parent.is_ready:
+                self._ready[parent.op_id] = None
+
+    def resolved_operations(self) -> List[Tuple[int, Number]]:
+        """
+        (op_id, result) of the resolved operations, in an order in which they can be resolved again by restore().
+        """
+        return [(o.op_id, o.result) for o in self.operations if o.is_resolved]
+
+    def restore(self, resolved: List[Tuple[int, Number]]) -> None:
+        """Resolve the operations saved with resolved_operations(), e.g. from a checkpoint."""
+        for op_id, result in resolved:
+            self.resolve(op_id, result)
+
+    def render(self) -> str:
+        """
+        Text form of the partially evaluated expression: resolved operations are replaced by their results.
+        Parentheses are kept wherever they are needed for the text to parse back into the same plan.
+        """
+        if self._rendered is None:
+            if not self.operations:
+                self._rendered = self.numeric.format(self.literal_result)
+            else:
+                self._rendered = self._render_operation(self.operations[-1])
+        return self._rendered
+
+    def render_after(self, resolved: List[Tuple[int, Number]]) -> str:
+        """
+        Text form the expression would have after resolving the given ready operations, leaving the plan unchanged.
+        """
+        saved_ready, saved_rendered = dict(self._ready), self._rendered
+        done: List[int] = []
+        try:
+            for op_id, result in resolved:
+                self.resolve(op_id, result)
+                done.append(op_id)
+            return self.render()
+        finally:
+            for op_id in done:
+                operation = self.operations[op_id]
+                operation.result = None
+                if operation.parent is not None:
+                    self.operations[operation.parent].operands[operation.parent_slot] = None
+            self._ready, self._rendered = saved_ready, saved_rendered
+
+    def _render_operation(self, operation: PlanOperation) -> str:
+        if operation.is_resolved:
+            return self.numeric.format(operation.result)
+
+        parts = []
+        for slot in (0, 1):
+            child_id = operation.inputs[slot]
+            child = self.operations[child_id] if child_id is not None else None
+
+            if child is None or child.is_resolved:
+                value = operation.operands[slot]
+                text = self.numeric.format(value)
+                # Negative numbers are wrapped after an operator, e.g. '10 - (-5)'
+                parts.append(f'({text})' if slot == 1 and value < 0 else text)
+                continue
+
+            text = self._render_operation(child)
+            child_precedence, precedence = PRECEDENCE[child.op], PRECEDENCE[operation.op]
+            if child_precedence < precedence or (slot == 1 and child_precedence == precedence):
+                text = f'({text})'
+            parts.append(text)
+
+        return f'{parts[0]} {operation.op} {parts[1]}'
+
+    def execute(self, step_func: Optional[Callable[[Number, Number, str], Number]] = None,
+                executor: Optional[Executor] = None) -> Number:
+        """
+        Evaluate the remaining operations round by round, performing all ready operations of a round together.
+
+        :param step_func: Function performing a single operation, calculate(a, b, op) of the numeric backend by default
+        :param executor: Optional executor used to run the operations of a round concurrently
+        :return: The result of the expression
+        """
+        step_func = step_func or self.numeric.calculate
+        while not self.is_complete:
+            ready = self.ready()
+            args = [(o.operands[0], o.operands[1], o.op) for o in ready]
+
+            if executor is not None:
+                results = list(executor.map(lambda arg: step_func(*arg), args))
+            else:
+                results = [step_func(*arg) for arg in args]
+
+            for operation, result in zip(ready, results):
+                self.resolve(operation.op_id, result)
+
+        return self.result
+
+    def _close(self, x: Number, y: Number) -> bool:
+        return math.isclose(x, y, rel_tol=self.rel_tol, abs_tol=1e-12)
@@ -0,0 +1,142 @@
+import decimal
+from decimal import Decimal
+from fractions import Fraction
+from typing import Any, Dict, Union
+
+from src.tools.calculator import calculate
+
+Number = Union[int, float, Decimal, Fraction]
+
+NUMERIC_BACKENDS = ('float', 'decimal', 'fraction')
+
+DEFAULT_PRECISION = 28
+
+
+def format_number(x: Number, precision: int = DEFAULT_PRECISION) -> str:
+    """
+    Text form of a number that round-trips exactly (unlike the 6 significant digits of float_to_str).
+    Integral floats are written without the trailing '.0', and very small or large numbers in positional notation,
+    since the expression syntax has no exponents. Fractions with a terminating decimal expansion are written
+    exactly, other fractions with precision significant digits.
+    """
+    if isinstance(x, int):
+        return str(x)
+    if isinstance(x, float):
+        if x.is_integer() and abs(x) < 1e16:
+            return str(int(x))
+        text = repr(x)
+        if 'e' in text:
+            text = format(Decimal(text), 'f')
+        return text
+    if isinstance(x, Fraction):
+        if x.denominator == 1:
+            return str(x.numerator)
+        x = _fraction_to_decimal(x, precision)
+
+    text = format(x, 'f')
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return text
+
+
+def _fraction_to_decimal(x: Fraction, precision: int) -> Decimal:
+    # A denominator 2^i * 5^j gives at most max(i, j) decimals, so enough digits make the division exact
+    denominator, i, j = x.denominator, 0, 0
+    while denominator % 2 == 0:
+        denominator //= 2
+        i += 1
+    while denominator % 5 == 0:
+        denominator //= 5
+        j += 1
+    if denominator == 1:
+        precision = len(str(abs(x.numerator))) + max(i, j)
+
+    with decimal.localcontext(decimal.Context(prec=precision)):
+        return Decimal(x.numerator) / Decimal(x.denominator)
+
+
+def to_json(x: Any) -> Any:
+    """JSON friendly form of a result: exact numbers are written as text, so that no digit is lost."""
+    if isinstance(x, (Decimal, Fraction)):
+        return format_number(x)
+    return x
+
+
+def encode_number(x: Any) -> Dict[str, str]:
+    """json.dump default= hook for exact numbers, reversed by decode_number."""
+    if isinstance(x, Decimal):
+        return {'__decimal__': str(x)}
+    if isinstance(x, Fraction):
+        return {'__fraction__': str(x)}
+    raise TypeError(f'Object of type {type(x).__name__} is not JSON serializable')
+
+
+def decode_number(obj: Dict[str, Any]) -> Any:
+    """json.load object_hook= hook restoring the numbers encoded by encode_number."""
+    if len(obj) == 1:
+        if '__decimal__' in obj:
+            return Decimal(obj['__decimal__'])
+        if '__fraction__' in obj:
+            return Fraction(obj['__fraction__'])
+    return obj
+
+
+class NumericBackend:
+    """
+    Number type used for the calculations of the agents:
+        float: binary floating point (default)
+        decimal: decimal floating point with precision significant digits, so that decimal inputs such as
+                 10.3 + 5.44 are exact and intermediate results print without binary rounding noise
+        fraction: exact rational arithmetic
+    Literals of the expression are parsed into the backend type, and the operands of the LLM steps (JSON numbers)
+    are converted from their shortest text form, i.e. 0.1 becomes Decimal('0.1'), not the binary value of 0.1.
+    """
+    def __init__(self, kind: str = 'float', precision: int = DEFAULT_PRECISION) -> None:
+        if kind not in NUMERIC_BACKENDS:
+            raise ValueError(f'Unsupported numeric backend: {kind}. '
+                             f'Supported backends are {", ".join(NUMERIC_BACKENDS)}.')
+
+        self.kind = kind
+        self.precision = precision
+        self._context = decimal.Context(prec=precision)
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'NumericBackend':
+        numeric_config = config.get('numeric') or {}
+        return cls(numeric_config.get('backend', 'float'), numeric_config.get('precision', DEFAULT_PRECISION))
+
+    @property
+    def is_exact(self) -> bool:
+        return self.kind != 'float'
+
+    def parse(self, text: str) -> Number:
+        """Number literal of an expression."""
+        if self.kind == 'decimal':
+            return Decimal(text)
+        if self.kind == 'fraction':
+            return Fraction(text)
+        return float(text) if '.' in text else int(text)
+
+    def convert(self, x: Number) -> Number:
+        """Number of the backend type for an operand, e.g. from the JSON arguments of a tool call."""
+        if self.kind == 'decimal':
+            if isinstance(x, Decimal):
+                return x
+            return Decimal(repr(x)) if isinstance(x, float) else Decimal(x)
+        if self.kind == 'fraction':
+            if isinstance(x, Fraction):
+                return x
+            return Fraction(repr(x)) if isinstance(x, float) else Fraction(x)
+        return x
+
+    def calculate(self, a: Number, b: Number, op: str) -> Number:
+        """calculate(a, b, op) on the backend type."""
+        if self.kind == 'decimal':
+            with decimal.localcontext(self._context):
+                return calculate(self.convert(a), self.convert(b), op)
+        if self.kind == 'fraction':
+            return calculate(self.convert(a), self.convert(b), op)
+        return calculate(a, b, op)
+
+    def format(self, x: Number) -> str:
+        return format_number(x, self.precision)
@@ -0,0 +1,131 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from src.tools.expression_parser import BinaryOpNode, Node, NumberNode
+from src.tools.expression_plan import COMMUTATIVE_OPS, PRECEDENCE
+from src.tools.numeric import Number
+
+
+def count_operations(node: Node) -> int:
+    if isinstance(node, NumberNode):
+        return 0
+    return 1 + count_operations(node.left) + count_operations(node.right)
+
+
+def tree_depth(node: Node) -> int:
+    """Number of rounds needed to evaluate the tree when all independent operations are performed together."""
+    if isinstance(node, NumberNode):
+        return 0
+    return 1 + max(tree_depth(node.left), tree_depth(node.right))
+
+
+def render_node(node: Node, format_func: Callable[[Number], str]) -> str:
+    """
+    Text form of an expression tree, with parentheses only where they are needed for it to parse back into the
+    same tree (the same rules as ExpressionPlan.render()).
+    """
+    if isinstance(node, NumberNode):
+        return format_func(node.value)
+
+    parts = []
+    for slot, child in enumerate((node.left, node.right)):
+        if isinstance(child, NumberNode):
+            text = format_func(child.value)
+            # Negative numbers are wrapped after an operator, e.g. '10 - (-5)'
+            parts.append(f'({text})' if slot == 1 and child.value < 0 else text)
+            continue
+
+        text = render_node(child, format_func)
+        child_precedence, precedence = PRECEDENCE[child.op], PRECEDENCE[node.op]
+        if child_precedence < precedence or (slot == 1 and child_precedence == precedence):
+            text = f'({text})'
+        parts.append(text)
+
+    return f'{parts[0]} {node.op} {parts[1]}'
+
+
+class SharedSubexpressions:
+    """
+    Sub-expressions (of at least one operation) occurring several times across the expressions of a batch.
+    Sub-expressions are compared by a normalized key: numbers in canonical form, and the operands of + and * in
+    sorted order (swapping them does not change the result, in floating point either), so '2.50 * x' and
+    'x * 2.5' are the same sub-expression. Only maximal shared sub-expressions are selected: one occurring inside
+    a selected one is not selected again for that occurrence.
+    """
+    def __init__(self, trees: Sequence[Optional[Node]], format_func: Callable[[Number], str],
+                 min_occurrences: int = 2) -> None:
+        """
+        :param trees: Parsed expressions; None for expressions that are left out (e.g. could not be parsed)
+        :param format_func: Canonical text of a number, e.g. NumericBackend.format
+        """
+        self.format_func = format_func
+        self.trees = list(trees)   # Also keeps the nodes alive, as they are identified by id()
+
+        counts: Dict[str, int] = {}
+        self._keys: List[Dict[int, str]] = []   # Per tree: id(node) -> key, for its operation nodes
+        for tree in self.trees:
+            keys: Dict[int, str] = {}
+            if tree is not None:
+                self._collect(tree, keys, counts)
+            self._keys.append(keys)
+
+        self.subexpressions: Dict[str, Node] = {}   # key -> first occurrence, in order of first occurrence
+        self.occurrences: List[List[Node]] = []   # Per tree: the selected nodes
+        for tree, keys in zip(self.trees, self._keys):
+            selected: List[Node] = []
+            if tree is not None:
+                self._select(tree, keys, counts, min_occurrences, selected)
+            self.occurrences.append(selected)
+
+    def _collect(self, node: Node, keys: Dict[int, str], counts: Dict[str, int]) -> str:
+        if isinstance(node, NumberNode):
+            return self.format_func(node.value)
+
+        left, right = self._collect(node.left, keys, counts), self._collect(node.right, keys, counts)
+        if node.op in COMMUTATIVE_OPS and right < left:
+            left, right = right, left
+        key = f'({left} {node.op} {right})'
+
+        keys[id(node)] = key
+        counts[key] = counts.get(key, 0) + 1
+        return key
+
+    def _select(self, node: Node, keys: Dict[int, str], counts: Dict[str, int], min_occurrences: int,
+                selected: List[Node]) -> None:
+        if isinstance(node, NumberNode):
+            return
+
+        key = keys[id(node)]
+        if counts[key] >= min_occurrences:
+            self.subexpressions.setdefault(key, node)
+            selected.append(node)
+            return
+
+        self._select(node.left, keys, counts, min_occurrences, selected)
+        self._select(node.right, keys, counts, min_occurrences, selected)
+
+    def texts(self) -> List[str]:
+        """The shared sub-expressions as expression texts, in the order of subexpressions."""
+        return [render_node(node, self.format_func) for node in self.subexpressions.values()]
+
+    def key(self, index: int, node: Node) -> Optional[str]:
+        """Key of an operation node of the tree of expression index (None for numbers)."""
+        return self._keys[index].get(id(node))
+
+    def rewrite(self, index: int, values: Dict[str, Number]) -> Tuple[Optional[Node], int]:
+        """
+        The tree of expression index with its shared sub-expressions replaced by their values, and the number of
+        replacements. Sub-expressions without a value (e.g. they failed) are kept. The tree itself is returned if
+        nothing was replaced.
+        """
+        tree, keys = self.trees[index], self._keys[index]
+        replaced = {id(node): values[keys[id(node)]] for node in self.occurrences[index] if keys[id(node)] in values}
+        if not replaced:
+            return tree, 0
+        return self._replace(tree, replaced), len(replaced)
+
+    def _replace(self, node: Node, replaced: Dict[int, Number]) -> Node:
+        if isinstance(node, NumberNode):
+            return node
+        if id(node) in replaced:
+            return NumberNode(replaced[id(node)])
+        return BinaryOpNode(node.op, self._replace(node.left, replaced), self._replace(node.right, replaced))
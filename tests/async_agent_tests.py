@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from conftest import AsyncScriptClient, REDUCING_CONFIG, STEPWISE_CONFIG, load_config
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+
+
+script = {
+    '2 * 3 + 4': (2, 3, '*', False),
+    '6 + 4': (6, 4, '+', True),
+    '7 / 2': (7, 2, '/', True),
+}
+
+
+def test_reducing_agent_arun():
+    agent = ReducingCalculatorAgent(AsyncScriptClient(script), load_config(REDUCING_CONFIG))
+    result = asyncio.run(agent.arun('2 * 3 + 4'))
+    assert result == 10
+
+
+def test_stepwise_agent_arun():
+    agent = StepwiseCalculatorAgent(AsyncScriptClient(script), load_config(STEPWISE_CONFIG))
+    result = asyncio.run(agent.arun('7 / 2'))
+    assert result == 3.5
+
+
+def test_arun_many_respects_concurrency_limit():
+    client = AsyncScriptClient(script)
+    config = load_config(REDUCING_CONFIG, max_concurrency=3)
+    agent = ReducingCalculatorAgent(client, config)
+
+    expressions = ['2 * 3 + 4', '7 / 2'] * 10
+    results = asyncio.run(agent.arun_many(expressions))
+
+    assert results == [10, 3.5] * 10
+    assert 1 < client.max_in_flight <= 3
+
+
+def test_arun_many_return_exceptions():
+    agent = ReducingCalculatorAgent(AsyncScriptClient(script), load_config(REDUCING_CONFIG))
+
+    results = asyncio.run(agent.arun_many(['7 / 2', 'a + b'], return_exceptions=True))
+
+    assert results[0] == 3.5
+    assert isinstance(results[1], ValueError)
+
+    with pytest.raises(ValueError):
+        asyncio.run(agent.arun_many(['7 / 2', 'a + b']))
@@ -0,0 +1,49 @@
+import pytest
+
+from conftest import ScriptClient, load_config
+from src.agents.batch import run_batch
+from src.agents.reducing_agent import ReducingCalculatorAgent
+
+
+@pytest.fixture
+def agent():
+    config = load_config(max_llm_calls=3)
+
+    script = {
+        '2 * 3 + 4': (2, 3, '*', False),
+        '6 + 4': (6, 4, '+', True),
+        '7 / 2': (7, 2, '/', True),
+        '1 / 0': (1, 0, '/', True),
+        '1 + 1 + 1': (5, 5, '+', False),   # Never matches --> hits max_llm_calls
+    }
+    return ReducingCalculatorAgent(ScriptClient(script), config)
+
+
+def test_run_many_keeps_order_and_collects_errors(agent):
+    expressions = ['2 * 3 + 4', 'a + b', '7 / 2', '1 / 0', '1 + 1 + 1']
+
+    report = agent.run_many(expressions, max_workers=4)
+
+    assert [item.expression for item in report.items] == expressions
+    assert report.results == [10, None, 3.5, None, None]
+    assert report.num_succeeded == 2
+    assert report.num_failed == 3
+
+    assert isinstance(report.items[1].error, ValueError)
+    assert isinstance(report.items[3].error, ZeroDivisionError)
+    assert isinstance(report.items[4].error, RuntimeError)
+
+
+def test_batch_report_timing():
+    report = run_batch(lambda expression: 1.0, ['1'] * 20, max_workers=2)
+
+    assert len(report.items) == 20
+    assert all(item.latency >= 0 for item in report.items)
+    assert report.throughput > 0
+    assert report.latency_percentile(50) <= report.latency_percentile(100)
+    assert '20 expressions' in report.summary()
+
+
+def test_invalid_max_workers():
+    with pytest.raises(ValueError):
+        run_batch(lambda expression: 1.0, ['1'], max_workers=0)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from conftest import load_config
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.tools.calculator import calculate
+from src.tools.calculator_batch import (ERROR_NONE, ERROR_UNSUPPORTED_OP, ERROR_ZERO_DIVISION, calculate_batch,
+                                        execute_plans_batch)
+from src.tools.expression_plan import ExpressionPlan
+
+
+def test_calculate_batch_matches_scalar():
+    a = [1, -5, 2.5, 7.5, 1_000_000_000]
+    b = [2, 3, 2.0, 2.5, 2]
+    ops = ['+', '-', '*', '/', '*']
+
+    batch = calculate_batch(a, b, ops)
+
+    assert batch.results.tolist() == [calculate(x, y, op) for x, y, op in zip(a, b, ops)]
+    assert batch.num_errors == 0
+
+
+def test_calculate_batch_errors():
+    batch = calculate_batch([1, 5, 6], [0, 3, 3], ['/', '^', '/'])
+
+    assert batch.errors.tolist() == [ERROR_ZERO_DIVISION, ERROR_UNSUPPORTED_OP, ERROR_NONE]
+    assert np.isnan(batch.results[0]) and np.isnan(batch.results[1])
+    assert batch.results[2] == 2
+    assert 'Division by zero' in batch.error_message(0)
+
+
+def test_calculate_batch_shape_mismatch():
+    with pytest.raises(ValueError):
+        calculate_batch([1, 2], [1], ['+', '+'])
+
+
+def test_execute_plans_batch():
+    expressions = ['10 + 5 * 3 - 8 / 2', '(10 + 5) * 3 - 20 / 4', '1 / (2 - 2)', '42']
+    outcomes = execute_plans_batch([ExpressionPlan.from_expression(e) for e in expressions])
+
+    assert outcomes[0] == 21
+    assert outcomes[1] == 40
+    assert isinstance(outcomes[2], ZeroDivisionError)
+    assert outcomes[3] == 42
+
+
+def test_run_many_local_mode_is_vectorized():
+    config = load_config(evaluation_mode='local')
+
+    agent = ReducingCalculatorAgent(None, config)   # The LLM is never needed for these expressions
+    report = agent.run_many(['2 * 3 + 4', 'a + b', '1 / 0', '7 / 2'])
+
+    assert report.results == [10, None, None, 3.5]
+    assert isinstance(report.items[1].error, ValueError)
+    assert isinstance(report.items[2].error, ZeroDivisionError)
+
+
+def test_run_many_local_mode_matches_run():
+    config = load_config(evaluation_mode='local', result_cache={'backend': 'memory'})
+
+    agent = ReducingCalculatorAgent(None, config)
+    expressions = ['1 + 2', '9007199254740993 + 0', '7 / 2 * 4', '0.1 + 0.2', '3 * 1.5']
+    report = agent.run_many(expressions)
+
+    assert report.results == [agent.run(e) for e in expressions]
+    assert [type(result) for result in report.results[:2]] == [int, int]
+    assert report.results[1] == 9007199254740993   # Beyond float64 precision
+
+    # Results are stored to the cache, and cached results are returned without evaluating the expressions
+    agent.result_cache.set(agent._cache_key('result', '5 - 1'), 99)
+    assert agent.run_many(['5 - 1', '1 + 2']).results == [99, 3]
+    assert agent._get_cached_result('0.1 + 0.2') == 0.1 + 0.2
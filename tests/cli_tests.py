@@ -0,0 +1,149 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+
+from src.cli import StreamPipeline, create_agent, load_config, main, parse_line
+
+
+def run_pipeline(agent, lines, **kwargs):
+    output = io.StringIO()
+    summary = StreamPipeline(agent, output, **kwargs).run(lines)
+    return [json.loads(line) for line in output.getvalue().splitlines()], summary
+
+
+def scripted_agent(agent_name='reducing'):
+    return create_agent(agent_name, load_config(agent_name), 'scripted')
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("2 + 3\n", (None, "2 + 3")),
+    ("   \n", None),
+    ("# comment\n", None),
+    ('{"id": 7, "expression": "2 + 3"}\n', (7, "2 + 3")),
+    ('{"expression": "2 + 3"}', (None, "2 + 3")),
+])
+def test_parse_line(line, expected):
+    assert parse_line(line) == expected
+
+
+def test_parse_line_errors():
+    with pytest.raises(ValueError):
+        parse_line('{"expression": ', 'auto')
+    with pytest.raises(KeyError):
+        parse_line('{"id": 1}', 'jsonl')
+    with pytest.raises(ValueError):
+        parse_line('2 + 3', 'jsonl')
+    for line in ('[1, 2]', '"2 + 3"', '3', '{"expression": 5}', '{"expression": null}'):
+        with pytest.raises(ValueError):
+            parse_line(line, 'jsonl')
+
+
+def test_pipeline_reports_jsonl_lines_that_are_not_objects():
+    lines = ['[1, 2]', '"x"', '3', '{"id": 4, "expression": "1 + 2"}']
+    records, summary = run_pipeline(scripted_agent('reducing'), lines, input_format='jsonl')
+
+    assert [r['result'] for r in records] == [None, None, None, 3]
+    assert all(r['error'].startswith('ValueError') for r in records[:3])
+    assert summary['count'] == 4 and summary['errors'] == 3
+
+
+@pytest.mark.parametrize("agent_name", ['reducing', 'stepwise'])
+def test_pipeline_ordered_results(agent_name):
+    lines = ['2 * (3 + 4)', '{"id": "b", "expression": "10 / (1 + 4)"}', 'foo', '10 / (5 - 5)', '6 + 4']
+    records, summary = run_pipeline(scripted_agent(agent_name), lines, max_workers=4, ordered=True)
+
+    assert [r['index'] for r in records] == [0, 1, 2, 3, 4]
+    assert [r['result'] for r in records] == [14, 2, None, None, 10]
+    assert records[1]['id'] == 'b'
+    assert records[2]['error'].startswith('ValueError')
+    assert records[3]['error'].startswith('ZeroDivisionError')
+    assert summary['count'] == 5 and summary['errors'] == 2
+
+
+class SlowAgent:
+    """Agent stand-in that tracks how many expressions are evaluated concurrently."""
+    max_expression_length = 100
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def run(self, expression):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.002)
+        with self.lock:
+            self.running -= 1
+        return int(expression)
+
+
+def test_pipeline_bounds_lines_in_flight():
+    read = []
+    output = io.StringIO()
+    max_ahead = [0]
+
+    def lines():
+        for i in range(200):
+            read.append(i)
+            written = output.getvalue().count('\n')
+            max_ahead[0] = max(max_ahead[0], len(read) - written)
+            yield str(i)
+
+    agent = SlowAgent()
+    summary = StreamPipeline(agent, output, max_workers=4, max_in_flight=8).run(lines())
+
+    assert summary['count'] == 200
+    assert agent.max_running <= 4
+    assert max_ahead[0] <= 8 + 1   # The line being read is not yet counted as in flight
+    assert sorted(json.loads(line)['result'] for line in output.getvalue().splitlines()) == list(range(200))
+
+
+class FailingOutput(io.StringIO):
+    """Output failing after max_lines lines, e.g. a full disk."""
+    def __init__(self, max_lines):
+        super().__init__()
+        self.max_lines = max_lines
+
+    def write(self, text):
+        if self.getvalue().count('\n') >= self.max_lines:
+            raise OSError('No space left on device')
+        return super().write(text)
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_pipeline_raises_write_errors(ordered):
+    output = FailingOutput(max_lines=5)
+    pipeline = StreamPipeline(SlowAgent(), output, max_workers=2, max_in_flight=4, ordered=ordered)
+    errors = []
+
+    def run():
+        try:
+            pipeline.run(str(i) for i in range(100))
+        except OSError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()   # The reader is not left waiting for slots of the failed writer
+    assert [str(e) for e in errors] == ['No space left on device']
+    assert pipeline.num_items == 5
+
+
+def test_main_local_mode(tmp_path, capsys):
+    input_path = tmp_path / 'input.txt'
+    output_path = tmp_path / 'output.jsonl'
+    input_path.write_text('2 * (3 + 4)\n1 + 2\n')
+
+    exit_code = main([str(input_path), '-o', str(output_path), '--evaluation-mode', 'local', '--ordered',
+                      '--summary'])
+
+    assert exit_code == 0
+    assert [json.loads(line)['result'] for line in output_path.read_text().splitlines()] == [14, 3]
+    assert json.loads(capsys.readouterr().err)['count'] == 2
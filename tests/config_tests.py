@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import yaml
+
+import src.config
+from src.config import clear_cache, compiled_path, load_config_file
+
+CONFIG_FILES = ['config/stepwise_agent_config.yaml', 'config/reducing_agent_config.yaml']
+
+MINIMAL_CONFIG = """
+model: gpt-4o
+max_llm_calls: 10
+max_expression_length: 100
+system_prompt: You are a calculator agent.
+tool_definitions: []
+"""
+
+
+def write_config(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.mark.parametrize("config_file", CONFIG_FILES)
+def test_load_config_file(config_file):
+    assert load_config_file(config_file) == yaml.safe_load(open(config_file))
+
+
+def test_configs_are_copies(tmp_path):
+    path = write_config(tmp_path / 'config.yaml', MINIMAL_CONFIG)
+
+    config = load_config_file(path)
+    config['model'] = 'changed'
+    config['tool_definitions'].append({})
+
+    assert load_config_file(path) == yaml.safe_load(MINIMAL_CONFIG)
+
+
+def test_compiled_config_is_used_until_the_file_changes(tmp_path, monkeypatch):
+    path = write_config(tmp_path / 'config.yaml', MINIMAL_CONFIG)
+    load_config_file(path)
+    assert os.path.exists(compiled_path(path))
+
+    # A new process (empty memory cache) loads the compiled config without parsing the YAML
+    clear_cache()
+    monkeypatch.setattr(src.config, '_compile', None)
+    assert load_config_file(path)['max_llm_calls'] == 10
+    monkeypatch.undo()
+
+    write_config(tmp_path / 'config.yaml', MINIMAL_CONFIG.replace('max_llm_calls: 10', 'max_llm_calls: 200'))
+    assert load_config_file(path)['max_llm_calls'] == 200
+
+    clear_cache()
+    assert load_config_file(path)['max_llm_calls'] == 200
+
+
+@pytest.mark.parametrize("text, message", [
+    ('- a list', 'mapping'),
+    (MINIMAL_CONFIG.replace('model: gpt-4o', ''), 'model'),
+    (MINIMAL_CONFIG.replace('max_llm_calls: 10', 'max_llm_calls: 0'), 'max_llm_calls'),
+    (MINIMAL_CONFIG.replace('system_prompt: You are a calculator agent.', ''), 'system prompt'),
+])
+def test_invalid_configs(tmp_path, text, message):
+    with pytest.raises(ValueError, match=message):
+        load_config_file(write_config(tmp_path / 'config.yaml', text))
+
+
+def test_agents_do_not_import_the_sdk():
+    code = ('import sys; import src.agents.reducing_agent, src.agents.stepwise_agent, src.llm.chatgpt, src.cli; '
+            'print(sorted(m for m in ("openai", "yaml", "numpy") if m in sys.modules))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == '[]'
@@ -0,0 +1,99 @@
+"""
+Helpers shared by the tests: the agent configs, scripted LLM responses and the offline clients answering with them.
+"""
+import asyncio
+import json
+
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+from src.config import load_config_file
+from src.llm.llm_base import AsyncLLMClientBase, LLMClientBase
+from src.llm.messages import AssistantMessage, FunctionCall, ToolCall
+from src.llm.scripted import ScriptedCalculatorClient
+
+REDUCING_CONFIG = 'config/reducing_agent_config.yaml'
+STEPWISE_CONFIG = 'config/stepwise_agent_config.yaml'
+
+AGENTS = [
+    (StepwiseCalculatorAgent, STEPWISE_CONFIG),
+    (ReducingCalculatorAgent, REDUCING_CONFIG),
+]
+
+
+def load_config(config_file=REDUCING_CONFIG, **overrides):
+    """An agent config, loaded as the CLI does, with verbose output off and the given keys overridden."""
+    config = load_config_file(config_file)
+    config['verbose'] = False
+    config.update(overrides)
+    return config
+
+
+def make_response(*calls):
+    """An assistant message with one calculate tool call per (a, b, op, is_final_step) tuple."""
+    tool_calls = []
+    for n, (a, b, op, is_final_step) in enumerate(calls):
+        arguments = json.dumps({'a': a, 'b': b, 'op': op, 'is_final_step': is_final_step})
+        tool_calls.append(ToolCall(f'call_{n}', FunctionCall('calculate', arguments)))
+    return AssistantMessage(tool_calls=tool_calls)
+
+
+def scripted_step(script, msg_history):
+    """The step scripted for the (reduced) expression found in the last user message."""
+    content = ' '.join(msg_history.get_messages()[-1]['content'].split())
+    for expression, step in script.items():
+        if f': {expression}.' in content:
+            return make_response(step)
+    raise AssertionError(f'Unexpected prompt: {content}')
+
+
+class ScriptClient(LLMClientBase):
+    """Answers with a scripted step for each (reduced) expression found in the last user message."""
+    def __init__(self, script):
+        self.script = script
+
+    def run_prompt(self, msg_history):
+        return scripted_step(self.script, msg_history)
+
+
+class AsyncScriptClient(AsyncLLMClientBase):
+    """Async ScriptClient, taking delay seconds per call and recording how many calls were in flight at most."""
+    def __init__(self, script, delay=0.01):
+        self.script = script
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def run_prompt(self, msg_history):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return scripted_step(self.script, msg_history)
+
+
+class ResponseListClient(LLMClientBase):
+    """Returns the given responses in order, recording the prompts it was given."""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    def run_prompt(self, msg_history):
+        self.prompts.append(list(msg_history.get_messages()))
+        return self.responses.pop(0)
+
+
+class AsyncScriptedClient(AsyncLLMClientBase):
+    """Async ScriptedCalculatorClient, taking delay seconds per call."""
+    def __init__(self, delay=0.0, **kwargs):
+        self.client = ScriptedCalculatorClient(**kwargs)
+        self.delay = delay
+        self.closed = False
+
+    async def run_prompt(self, msg_history):
+        await asyncio.sleep(self.delay)
+        return self.client.run_prompt(msg_history)
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,39 @@
+import pytest
+
+from src.tools.expression_parser import (BinaryOpNode, ExpressionSyntaxError, NumberNode, evaluate_expression,
+                                         parse_expression)
+
+
+@pytest.mark.parametrize("expression, expected_result", [
+    ("2 + 3", 5),
+    ("2 * 3 + 4", 10),
+    ("2.67 * 3.82 + 4.77", 14.9694),
+    ("(3 + 2) * 4", 20),
+    ("1000000 + 2000000", 3000000),
+    ("0.0001 + 0.0002", 0.0003),
+    ("-5 * 3", -15),
+    ("7 / 2", 3.5),
+    ("2 * 3 + 4 / 2 - 1", 7),
+    ("(10 + 5) * 3 - 20 / 4", 40),
+    ("10 - 4 - 3", 3),
+    ("8 / 4 / 2", 1),
+    ("-(2 + 3) * 2", -10),
+    ("10.3 + 5.44 * 3.1 - 8.776 / 2.2 * 3.44 + 1.23", 10.3 + 5.44 * 3.1 - 8.776 / 2.2 * 3.44 + 1.23),
+])
+def test_evaluate_expression(expression, expected_result):
+    assert pytest.approx(evaluate_expression(expression), rel=1e-9) == expected_result
+
+
+def test_precedence_tree():
+    assert parse_expression("1 + 2 * 3") == BinaryOpNode('+', NumberNode(1), BinaryOpNode('*', NumberNode(2), NumberNode(3)))
+
+
+@pytest.mark.parametrize("expression", ["", "2 +", "(2 + 3", "2 + 3)", "2 3", "* 2", "()", "1..2"])
+def test_syntax_errors(expression):
+    with pytest.raises(ExpressionSyntaxError):
+        parse_expression(expression)
+
+
+def test_zero_division():
+    with pytest.raises(ZeroDivisionError):
+        evaluate_expression("1 / (2 - 2)")
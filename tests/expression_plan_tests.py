@@ -0,0 +1,110 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import REDUCING_CONFIG, STEPWISE_CONFIG, ResponseListClient, load_config, make_response
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+from src.tools.expression_plan import ExpressionPlan
+
+
+def test_plan_levels():
+    plan = ExpressionPlan.from_expression('10 + 5 * 3 - 8 / 2')
+
+    assert plan.num_operations == 4
+    assert plan.depth == 3
+    assert sorted((o.operands[0], o.op, o.operands[1]) for o in plan.ready()) == [(5, '*', 3), (8, '/', 2)]
+
+
+def test_plan_match_and_resolve():
+    plan = ExpressionPlan.from_expression('10 + 5 * 3 - 8 / 2')
+
+    assert plan.match(10, 5, '+') is None   # Out of order: 5 * 3 must be calculated first
+    assert plan.match(5, 3, '-') is None
+
+    operation = plan.match(3, 5, '*')   # Commutative operands are accepted in either order
+    plan.resolve(operation.op_id, 15)
+
+    assert plan.match(10, 15, '+') is not None
+    assert plan.match(15, 10, '-') is None
+    assert not plan.is_complete
+
+
+@pytest.mark.parametrize("expression, expected_result", [
+    ("2 + 3", 5),
+    ("(10 + 5) * 3 - 20 / 4", 40),
+    ("1 + 2 + 3 + 4 + 5 + 6 + 7 + 8", 36),
+    ("42", 42),
+])
+def test_plan_execute(expression, expected_result):
+    assert ExpressionPlan.from_expression(expression).execute() == expected_result
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert ExpressionPlan.from_expression(expression).execute(executor=executor) == expected_result
+
+
+def test_balanced_expression_depth():
+    plan = ExpressionPlan.from_expression('(1 + 2) * (3 + 4) - (5 + 6) * (7 + 8)')
+    assert plan.num_operations == 7
+    assert plan.depth == 3
+
+
+@pytest.mark.parametrize("agent_class, config_file", [
+    (ReducingCalculatorAgent, REDUCING_CONFIG),
+    (StepwiseCalculatorAgent, STEPWISE_CONFIG),
+])
+def test_agent_rejects_out_of_order_steps(agent_class, config_file):
+    config = load_config(config_file, plan_steps=True, append_messages=True)
+
+    client = ResponseListClient([
+        make_response((2, 3, '+', False)),   # Wrong: 3 * 4 has to be calculated first
+        make_response((3, 4, '*', True)),    # Claims to be final, but the plan is not complete
+        make_response((2, 12, '+', False)),  # Completes the plan
+    ])
+    agent = agent_class(client, config)
+
+    assert agent.run('2 + 3 * 4') == 14
+    assert len(client.prompts) == 3
+
+
+@pytest.mark.parametrize("expression", [
+    "10 + 5 * 3 - 8 / 2",
+    "(10 + 5) * 3 - 20 / 4",
+    "2 - (3 - 4)",
+    "2 * (3 * 4)",
+    "10 - -5",
+    "-(2 + 3) * 2",
+])
+def test_render_round_trips(expression):
+    plan = ExpressionPlan.from_expression(expression)
+    assert ExpressionPlan.from_expression(plan.render()).execute() == plan.execute()
+
+
+def test_render_after_steps_keeps_full_precision():
+    plan = ExpressionPlan.from_expression('1 / 3 + 10 - 4')
+    plan.resolve(plan.match(1, 3, '/').op_id, 1 / 3)
+
+    assert plan.render() == '0.3333333333333333 + 10 - 4'
+    assert plan.match(0.333333, 10, '+') is not None   # Operands rounded by the LLM still match
+
+
+def test_render_small_results_without_exponent():
+    plan = ExpressionPlan.from_expression('1 / 100000 - 2')
+    plan.resolve(plan.match(1, 100000, '/').op_id, 1 / 100000)
+
+    assert plan.render() == '0.00001 - 2'
+    assert ExpressionPlan.from_expression(plan.render()).execute() == 1 / 100000 - 2
+
+
+def test_reducing_agent_never_applies_unmatched_steps():
+    config = load_config(plan_steps=False)   # The reducing agent always reduces through the parsed expression
+
+    client = ResponseListClient([
+        make_response((2, 3, '+', True)),    # The regex reducer would have turned this into '5 * 4'
+        make_response((3, 4, '*', False)),
+        make_response((2, 12, '+', False)),
+    ])
+    agent = ReducingCalculatorAgent(client, config)
+
+    assert agent.run('2 + 3 * 4') == 14
+    assert ': 2 + 12.' in ' '.join(client.prompts[2][-1]['content'].split())
@@ -0,0 +1,237 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import load_config
+from src.agents.metrics import AgentMetrics
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.llm.chatgpt import AsyncChatGPTClient, ChatGPTClient, ChatGPTError, MessageHistory
+from src.llm.resilience import LatencyTracker, RetryPolicy, acall_hedged, call_hedged, retry_after_seconds
+
+
+def completion_body(a, b, op, is_final_step):
+    arguments = json.dumps({'a': a, 'b': b, 'op': op, 'is_final_step': is_final_step})
+    return {
+        'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4o',
+        'choices': [{
+            'index': 0, 'finish_reason': 'tool_calls',
+            'message': {'role': 'assistant', 'content': None, 'tool_calls': [
+                {'id': 'call_1', 'type': 'function', 'function': {'name': 'calculate', 'arguments': arguments}}]},
+        }],
+        'usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15},
+    }
+
+
+class StubServer:
+    """
+    Local chat completions endpoint, answering with the scripted (status, headers, body, delay) responses in order;
+    the last one is repeated.
+    """
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub.lock:
+                    index = min(stub.requests, len(stub.responses) - 1)
+                    stub.requests += 1
+                status, headers, body, delay = stub.responses[index]
+                time.sleep(delay)
+
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}/v1'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def stub_config(base_url, **http_overrides):
+    config = load_config(api_key='test-key', tool_call_required='required')
+    config['http'].update({'base_url': base_url, 'backoff_base': 0.01, **http_overrides})
+    return config
+
+
+RATE_LIMITED = (429, {'Retry-After': '0'}, {'error': {'message': 'Rate limit reached', 'type': 'requests'}}, 0)
+SERVER_ERROR = (503, {}, {'error': {'message': 'Overloaded', 'type': 'server_error'}}, 0)
+BAD_REQUEST = (400, {}, {'error': {'message': 'Bad request', 'type': 'invalid_request_error'}}, 0)
+
+
+def test_retries_transient_errors():
+    with StubServer([RATE_LIMITED, SERVER_ERROR, (200, {}, completion_body(6, 4, '+', True), 0)]) as stub:
+        metrics = AgentMetrics()
+        client = ChatGPTClient(stub_config(stub.base_url), metrics)
+        agent = ReducingCalculatorAgent(client, stub_config(stub.base_url), metrics=metrics)
+
+        assert agent.run('6 + 4') == 10
+        assert stub.requests == 3
+        assert metrics.counters['llm_retries'] == 2
+        assert metrics.counters['prompt_tokens'] == 10
+
+
+def test_gives_up_after_max_retries():
+    with StubServer([SERVER_ERROR]) as stub:
+        client = ChatGPTClient(stub_config(stub.base_url, max_retries=2))
+
+        with pytest.raises(ChatGPTError):
+            client.run_prompt(MessageHistory())
+        assert stub.requests == 3
+
+
+def test_does_not_retry_client_errors():
+    with StubServer([BAD_REQUEST]) as stub:
+        client = ChatGPTClient(stub_config(stub.base_url))
+
+        with pytest.raises(ChatGPTError):
+            client.run_prompt(MessageHistory())
+        assert stub.requests == 1
+
+
+def test_async_client_retries():
+    with StubServer([RATE_LIMITED, (200, {}, completion_body(6, 4, '+', True), 0)]) as stub:
+        client = AsyncChatGPTClient(stub_config(stub.base_url))
+
+        response = asyncio.run(client.run_prompt(MessageHistory()))
+        assert json.loads(response.tool_calls[0].function.arguments)['a'] == 6
+        assert stub.requests == 2
+
+
+def test_hedged_request_returns_fast_duplicate():
+    slow = (200, {}, completion_body(1, 1, '+', True), 1.0)
+    fast = (200, {}, completion_body(2, 2, '+', True), 0)
+    with StubServer([slow, fast]) as stub:
+        metrics = AgentMetrics()
+        client = ChatGPTClient(stub_config(stub.base_url, hedge=True), metrics)
+        for _ in range(20):
+            client.latency_tracker.observe(0.05)
+
+        start = time.perf_counter()
+        response = client.run_prompt(MessageHistory())
+
+        assert time.perf_counter() - start < 0.9
+        assert json.loads(response.tool_calls[0].function.arguments)['a'] == 2
+        assert metrics.counters['llm_hedges'] == 1
+
+
+def test_closing_the_agent_stops_the_hedge_threads():
+    with StubServer([(200, {}, completion_body(6, 4, '+', True), 0)]) as stub:
+        client = ChatGPTClient(stub_config(stub.base_url, hedge=True))
+        for _ in range(20):
+            client.latency_tracker.observe(0.05)
+
+        with ReducingCalculatorAgent(client, stub_config(stub.base_url)) as agent:
+            assert agent.run('6 + 4') == 10
+            hedge_threads = [thread for thread in threading.enumerate() if thread.name.startswith('llm-hedge')]
+            assert hedge_threads
+
+        for thread in hedge_threads:
+            thread.join(timeout=5)
+        assert not any(thread.is_alive() for thread in hedge_threads)
+
+
+def test_async_client_closes_its_connections():
+    with StubServer([(200, {}, completion_body(6, 4, '+', True), 0)]) as stub:
+        async def main():
+            async with AsyncChatGPTClient(stub_config(stub.base_url)) as client:
+                await client.run_prompt(MessageHistory())
+            return client
+
+        assert asyncio.run(main()).client.is_closed()
+
+
+def test_retry_after_header():
+    def error(headers):
+        return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+    assert retry_after_seconds(error({'retry-after': '2'})) == 2
+    assert retry_after_seconds(error({'retry-after-ms': '250', 'retry-after': '2'})) == 0.25
+    assert retry_after_seconds(error({'retry-after': 'Thu, 01 Jan 1970 00:00:00 GMT'})) == 0
+    assert retry_after_seconds(error({})) is None
+    assert retry_after_seconds(ValueError()) is None
+
+
+def test_retry_policy_backoff():
+    policy = RetryPolicy(backoff_base=1.0, backoff_max=5.0)
+    for attempt in range(10):
+        assert 0 <= policy.delay(attempt, ValueError()) <= min(5.0, 2 ** attempt)
+
+    retry_after = SimpleNamespace(response=SimpleNamespace(headers={'retry-after': '60'}))
+    assert policy.delay(0, retry_after) == 5.0   # Capped at backoff_max
+
+
+def test_latency_tracker():
+    tracker = LatencyTracker(min_samples=10)
+    for i in range(9):
+        tracker.observe(i)
+    assert tracker.hedge_delay() is None
+
+    for i in range(9, 100):
+        tracker.observe(i)
+    assert tracker.hedge_delay() == 94
+
+
+def test_call_hedged_falls_back_to_successful_request():
+    calls = []
+
+    def func():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(0.05)
+            raise RuntimeError('primary failed')
+        return 'backup'
+
+    with ThreadPoolExecutor(2) as executor:
+        assert call_hedged(func, 0.01, executor) == 'backup'
+        assert call_hedged(lambda: 'direct', None, executor) == 'direct'
+
+
+def test_acall_hedged_cancels_slow_request():
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+            return 'slow'
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    responses = iter([slow, lambda: asyncio.sleep(0, 'fast')])
+
+    async def run():
+        result = await acall_hedged(lambda: next(responses)(), 0.01)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == 'fast'
+    assert cancelled == [True]
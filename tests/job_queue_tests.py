@@ -0,0 +1,169 @@
+import json
+from fractions import Fraction
+
+import pytest
+
+from src.agents.job_queue import JobQueue
+from src.jobs import main, run_workers, work
+
+EXPRESSIONS = ['2 * (3 + 4)', '10 / (5 - 5)', 'foo', '(2 + 3) * 4 - 10 / (1 + 4)', '1 + 2 + 3']
+
+
+def test_enqueue_skips_duplicates(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    assert queue.enqueue(['1 + 2', '3 * 4', '1 + 2']) == 2
+    assert queue.enqueue(['3 * 4', '5 - 6']) == 1
+    assert queue.counts() == {'pending': 3, 'leased': 0, 'done': 0, 'failed': 0}
+
+
+def test_enqueue_rejects_expressions_that_are_not_strings(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    for expression in (5, None):
+        with pytest.raises(ValueError, match='must be a string'):
+            queue.enqueue([('a', '1 + 2'), ('b', expression)])
+    assert queue.counts()['pending'] == 0   # The whole enqueue is rolled back
+
+
+def test_leases_are_exclusive_until_they_expire(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.enqueue(['1 + 2', '3 * 4'])
+
+    first = queue.lease('worker-1', max_jobs=1)
+    second = queue.lease('worker-2', max_jobs=5)
+    assert [job.expression for job in first + second] == ['1 + 2', '3 * 4']
+    assert queue.lease('worker-3') == []
+
+    # worker-1 stalls: once its lease expires, the job is leased again, and only one completion counts
+    expired = JobQueue(str(tmp_path), lease_seconds=-1)
+    expired.enqueue(['5 - 6'])
+    stalled = expired.lease('worker-1')
+    retried = expired.lease('worker-2')
+    assert [job.job_id for job in retried] == [job.job_id for job in stalled]
+    assert retried[0].attempts == 2
+
+    assert expired.complete(retried[0], 4)
+    assert not expired.complete(stalled[0], 5)
+    assert [record['result'] for record in expired.results()] == [4]
+
+
+def test_jobs_that_kill_their_workers_fail_after_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path), lease_seconds=-1, max_attempts=2)   # Every lease has expired right away
+    queue.enqueue(['1 + 2'])
+
+    assert [job.attempts for job in queue.lease('worker-1') + queue.lease('worker-2')] == [1, 2]
+    assert queue.counts()['failed'] == 1
+    assert queue.lease('worker-3') == []
+
+    [record] = queue.results()
+    assert record['error'].startswith('Lease expired') and record['attempts'] == 2
+
+
+def test_stale_worker_cannot_fail_a_job_leased_again(tmp_path):
+    queue = JobQueue(str(tmp_path), lease_seconds=-1)
+    queue.enqueue(['1 + 2'])
+    [stalled] = queue.lease('worker-1')
+    [current] = queue.lease('worker-2')
+
+    queue.fail(stalled, 'ChatGPTError: API error', retry=False)
+    assert queue.counts()['failed'] == 0
+    assert queue.complete(current, 3)
+    assert [record['result'] for record in queue.results()] == [3]
+
+
+def test_input_ids_are_kept_per_expression(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    assert queue.enqueue([('a', '1 + 2'), ('b', '3 * 4'), ('c', '1 + 2'), (None, '1 + 2')]) == 2
+    assert queue.enqueue([('a', '1 + 2'), ('d', '5 - 6')]) == 1   # Enqueueing 'a' again adds nothing
+
+    for job in queue.lease('worker', max_jobs=3):
+        queue.complete(job, 0)
+    assert [record['ids'] for record in queue.results()] == [['a', 'c'], ['b'], ['d']]
+
+
+def test_failed_jobs_are_retried_up_to_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path), max_attempts=2)
+    queue.enqueue(['1 + 2', 'foo'])
+
+    api_error, invalid = queue.lease('worker', max_jobs=2)
+    queue.fail(api_error, 'ChatGPTError: API error')
+    queue.fail(invalid, 'ValueError: invalid expression', retry=False)
+    assert queue.counts() == {'pending': 1, 'leased': 0, 'done': 0, 'failed': 1}
+
+    [api_error] = queue.lease('worker')
+    queue.fail(api_error, 'ChatGPTError: API error')
+    assert queue.counts()['failed'] == 2
+    assert queue.lease('worker') == []
+
+
+def test_exact_results_are_stored_exactly(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.enqueue(['1 / 3'])
+    [job] = queue.lease('worker')
+    queue.complete(job, Fraction(1, 3), llm_calls=1, latency=0.5)
+
+    [record] = queue.results()
+    assert record['result'] == Fraction(1, 3)
+    assert record['llm_calls'] == 1 and record['attempts'] == 1
+
+
+def test_work_drains_the_queue(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.enqueue(EXPRESSIONS)
+
+    assert work(str(tmp_path), client_name='scripted', max_jobs=2)['completed'] == 1
+    summary = work(str(tmp_path), client_name='scripted')
+    assert (summary['completed'], summary['failed'], summary['retried']) == (2, 1, 0)
+
+    records = list(queue.results())
+    assert [record['result'] for record in records] == [14, None, None, 18, 6]
+    assert records[1]['error'].startswith('ZeroDivisionError')
+    assert records[3]['llm_calls'] == 5
+
+
+def test_worker_processes(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    queue.enqueue(f'{n} * (3 + 4)' for n in range(40))
+
+    summaries = run_workers(str(tmp_path), processes=2, client_name='scripted')
+    assert sum(summary['completed'] + summary['duplicates'] for summary in summaries) == 40
+    assert len({summary['worker'] for summary in summaries}) == 2
+    assert sorted(record['result'] for record in queue.results()) == [7 * n for n in range(40)]
+
+
+def test_command_line(tmp_path, capsys):
+    queue_dir, input_path, output_path = str(tmp_path / 'queue'), tmp_path / 'input.txt', tmp_path / 'out.jsonl'
+    input_path.write_text('\n'.join(EXPRESSIONS + ['# comment', '2 * (3 + 4)']) + '\n')
+
+    assert main(['enqueue', queue_dir, str(input_path)]) == 0
+    assert json.loads(capsys.readouterr().out) == {'added': 5, 'pending': 5, 'leased': 0, 'done': 0, 'failed': 0}
+
+    assert main(['work', queue_dir, '--processes', '1', '--client', 'scripted']) == 0
+    assert json.loads(capsys.readouterr().out) == {'pending': 0, 'leased': 0, 'done': 3, 'failed': 2}
+
+    assert main(['export', queue_dir, '-o', str(output_path)]) == 0
+    records = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [record['expression'] for record in records] == EXPRESSIONS
+
+
+def test_command_line_rejects_invalid_records(tmp_path, capsys):
+    queue_dir, input_path = str(tmp_path / 'queue'), tmp_path / 'input.jsonl'
+    input_path.write_text('{"expression": "1 + 2"}\n{"expression": 5}\n')
+
+    assert main(['enqueue', queue_dir, str(input_path)]) == 1
+    assert 'Line 2: ValueError: expression must be a string' in capsys.readouterr().err
+    assert main(['status', queue_dir]) == 0
+    assert json.loads(capsys.readouterr().out)['pending'] == 0
+
+
+def test_command_line_exports_input_ids(tmp_path, capsys):
+    queue_dir, input_path, output_path = str(tmp_path / 'queue'), tmp_path / 'input.jsonl', tmp_path / 'out.jsonl'
+    input_path.write_text('{"id": 1, "expression": "2 * 3"}\n{"id": 2, "expression": "1 + 1"}\n'
+                          '{"id": 3, "expression": "2 * 3"}\n')
+
+    assert main(['enqueue', queue_dir, str(input_path)]) == 0
+    assert main(['work', queue_dir, '--processes', '1', '--client', 'scripted']) == 0
+    assert main(['export', queue_dir, '-o', str(output_path)]) == 0
+    capsys.readouterr()
+
+    records = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [(record['ids'], record['result']) for record in records] == [([1, 3], 6), ([2], 2)]
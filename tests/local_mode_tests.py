@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import AGENTS, REDUCING_CONFIG, STEPWISE_CONFIG, ResponseListClient, load_config, make_response
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+
+
+def final_answer_client(a, b, op):
+    """Answers with a single, final calculate call."""
+    return ResponseListClient([make_response((a, b, op, True))])
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+def test_local_mode_skips_llm(agent_class, config_file):
+    client = final_answer_client(0, 0, '+')
+    agent = agent_class(client, load_config(config_file, evaluation_mode='local'))
+
+    assert agent.run('(10 + 5) * 3 - 20 / 4') == 40
+    assert client.prompts == []
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+def test_local_mode_falls_back_to_llm_on_parse_error(agent_class, config_file):
+    client = final_answer_client(2, 3, '+')
+    agent = agent_class(client, load_config(config_file, evaluation_mode='local'))
+
+    assert agent.run('2 + 3 )') == 5   # Passes validate_expression, but is not well formed
+    assert len(client.prompts) == 1
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+def test_cross_check_mode(agent_class, config_file):
+    agent = agent_class(final_answer_client(2, 3, '+'), load_config(config_file, evaluation_mode='cross_check'))
+    assert agent.run('2 + 3') == 5
+
+
+def test_cross_check_mode_mismatch():
+    # The reducing agent rejects such a step before it gets to the final result, so only the stepwise agent is tested
+    agent = StepwiseCalculatorAgent(final_answer_client(2, 3, '*'),
+                                    load_config(STEPWISE_CONFIG, evaluation_mode='cross_check'))
+    with pytest.raises(RuntimeError) as excinfo:
+        agent.run('2 + 3')
+    assert 'does not match local evaluation' in str(excinfo.value)
+
+
+def test_invalid_evaluation_mode():
+    with pytest.raises(ValueError):
+        ReducingCalculatorAgent(final_answer_client(0, 0, '+'), load_config(REDUCING_CONFIG, evaluation_mode='magic'))
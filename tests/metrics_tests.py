@@ -0,0 +1,108 @@
+import json
+from types import SimpleNamespace
+
+from conftest import ResponseListClient, load_config, make_response
+from src.agents.metrics import AgentMetrics, Histogram
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.llm.chatgpt import ChatGPTClient, MessageHistory
+
+
+def create_agent(metrics=None, **config_overrides):
+    client = ResponseListClient([make_response((2, 3, '*', False)), make_response((6, 4, '+', True))])
+    return ReducingCalculatorAgent(client, load_config(**config_overrides), metrics=metrics)
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1]
+    assert histogram.count == 4
+    assert histogram.percentile(50) == 1.0
+    assert histogram.max == 5.0
+
+
+def test_agent_records_metrics():
+    metrics = AgentMetrics()
+    agent = create_agent(metrics)
+
+    assert agent.run('2 * 3 + 4') == 10
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['llm_calls'] == 2
+    assert snapshot['histograms']['llm_call']['count'] == 2
+    assert snapshot['histograms']['prompt_build']['count'] == 2
+    assert snapshot['histograms']['calculate']['count'] == 2
+    assert snapshot['histograms']['reduce']['count'] >= 2
+
+    assert json.loads(metrics.to_json())['counters']['llm_calls'] == 2
+
+
+def test_prometheus_export():
+    metrics = AgentMetrics(buckets=(0.1, 1.0))
+    metrics.observe('llm_call', 0.5)
+    metrics.increment('llm_calls')
+
+    text = metrics.to_prometheus()
+
+    assert '# TYPE calculator_agent_llm_calls_total counter\ncalculator_agent_llm_calls_total 1\n' in text
+    assert 'calculator_agent_llm_call_seconds_bucket{le="0.1"} 0' in text
+    assert 'calculator_agent_llm_call_seconds_bucket{le="1.0"} 1' in text
+    assert 'calculator_agent_llm_call_seconds_bucket{le="+Inf"} 1' in text
+    assert 'calculator_agent_llm_call_seconds_count 1' in text
+
+
+def test_prometheus_gauges():
+    metrics = AgentMetrics()
+    metrics.set_gauge('in_flight', 3)
+
+    assert '# TYPE calculator_agent_in_flight gauge\ncalculator_agent_in_flight 3\n' in metrics.to_prometheus()
+    assert metrics.snapshot()['gauges'] == {'in_flight': 3}
+
+
+def test_listeners():
+    metrics = AgentMetrics()
+    events = []
+    metrics.listeners.append(lambda name, seconds: events.append(name))
+
+    with metrics.timer('calculate'):
+        pass
+
+    assert events == ['calculate']
+
+
+def test_verbose_off_prints_nothing(capsys):
+    agent = create_agent(verbose=False)
+    agent.run('2 * 3 + 4')
+    assert capsys.readouterr().out == ''
+
+    agent = create_agent(verbose=True)
+    agent.run('2 * 3 + 4')
+    assert 'Call 1' in capsys.readouterr().out
+
+
+def test_chatgpt_client_records_usage():
+    config = load_config(api_key='test-key', tool_call_required='required')
+
+    metrics = AgentMetrics()
+    client = ChatGPTClient(config, metrics)
+
+    usage = SimpleNamespace(prompt_tokens=120, completion_tokens=30)
+    completion = SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=make_response((1, 2, '+', True)))])
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: completion)))
+
+    client.run_prompt(MessageHistory())
+    client.run_prompt(MessageHistory())
+
+    assert metrics.counters == {'prompt_tokens': 240, 'completion_tokens': 60}
+
+
+def test_record_usage_cached_tokens():
+    metrics = AgentMetrics()
+    details = SimpleNamespace(cached_tokens=1024, audio_tokens=0)
+    metrics.record_usage(SimpleNamespace(prompt_tokens=1500, completion_tokens=20, prompt_tokens_details=details))
+    metrics.record_usage(SimpleNamespace(prompt_tokens=1500, completion_tokens=20, prompt_tokens_details=None))
+
+    assert metrics.counters['cached_prompt_tokens'] == 1024
+    assert metrics.counters['prompt_tokens'] == 3000
@@ -0,0 +1,94 @@
+import json
+from decimal import Decimal
+from fractions import Fraction
+
+import pytest
+
+from conftest import AGENTS, load_config
+from src.agents.run_state import AgentRunState
+from src.agents.utility import reduce_expression
+from src.llm.chatgpt import tool_result_content
+from src.llm.scripted import ScriptedCalculatorClient
+from src.tools.expression_plan import ExpressionPlan
+from src.tools.numeric import NumericBackend, decode_number, encode_number, format_number
+
+EXPRESSION = '10.3 + 5.44 * 3.1 - 8.776 / 2.2 * 3.44 + 1.23'
+
+
+def numeric_config(config_file, backend):
+    return load_config(config_file, numeric={'backend': backend, 'precision': 28})
+
+
+@pytest.mark.parametrize("x, expected", [
+    (14, '14'),
+    (14.0, '14'),
+    (0.1 + 0.2, '0.30000000000000004'),
+    (1e-7, '0.0000001'),
+    (Decimal('2.50'), '2.5'),
+    (Decimal('1E+2'), '100'),
+    (Decimal('-0.000001'), '-0.000001'),
+    (Fraction(7, 1), '7'),
+    (Fraction(3, 8), '0.375'),
+    (Fraction(-1, 3), '-0.3333333333333333333333333333'),
+])
+def test_format_number(x, expected):
+    assert format_number(x) == expected
+
+
+def test_backends():
+    assert NumericBackend('decimal').calculate(0.1, 0.2, '+') == Decimal('0.3')
+    assert NumericBackend('decimal', precision=5).calculate(1, 3, '/') == Decimal('0.33333')
+    assert NumericBackend('fraction').calculate(1, 3, '/') == Fraction(1, 3)
+    assert NumericBackend('fraction').parse('0.1') == Fraction(1, 10)
+    assert NumericBackend().calculate(0.1, 0.2, '+') == 0.1 + 0.2
+
+    with pytest.raises(ZeroDivisionError):
+        NumericBackend('decimal').calculate(1, 0, '/')
+    with pytest.raises(ValueError):
+        NumericBackend('double')
+
+
+def test_exact_numbers_round_trip_through_json():
+    data = {'results': [Decimal('0.1'), Fraction(1, 3), 2.5]}
+    assert json.loads(json.dumps(data, default=encode_number), object_hook=decode_number) == data
+
+    assert json.loads(tool_result_content(Decimal('14.671527272727272727'))) == {'result': 14.671527272727272727}
+
+
+def test_plan_renders_exact_results():
+    plan = ExpressionPlan.from_expression('10.3 + 5.44 * 3.1', numeric=NumericBackend('decimal'))
+    plan.execute()
+    assert plan.result == Decimal('27.164')
+    assert plan.render() == '27.164'
+
+
+def test_regex_reduction_keeps_full_precision():
+    # 6 significant digits would not find the operands, nor write the result back exactly
+    assert reduce_expression('10.123456789 + 2 * 3', 2, 3, '*', 6) == '10.123456789 + 6'
+    assert reduce_expression('1.0000001 * 3', 1.0000001, 3, '*', 3.0000003) == '3.0000003'
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+@pytest.mark.parametrize("backend, expected", [
+    ('decimal', Decimal('14.67152727272727272727272727')),
+    ('fraction', Fraction(403467, 27500)),
+])
+def test_exact_agent_run(agent_class, config_file, backend, expected):
+    agent = agent_class(ScriptedCalculatorClient(), numeric_config(config_file, backend))
+    assert agent.run(EXPRESSION) == expected
+    assert agent.run('1 / 3 * 3') == (1 if backend == 'fraction' else Decimal('0.9999999999999999999999999999'))
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+def test_exact_checkpoint_resume(agent_class, config_file, tmp_path):
+    path = str(tmp_path / 'state.json')
+    config = numeric_config(config_file, 'fraction')
+    config['max_llm_calls'] = 3
+
+    with pytest.raises(RuntimeError):
+        agent_class(ScriptedCalculatorClient(), config).run(EXPRESSION, checkpoint_path=path)
+    assert all(isinstance(result, Fraction) for _, result in AgentRunState.load(path).resolved_operations)
+
+    config['max_llm_calls'] = 10
+    assert agent_class(ScriptedCalculatorClient(), config).run(EXPRESSION, checkpoint_path=path) == \
+        Fraction(403467, 27500)
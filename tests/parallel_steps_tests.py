@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import REDUCING_CONFIG, STEPWISE_CONFIG, ResponseListClient, load_config, make_response
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+from src.llm.chatgpt import ChatGPTClient, MessageHistory
+
+
+responses = [
+    make_response((5, 3, '*', False), (8, 2, '/', False)),
+    make_response((10, 15, '+', False)),
+    make_response((25, 4, '-', True)),
+]
+
+
+@pytest.mark.parametrize("agent_class, config_file", [
+    (ReducingCalculatorAgent, REDUCING_CONFIG),
+    (StepwiseCalculatorAgent, STEPWISE_CONFIG),
+])
+def test_parallel_steps(agent_class, config_file):
+    config = load_config(config_file, parallel_steps=True)
+    client = ResponseListClient(responses)
+    agent = agent_class(client, config)
+
+    assert agent.run('10 + 5 * 3 - 8 / 2') == 21
+    assert len(client.prompts) == 3   # Instead of 4 single-step calls
+    assert client.prompts[0][0]['content'] == config['parallel_steps_system_prompt']
+
+
+def test_reducing_agent_applies_all_parallel_calls():
+    config = load_config(parallel_steps=True)
+    client = ResponseListClient(responses)
+    agent = ReducingCalculatorAgent(client, config)
+
+    agent.run('10 + 5 * 3 - 8 / 2')
+
+    second_prompt = ' '.join(client.prompts[1][-1]['content'].split())
+    assert ': 10 + 15 - 4.' in second_prompt
+
+
+class RecordingCompletions:
+    def __init__(self):
+        self.kwargs = None
+
+    def create(self, **kwargs):
+        self.kwargs = kwargs
+        return SimpleNamespace(choices=[SimpleNamespace(message=make_response((1, 2, '+', True)))])
+
+
+@pytest.mark.parametrize("parallel_steps", [True, False])
+def test_chatgpt_client_parallel_tool_calls(parallel_steps):
+    config = load_config(parallel_steps=parallel_steps, api_key='test-key', tool_call_required='required')
+
+    client = ChatGPTClient(config)
+    completions = RecordingCompletions()
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    client.run_prompt(MessageHistory())
+
+    assert (completions.kwargs['parallel_tool_calls'] is True) == parallel_steps
@@ -0,0 +1,163 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import AGENTS, load_config
+from src.agents.prompt_builder import StepwisePromptBuilder
+from src.agents.tool_call_result import StepRecord, ToolCallResult
+from src.llm.chatgpt import MessageHistory, PromptPrefix, estimate_tokens
+from src.llm.scripted import ScriptedCalculatorClient
+from src.tools.expression_plan import ExpressionPlan
+
+EXPRESSION = '1 + 2 + 3 + 4 + 5 + 6 + 7 + 8'
+STEPS = [(1, 2, 3), (3, 3, 6), (6, 4, 10), (10, 5, 15), (15, 6, 21), (21, 7, 28)]
+
+
+def make_builder(append_messages, token_budget=None, budget_strategy='sliding_window', plan=None,
+                 prompt_layout='standard'):
+    return StepwisePromptBuilder(EXPRESSION, 'You are a calculator agent.', 'Evaluate {EXPRESSION}.',
+                                 'Original: {EXPRESSION}\nSteps:\n{STEPS_SO_FAR}', 'Remaining: {EXPRESSION}',
+                                 append_messages, True, token_budget, budget_strategy, plan,
+                                 prompt_layout, 'Steps:\n{STEPS_SO_FAR}')
+
+
+def run_steps(builder, plan=None):
+    prompt_msg = builder.initial()
+    prompts = [prompt_msg]
+
+    for n, (a, b, result) in enumerate(STEPS):
+        if plan is not None:
+            plan.resolve(plan.match(a, b, '+').op_id, result)
+        arguments = json.dumps({'a': a, 'b': b, 'op': '+', 'is_final_step': False})
+        tool_call = SimpleNamespace(id=f'call_{n}', function=SimpleNamespace(name='calculate', arguments=arguments))
+        response = SimpleNamespace(role='assistant', content=None, tool_calls=[tool_call])
+
+        step_result = ToolCallResult([StepRecord(a, b, '+', result, f'call_{n}')], False, '')
+        prompt_msg = builder.next(prompt_msg, step_result, response)
+        prompts.append(prompt_msg)
+
+    return prompts
+
+
+def test_message_history_token_counts():
+    prompt_msg = MessageHistory()
+    prompt_msg.add_system_message('x' * 40)
+    prompt_msg.add_user_message('y' * 8)
+
+    assert prompt_msg.token_counts == [4 + 10, 4 + 2]
+    assert prompt_msg.total_tokens == 20
+
+    prompt_msg.remove_messages(0, 1)
+    assert prompt_msg.total_tokens == 6
+
+
+def test_fresh_prompt_without_budget_lists_all_steps():
+    prompts = run_steps(make_builder(append_messages=False))
+
+    content = prompts[-1].get_messages()[-1]['content']
+    assert content == f'Original: {EXPRESSION}\nSteps:\n' + '\n'.join(f'{a} + {b} = {r}' for a, b, r in STEPS)
+
+
+def test_fresh_prompt_sliding_window():
+    prompts = run_steps(make_builder(append_messages=False, token_budget=38, budget_strategy='sliding_window'))
+
+    assert all(p.total_tokens <= 38 for p in prompts[1:])
+    content = prompts[-1].get_messages()[-1]['content']
+    assert '(5 earlier steps omitted)' in content
+    assert content.endswith('21 + 7 = 28')
+
+
+@pytest.mark.parametrize("budget_strategy, header", [
+    ('sliding_window', 'earlier steps omitted'),
+    ('summarize', 'Their results were: 3, 6'),
+])
+def test_fresh_prompt_budget(budget_strategy, header):
+    prompts = run_steps(make_builder(append_messages=False, token_budget=42, budget_strategy=budget_strategy))
+
+    content = prompts[-1].get_messages()[-1]['content']
+    assert header in content
+    assert content.endswith('21 + 7 = 28')
+
+
+def test_append_mode_sliding_window_bounds_history():
+    unbounded = run_steps(make_builder(append_messages=True))
+    bounded = run_steps(make_builder(append_messages=True, token_budget=150))
+
+    assert unbounded[-1].total_tokens > 150
+    assert bounded[-1].total_tokens <= 150
+
+    messages = bounded[-1].get_messages()
+    assert messages[0]['role'] == 'system'
+    assert messages[1]['content'] == f'Evaluate {EXPRESSION}.'
+    # Tool results are never separated from the assistant message that requested them
+    for n, msg in enumerate(messages):
+        if isinstance(msg, dict) and msg['role'] == 'tool':
+            assert not isinstance(messages[n - 1], dict) or messages[n - 1]['role'] == 'tool'
+
+
+def test_append_mode_summarize():
+    prompts = run_steps(make_builder(append_messages=True, token_budget=150, budget_strategy='summarize'))
+
+    summary = prompts[-1].get_messages()[2]['content']
+    assert summary.startswith('(Earlier steps omitted. Their results were: 3')
+
+
+def test_reduced_form():
+    plan = ExpressionPlan.from_expression(EXPRESSION)
+    prompts = run_steps(make_builder(append_messages=True, token_budget=100, budget_strategy='reduced_form', plan=plan),
+                        plan)
+
+    assert prompts[-1].get_messages()[-1]['content'] == 'Remaining: 28 + 8'
+    assert len(prompts[-1].get_messages()) == 2
+
+
+def test_prefix_cache_layout_keeps_a_fixed_prefix():
+    prompts = run_steps(make_builder(append_messages=False, prompt_layout='prefix_cache'))
+
+    first = prompts[0].get_messages()
+    for prompt_msg in prompts[1:]:
+        messages = prompt_msg.get_messages()
+        assert len(messages) == 3
+        assert messages[0] is first[0] and messages[1] is first[1]   # The very same objects, serialized identically
+    assert prompts[-1].get_messages()[-1]['content'] == 'Steps:\n' + '\n'.join(f'{a} + {b} = {r}' for a, b, r in STEPS)
+
+
+def test_prefix_cache_layout_budget():
+    prompts = run_steps(make_builder(append_messages=False, token_budget=42, prompt_layout='prefix_cache'))
+
+    assert all(p.total_tokens <= 42 for p in prompts[1:])
+    assert prompts[-1].get_messages()[1]['content'] == f'Evaluate {EXPRESSION}.'
+    assert 'earlier steps omitted' in prompts[-1].get_messages()[-1]['content']
+
+
+def test_prefix_is_shared_across_runs():
+    prefix = PromptPrefix([{'role': 'system', 'content': 'You are a calculator agent.'}])
+    histories = [prefix.history(), prefix.history()]
+    histories[0].add_user_message('1 + 2')
+
+    assert histories[0].messages[0] is histories[1].messages[0]
+    assert len(histories[1].messages) == 1 and histories[1].total_tokens == prefix.token_counts[0]
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+def test_agent_prompts_share_the_system_message(agent_class, config_file):
+    config = load_config(config_file, prompt_layout='prefix_cache')
+
+    prompts = []
+
+    class RecordingClient(ScriptedCalculatorClient):
+        def run_prompt(self, msg_history):
+            prompts.append(list(msg_history.get_messages()))
+            return super().run_prompt(msg_history)
+
+    agent = agent_class(RecordingClient(), config)
+    assert agent.run('(2 + 3) * 4 - 10 / (1 + 4)') == 18
+    assert agent.run('6 + 4') == 10
+
+    assert all(messages[0] is agent.prompt_prefix.messages[0] for messages in prompts)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('abcde') == 2
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import AsyncScriptedClient, load_config
+from src.agents.metrics import AgentMetrics
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.llm.messages import MessageHistory
+from src.llm.rate_limit import (AsyncRateLimitedClient, RateLimitedClient, RateLimitScheduler, TokenBucket,
+                                estimate_call_tokens)
+from src.llm.routing import RoutingClient, create_llm_client
+from src.llm.scripted import ScriptedCalculatorClient
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def grant_order(scheduler, requests):
+    """Enqueue (tenant, priority, tokens) requests, then grant them one dispatch at a time."""
+    pending = [scheduler._enqueue(tokens, tenant, priority) for tenant, priority, tokens in requests]
+    order = []
+    while pending:
+        scheduler.clock.now += 1.0   # One request per second
+        with scheduler._lock:
+            scheduler._dispatch()
+        order.extend(r.tenant for r in pending if r.granted)
+        pending = [r for r in pending if not r.granted]
+    return order
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate_per_minute=60, capacity=2, now=0.0)
+    bucket.consume(2)
+    assert bucket.time_until(1) == pytest.approx(1.0)
+
+    bucket.refill(10.0)
+    assert bucket.level == 2   # Capped at the capacity
+    assert bucket.time_until(5) == 0   # Larger requests only wait for a full bucket
+
+
+def test_requests_per_minute_are_spread_out():
+    scheduler = RateLimitScheduler(requests_per_minute=6000, burst_seconds=0.01)   # 100 per second, no burst
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: scheduler.acquire(), range(11)))
+
+    assert time.perf_counter() - start >= 0.09
+    stats = scheduler.stats()
+    assert stats['granted'] == 11 and stats['queue_depth'] == 0
+    assert stats['waited'] >= 9 and stats['max_wait_seconds'] > 0
+
+
+def test_tokens_per_minute():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(tokens_per_minute=600, burst_seconds=10, clock=clock)   # 10 tokens per second
+
+    assert grant_order(scheduler, [('a', 'default', 100), ('b', 'default', 30), ('c', 'default', 30)]) == \
+        ['a', 'b', 'c']
+    assert clock.now == 7.0   # The full bucket went to 'a' at 1s, then 3 seconds of refill each for 'b' and 'c'
+
+
+def test_fair_queuing_across_tenants():
+    scheduler = RateLimitScheduler(requests_per_minute=60, burst_seconds=1, clock=FakeClock())
+    requests = [('batch-1', 'default', 0)] * 4 + [('batch-2', 'default', 0)] * 2
+
+    assert grant_order(scheduler, requests) == ['batch-1', 'batch-2', 'batch-1', 'batch-2', 'batch-1', 'batch-1']
+
+
+def test_priority_classes():
+    scheduler = RateLimitScheduler(requests_per_minute=60, burst_seconds=1, clock=FakeClock())
+    requests = [('batch', 'batch', 0)] * 2 + [('user', 'interactive', 0)] * 2
+
+    assert grant_order(scheduler, requests) == ['user', 'user', 'batch', 'batch']
+
+    with pytest.raises(ValueError):
+        scheduler.acquire(priority='urgent')
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = RateLimitScheduler(requests_per_minute=1, burst_seconds=60)
+
+    async def main():
+        await scheduler.aacquire()   # Takes the only request of the minute
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(scheduler.aacquire(), timeout=0.05)
+
+    asyncio.run(main())
+    assert scheduler.stats()['queue_depth'] == 0
+
+
+def test_rate_limited_agent():
+    config = load_config()
+    metrics = AgentMetrics()
+    scheduler = RateLimitScheduler(requests_per_minute=6000, tokens_per_minute=10 ** 6, metrics=metrics)
+
+    client = RateLimitedClient(ScriptedCalculatorClient(), scheduler)
+    agent = ReducingCalculatorAgent(client, config, metrics=metrics)
+    assert agent.run('(2 + 3) * 4 - 10 / (1 + 4)') == 18
+
+    async_client = AsyncRateLimitedClient(AsyncScriptedClient(), scheduler, tenant='async')
+    agent = ReducingCalculatorAgent(async_client, config, metrics=metrics)
+    assert asyncio.run(agent.arun('(2 + 3) * 4')) == 20
+
+    assert scheduler.stats()['granted'] == 7
+    assert metrics.histograms['rate_limit_wait'].count == 7
+    assert metrics.gauges['rate_limit_queue_depth'] == 0
+
+
+def test_estimate_call_tokens():
+    prompt_msg = MessageHistory()
+    prompt_msg.add_user_message('x' * 40)
+    assert estimate_call_tokens(prompt_msg, 100) == 4 + 10 + 100
+
+
+def test_create_llm_client_shares_schedulers():
+    config = load_config(api_key='test-key', tool_call_required='required')
+    config['rate_limit'] = {'requests_per_minute': 500, 'tokens_per_minute': 30000, 'tenant': 'nightly'}
+    config['routing'] = {'models': [{'model': 'gpt-4o-mini', 'cost': 1}, {'model': 'gpt-4o', 'cost': 16}]}
+
+    router = create_llm_client(config)
+    assert isinstance(router, RoutingClient)
+    mini, full = (route.client for route in router.routes)
+    assert isinstance(mini, RateLimitedClient) and mini.tenant == 'nightly'
+    assert mini.scheduler is not full.scheduler   # Limits are per model
+
+    assert create_llm_client(dict(config, routing={})).scheduler is full.scheduler
+    assert not isinstance(create_llm_client(dict(config, routing={}, rate_limit={})), RateLimitedClient)
@@ -0,0 +1,98 @@
+import pytest
+
+from conftest import AGENTS, REDUCING_CONFIG, STEPWISE_CONFIG, load_config
+from src.agents.metrics import AgentMetrics
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+from src.llm.chatgpt import MessageHistory
+from src.llm.replay import RecordReplayClient, ReplayMissError, hash_messages
+from src.llm.scripted import ScriptedCalculatorClient
+
+EXPRESSIONS = [
+    ("6 + 4", 10),
+    ("(2 + 3) * 4 - 10 / (1 + 4)", 18),
+    ("2 * (3 + 4) - 1.5 * 2 / (10 - 4)", 13.5),
+]
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+@pytest.mark.parametrize("parallel_steps", [False, True])
+@pytest.mark.parametrize("expression, expected_result", EXPRESSIONS)
+def test_scripted_client_solves_expressions(agent_class, config_file, parallel_steps, expression, expected_result):
+    client = ScriptedCalculatorClient(parallel_steps=parallel_steps)
+    agent = agent_class(client, load_config(config_file, parallel_steps=parallel_steps))
+
+    assert agent.run(expression) == pytest.approx(expected_result)
+
+
+def test_scripted_client_parallel_steps_use_fewer_calls():
+    expression = "(1 + 2) * (3 + 4) + (5 + 6) * (7 + 8)"
+    config_file = REDUCING_CONFIG
+
+    sequential = ScriptedCalculatorClient()
+    ReducingCalculatorAgent(sequential, load_config(config_file)).run(expression)
+    parallel = ScriptedCalculatorClient(parallel_steps=True)
+    ReducingCalculatorAgent(parallel, load_config(config_file, parallel_steps=True)).run(expression)
+
+    assert sequential.num_calls == 7
+    assert parallel.num_calls == 3   # One call per level of the expression
+
+
+def test_scripted_client_wrong_steps_are_rejected():
+    client = ScriptedCalculatorClient(error_rate=0.5, seed=1)
+    agent = StepwiseCalculatorAgent(client, load_config(STEPWISE_CONFIG, plan_steps=True,
+                                                         max_llm_calls=20))
+
+    assert agent.run("(2 + 3) * 4 - 10 / (1 + 4)") == pytest.approx(18)
+    assert client.num_calls > 5
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+def test_record_then_replay(tmp_path, agent_class, config_file):
+    path = str(tmp_path / 'responses.json')
+    expression = "(2 + 3) * 4 - 10 / (1 + 4)"
+
+    recorder = RecordReplayClient(path, mode='record', client=ScriptedCalculatorClient())
+    assert agent_class(recorder, load_config(config_file)).run(expression) == pytest.approx(18)
+    assert len(recorder) == 5
+
+    metrics = AgentMetrics()
+    replayer = RecordReplayClient(path, mode='replay')
+    assert agent_class(replayer, load_config(config_file), metrics=metrics).run(expression) == pytest.approx(18)
+    assert replayer.hits == 5
+    assert metrics.counters['llm_calls'] == 5
+
+
+def test_replay_miss(tmp_path):
+    replayer = RecordReplayClient(str(tmp_path / 'responses.json'), mode='replay')
+    agent = ReducingCalculatorAgent(replayer, load_config(REDUCING_CONFIG))
+
+    with pytest.raises(ReplayMissError):
+        agent.run("6 + 4")
+
+
+def test_auto_mode_only_records_missing_prompts(tmp_path):
+    path = str(tmp_path / 'responses.json')
+    scripted = ScriptedCalculatorClient()
+    client = RecordReplayClient(path, mode='auto', client=scripted)
+    agent = ReducingCalculatorAgent(client, load_config(REDUCING_CONFIG))
+
+    agent.run("(2 + 3) * 4")
+    agent.run("(2 + 3) * 4")
+
+    assert scripted.num_calls == 2
+    assert client.hits == 2
+
+
+def test_hash_messages_depends_on_content():
+    first, second = MessageHistory(), MessageHistory()
+    first.add_user_message('6 + 4')
+    second.add_user_message('6 + 5')
+
+    assert hash_messages(first) != hash_messages(second)
+    assert hash_messages(first) == hash_messages(first)
+
+
+def test_record_requires_client(tmp_path):
+    with pytest.raises(ValueError):
+        RecordReplayClient(str(tmp_path / 'responses.json'), mode='record')
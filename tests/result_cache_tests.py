@@ -0,0 +1,144 @@
+import time
+from decimal import Decimal
+
+import pytest
+
+from conftest import STEPWISE_CONFIG, ScriptClient, load_config
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.result_cache import (LRUResultCache, SQLiteResultCache, config_fingerprint, create_result_cache,
+                                     normalize_expression)
+from src.llm.scripted import ScriptedCalculatorClient
+from src.tools.numeric import NumericBackend
+
+
+def test_normalize_expression():
+    assert normalize_expression('2.50 +  03') == normalize_expression('2.5+3')
+    assert normalize_expression('(1 + 2) * 3') == '(1+2)*3'
+    assert normalize_expression('1 + 2') != normalize_expression('1 + 3')
+
+
+def test_normalize_expression_keeps_exact_literals_apart():
+    decimal = NumericBackend('decimal')
+    assert normalize_expression('0.10000000000000000001 + 0.2', decimal) != normalize_expression('0.1 + 0.2', decimal)
+    assert normalize_expression('2.50 +  03', decimal) == normalize_expression('2.5+3', decimal)
+
+
+def test_agent_result_cache_decimal_backend():
+    config = load_config(numeric={'backend': 'decimal', 'precision': 40},
+                         result_cache={'backend': 'memory', 'cache_steps': True})
+    agent = ReducingCalculatorAgent(ScriptedCalculatorClient(), config)
+
+    assert agent.run('10000000000000000000000.1 + 0') == Decimal('10000000000000000000000.1')
+    assert agent.run('10000000000000000000000.2 + 0') == Decimal('10000000000000000000000.2')
+    assert agent.run('0.1 + 0.2') == Decimal('0.3')
+    assert agent.run('0.10000000000000000001 + 0.2') == Decimal('0.30000000000000000001')
+    assert agent.result_cache.hits == 0
+
+
+def test_lru_eviction_and_counters():
+    cache = LRUResultCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1   # 'a' is now the most recently used entry
+    cache.set('c', 3)            # --> evicts 'b'
+
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'hit_rate': 2 / 3, 'evictions': 1, 'size': 2}
+
+
+def test_lru_ttl():
+    cache = LRUResultCache(max_size=10, ttl_seconds=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+
+def test_sqlite_cache(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+
+    cache = SQLiteResultCache(path, max_size=2)
+    cache.set('a', [[1, 2, '+', True, 'id']])
+    cache.set('b', 2.5)
+    cache.get('a')
+    cache.set('c', 3)   # --> evicts 'b', the least recently accessed entry
+    cache.close()
+
+    cache = SQLiteResultCache(path, max_size=2)   # Entries survive reopening
+    assert cache.get('a') == [[1, 2, '+', True, 'id']]
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_config_fingerprint():
+    config = load_config(STEPWISE_CONFIG)
+    fingerprint = config_fingerprint(config)
+
+    for key, value in [('steps_prompt', 'Done so far: {STEPS_SO_FAR}'), ('prompt_layout', 'prefix_cache'),
+                       ('prompt_token_budget', 100), ('speculation', 'local'), ('plan_steps', True),
+                       ('routing', {'models': [{'model': 'gpt-4o', 'cost': 16}]}),
+                       ('http', {**config['http'], 'base_url': 'http://localhost:8000/v1'})]:
+        assert config_fingerprint({**config, key: value}) != fingerprint, key
+
+    for key, value in [('verbose', True), ('max_workers', 2), ('api_key', 'test-key'),
+                       ('http', {**config['http'], 'max_retries': 0}), ('result_cache', {'backend': 'sqlite'})]:
+        assert config_fingerprint({**config, key: value}) == fingerprint, key
+
+
+def test_create_result_cache():
+    assert create_result_cache({}) is None
+    assert isinstance(create_result_cache({'result_cache': {'backend': 'memory'}}), LRUResultCache)
+    with pytest.raises(ValueError):
+        create_result_cache({'result_cache': {'backend': 'redis'}})
+
+
+class CountingClient(ScriptClient):
+    """ScriptClient counting the calls made."""
+    def __init__(self, script):
+        super().__init__(script)
+        self.num_calls = 0
+
+    def run_prompt(self, msg_history):
+        self.num_calls += 1
+        return super().run_prompt(msg_history)
+
+
+def create_agent(client, cache_steps):
+    config = load_config(result_cache={'backend': 'memory', 'cache_steps': cache_steps})
+    return ReducingCalculatorAgent(client, config)
+
+
+script = {
+    '2 * 3 + 4': (2, 3, '*', False),
+    '6 + 4': (6, 4, '+', True),
+    '1 + 2 * 3 + 4': (2, 3, '*', False),
+    '1 + 6 + 4': (1, 6, '+', False),
+    '7 + 4': (7, 4, '+', True),
+}
+
+
+def test_agent_result_cache():
+    client = CountingClient(script)
+    agent = create_agent(client, cache_steps=False)
+
+    assert agent.run('2 * 3 + 4') == 10
+    assert client.num_calls == 2
+
+    assert agent.run('2*3 +  4') == 10   # Same normalized expression
+    assert client.num_calls == 2
+    assert agent.result_cache.hits == 1
+
+
+def test_agent_step_cache():
+    client = CountingClient(script)
+    agent = create_agent(client, cache_steps=True)
+
+    assert agent.run('2 * 3 + 4') == 10
+    assert client.num_calls == 2
+
+    # None of the reduced forms of '1 + 2 * 3 + 4' have been seen before --> 3 new LLM calls
+    assert agent.run('1 + 2 * 3 + 4') == 11
+    assert client.num_calls == 5
+    assert agent.run('6 + 4') == 10   # Solved as a step of the first expression
+    assert client.num_calls == 5
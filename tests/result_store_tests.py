@@ -0,0 +1,130 @@
+import math
+import os
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+import src.agents.result_store as result_store
+from src.agents.result_store import ColumnarResultStore, status_code
+from src.cli import main
+
+
+def test_append_and_read_back(tmp_path):
+    with ColumnarResultStore(str(tmp_path)) as store:
+        store.append('2 * (3 + 4)', 14, llm_calls=2, latency=0.5)
+        store.append('1 / 0', None, ZeroDivisionError('Division by zero'), llm_calls=1, latency=0.25)
+        store.append('foo', None, ValueError('invalid'))
+        store.append('1 / 3', Fraction(1, 3), None, 1, 0.1)
+        assert len(store) == 4
+
+        assert store.get('2*(3+4)') == {'row': 0, 'expression': '2 * (3 + 4)', 'result': 14.0, 'status': 'ok',
+                                        'llm_calls': 2, 'latency_seconds': 0.5}
+        assert store.get('1 / 0')['status'] == 'arithmetic_error'
+        assert store.get('foo')['result'] is None
+        assert store.get('1 / 3')['result'] == 1 / 3
+        assert store.get('1 + 1') is None
+
+        assert math.isnan(store.column('result')[1])
+        assert list(store.column('status')) == [0, 2, 1, 0]
+
+
+def test_status_codes():
+    assert [status_code(e) for e in (None, ValueError(), ZeroDivisionError(), RuntimeError())] == [0, 1, 2, 3]
+
+
+def test_lookup_over_index_and_tail(tmp_path):
+    # Small flushes, so that lookups go both through the sorted index and the rows appended since
+    store = ColumnarResultStore(str(tmp_path), flush_rows=7, index_tail_fraction=0.3)
+    store.append_many((f'{i} + 1', i + 1, None, 1, 0.0) for i in range(100))
+    store.append('5 + 1', 6.5)   # The latest row of an expression wins
+    store.flush()
+    assert 0 < store.indexed_rows < len(store)
+
+    rows = store.lookup(['0 + 1', '99 + 1', '5 + 1', '42 +1', '100 + 1'])
+    assert list(rows) == [0, 99, 100, 42, -1]
+    assert store.record(int(rows[2]))['result'] == 6.5
+
+
+def test_hash_collisions(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store, 'expression_hash', lambda expression: 42)
+    store = ColumnarResultStore(str(tmp_path), flush_rows=2)
+    store.append_many([('1 + 1', 2), ('2 + 2', 4), ('3 + 3', 6)])
+
+    assert list(store.lookup(['2 + 2', '1 + 1', '3 + 3', '4 + 4'])) == [1, 0, 2, -1]
+
+
+def test_reopen_discards_uncommitted_rows(tmp_path):
+    with ColumnarResultStore(str(tmp_path)) as store:
+        store.append_many((f'{i} * 2', i * 2, None, 1, 0.1) for i in range(10))
+
+    # A flush interrupted before its commit: data in the column files, index covering rows that do not exist
+    with open(tmp_path / 'result', 'ab') as f:
+        f.write(np.zeros(3).tobytes())
+    with open(tmp_path / 'index_row', 'ab') as f:
+        f.write(np.arange(3, dtype=np.int64).tobytes())
+
+    store = ColumnarResultStore(str(tmp_path))
+    assert len(store) == 10
+    assert os.path.getsize(tmp_path / 'result') == 10 * 8
+    assert store.get('7 * 2')['result'] == 14
+
+    store.append('10 * 2', 20)
+    store.close()
+    assert ColumnarResultStore(str(tmp_path)).get('10 * 2')['row'] == 10
+
+
+def test_summary(tmp_path):
+    store = ColumnarResultStore(str(tmp_path))
+    assert store.summary()['rows'] == 0
+
+    store.append_many((f'{i} - 1', i - 1, None, i % 3, i / 100) for i in range(1, 101))
+    store.append('x', None, ValueError('invalid'))
+    summary = store.summary()
+
+    assert (summary['rows'], summary['ok'], summary['invalid'], summary['error']) == (101, 100, 1, 0)
+    assert summary['llm_calls'] == sum(i % 3 for i in range(1, 101))
+    assert summary['latency_max_seconds'] == 1.0
+    assert summary['latency_p50_seconds'] == pytest.approx(0.5)
+
+
+def test_cli_store(tmp_path):
+    input_path, store_dir = tmp_path / 'input.txt', str(tmp_path / 'store')
+    input_path.write_text('2 * (3 + 4)\nfoo\n10 / (5 - 5)\n(2 + 3) * 4 - 10 / (1 + 4)\n')
+
+    exit_code = main([str(input_path), '-o', str(tmp_path / 'out.jsonl'), '--client', 'scripted',
+                      '--store', store_dir])
+    assert exit_code == 1   # Some expressions failed
+
+    store = ColumnarResultStore(store_dir)
+    assert store.summary()['rows'] == 4
+    assert store.get('(2 + 3) * 4 - 10 / (1 + 4)')['result'] == 18
+    assert store.get('(2 + 3) * 4 - 10 / (1 + 4)')['llm_calls'] == 5
+    assert [store.get(e)['status'] for e in ('2 * (3 + 4)', 'foo', '10 / (5 - 5)')] == \
+        ['ok', 'invalid', 'arithmetic_error']
+
+
+def test_rows_that_are_not_strings(tmp_path):
+    store = ColumnarResultStore(str(tmp_path), flush_rows=3)
+    store.append('1 + 2', 3, llm_calls=1)
+    store.append(5, None, TypeError('expression must be a string'))
+    store.append('x', 'not a number', RuntimeError('bad answer'))
+    store.close()
+
+    store = ColumnarResultStore(str(tmp_path))
+    assert len(store) == 3
+    assert store.get('1 + 2')['result'] == 3
+    assert store.get('5')['status'] == 'invalid'
+    assert store.get('x')['result'] is None and store.get('x')['status'] == 'error'
+
+
+def test_cli_store_non_string_expression(tmp_path):
+    input_path, store_dir = tmp_path / 'input.jsonl', str(tmp_path / 'store')
+    input_path.write_text('{"expression": 5}\n{"expression": "1 + 2"}\n')
+
+    assert main([str(input_path), '-o', str(tmp_path / 'out.jsonl'), '--client', 'scripted',
+                 '--store', store_dir]) == 1
+
+    store = ColumnarResultStore(store_dir)
+    assert store.get('{"expression": 5}')['status'] == 'invalid'   # Stored as the input line
+    assert store.get('1 + 2')['result'] == 3
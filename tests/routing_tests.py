@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import pytest
+
+from conftest import AGENTS, REDUCING_CONFIG, STEPWISE_CONFIG, AsyncScriptedClient, load_config
+from src.agents.metrics import AgentMetrics
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+from src.llm.chatgpt import MessageHistory
+from src.llm.llm_base import LLMClientBase
+from src.llm.messages import AssistantMessage, FunctionCall, ToolCall
+from src.llm.prompt_steps import check_tool_calls
+from src.llm.routing import AsyncRoutingClient, ModelRoute, RoutingClient
+from src.llm.scripted import ScriptedCalculatorClient
+from src.tools.expression_plan import ExpressionPlan
+
+
+def tool_call(arguments):
+    return ToolCall('call_0', FunctionCall('calculate', arguments if isinstance(arguments, str)
+                                           else json.dumps(arguments)))
+
+
+class FailingClient(LLMClientBase):
+    def __init__(self):
+        self.num_calls = 0
+
+    def run_prompt(self, msg_history):
+        self.num_calls += 1
+        raise ConnectionError('unavailable')
+
+
+def test_check_tool_calls():
+    plan = ExpressionPlan.from_expression('(2 + 3) * (4 - 1)')
+    step = {'a': 2, 'b': 3, 'op': '+', 'is_final_step': False}
+
+    assert check_tool_calls([tool_call(step)], plan) is None
+    assert check_tool_calls([tool_call(step), tool_call({**step, 'a': 4, 'b': 1, 'op': '-'})], plan) is None
+    assert check_tool_calls(None, plan) == 'no tool call'
+    assert check_tool_calls([tool_call('{"a": 2')], plan).startswith('invalid arguments')
+    assert check_tool_calls([tool_call({'a': 2, 'b': 3})], plan).startswith('invalid arguments')
+    assert check_tool_calls([tool_call({**step, 'a': 5, 'b': 3, 'op': '*'})], plan).endswith('not a valid next step')
+    assert check_tool_calls([tool_call(step), tool_call(step)], plan).endswith('not a valid next step')
+    assert check_tool_calls([tool_call({**step, 'a': 7})]) is None   # Without a plan, only the arguments are checked
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+def test_invalid_steps_are_escalated(agent_class, config_file):
+    cheap = ScriptedCalculatorClient(error_rate=1.0, seed=0)
+    strong = ScriptedCalculatorClient()
+    metrics = AgentMetrics()
+    router = RoutingClient([ModelRoute('cheap', cheap, 1), ModelRoute('strong', strong, 10)], probe_interval=0,
+                           metrics=metrics)
+
+    agent = agent_class(router, load_config(config_file, max_llm_calls=20), metrics=metrics)
+    assert agent.run('(2 + 3) * 4 - 10 / (1 + 4)') == 18
+
+    # Every wrong step was caught before reaching the agent
+    assert router.stats['cheap'].invalid == cheap.num_calls
+    assert router.stats['strong'].valid == strong.num_calls == 5
+    assert metrics.counters['routing_escalations'] == cheap.num_calls
+
+
+def test_failing_model_stops_being_tried_first():
+    cheap = ScriptedCalculatorClient(error_rate=1.0, seed=0)
+    strong = ScriptedCalculatorClient()
+    router = RoutingClient([ModelRoute('cheap', cheap, 1), ModelRoute('strong', strong, 3)], stats_decay=0.5,
+                           probe_interval=10)
+    agent = ReducingCalculatorAgent(router, load_config(REDUCING_CONFIG, max_llm_calls=20))
+
+    for i in range(10):
+        assert agent.run(f'({i} + 1) * 2 - 3') == (i + 1) * 2 - 3
+
+    # 30 steps: once its success rate dropped (after 2 calls), the cheap model was only tried on the probe calls
+    assert cheap.num_calls == 2 + 3
+    assert strong.num_calls == 30
+
+
+def test_reliable_cheap_model_is_not_escalated():
+    cheap = ScriptedCalculatorClient()
+    strong = ScriptedCalculatorClient()
+    router = RoutingClient([ModelRoute('cheap', cheap, 1), ModelRoute('strong', strong, 10)])
+    agent = StepwiseCalculatorAgent(router, load_config(STEPWISE_CONFIG, max_llm_calls=20))
+
+    assert agent.run('2 * (3 + 4) - 1.5 * 2 / (10 - 4)') == 13.5
+    assert strong.num_calls == 0
+    assert router.stats['cheap'].success_rate == 1.0
+    assert router.stats['cheap'].latency is not None
+
+
+def test_errors_are_escalated():
+    failing = FailingClient()
+    strong = ScriptedCalculatorClient()
+    router = RoutingClient([ModelRoute('failing', failing, 1), ModelRoute('strong', strong, 10)])
+    agent = ReducingCalculatorAgent(router, load_config(REDUCING_CONFIG, max_llm_calls=20))
+
+    assert agent.run('6 + 4') == 10
+    assert router.stats['failing'].errors == 1
+
+    router = RoutingClient([ModelRoute('failing', failing, 1)])
+    with pytest.raises(ConnectionError):
+        router.run_prompt(MessageHistory([{'role': 'user', 'content': '6 + 4'}]))
+
+
+def test_last_response_is_returned_when_all_models_fail():
+    no_tools = AssistantMessage(content='I cannot help with that.')
+
+    class NoToolsClient(LLMClientBase):
+        def run_prompt(self, msg_history):
+            return no_tools
+
+    router = RoutingClient([ModelRoute('a', NoToolsClient(), 1), ModelRoute('b', NoToolsClient(), 2)],
+                           validate_steps=False)
+    assert router.run_prompt(MessageHistory()) is no_tools
+    assert router.stats['a'].invalid == router.stats['b'].invalid == 1
+
+
+def test_async_routing():
+    cheap = AsyncScriptedClient(error_rate=1.0, seed=0)
+    strong = AsyncScriptedClient()
+    router = AsyncRoutingClient([ModelRoute('cheap', cheap, 1), ModelRoute('strong', strong, 10)], probe_interval=0)
+    agent = ReducingCalculatorAgent(router, load_config(REDUCING_CONFIG, max_llm_calls=20))
+
+    assert asyncio.run(agent.arun('(2 + 3) * 4 - 10 / (1 + 4)')) == 18
+    assert router.stats['strong'].valid == 5
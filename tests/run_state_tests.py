@@ -0,0 +1,122 @@
+import json
+from fractions import Fraction
+
+import pytest
+
+from conftest import AGENTS, REDUCING_CONFIG, STEPWISE_CONFIG, load_config
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.run_state import AgentRunState
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+from src.agents.tool_call_result import StepRecord
+from src.llm.chatgpt import ChatGPTError
+from src.llm.llm_base import LLMClientBase
+from src.llm.scripted import ScriptedCalculatorClient
+from src.tools.numeric import decode_number, encode_number
+
+EXPRESSION = "(2 + 3) * 4 - 10 / (1 + 4)"   # 5 steps, result 18
+
+
+class FailingClient(LLMClientBase):
+    """Scripted client raising an API error on the given call."""
+    def __init__(self, fail_on_call):
+        self.client = ScriptedCalculatorClient()
+        self.fail_on_call = fail_on_call
+
+    def run_prompt(self, msg_history):
+        if self.client.num_calls + 1 == self.fail_on_call:
+            raise ChatGPTError('API error: 503 Service Unavailable')
+        return self.client.run_prompt(msg_history)
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+def test_resume_after_api_error(agent_class, config_file):
+    state = AgentRunState(agent_class.__name__, EXPRESSION)
+    failing = FailingClient(fail_on_call=4)
+
+    with pytest.raises(ChatGPTError):
+        agent_class(failing, load_config(config_file)).run(EXPRESSION, state=state)
+    assert len(state.steps) == 3
+    assert state.llm_calls == 3
+
+    client = ScriptedCalculatorClient()
+    assert agent_class(client, load_config(config_file)).run(EXPRESSION, state=state) == pytest.approx(18)
+    assert client.num_calls == 2   # Only the remaining steps
+    assert state.is_complete
+    assert state.llm_calls == 5
+
+
+@pytest.mark.parametrize("agent_class, config_file", AGENTS)
+@pytest.mark.parametrize("append_messages", [False, True])
+def test_resume_from_checkpoint(tmp_path, agent_class, config_file, append_messages):
+    path = str(tmp_path / 'checkpoint.json')
+    config = load_config(config_file, max_llm_calls=2, append_messages=append_messages)
+
+    with pytest.raises(RuntimeError, match='Max LLM calls'):
+        agent_class(ScriptedCalculatorClient(), config).run(EXPRESSION, checkpoint_path=path)
+
+    with open(path) as f:
+        checkpoint = json.load(f)
+    assert len(checkpoint['steps']) == 2
+    assert not checkpoint['is_complete']
+
+    client = ScriptedCalculatorClient()
+    agent = agent_class(client, load_config(config_file, append_messages=append_messages))
+    assert agent.run(EXPRESSION, checkpoint_path=path) == pytest.approx(18)
+    assert client.num_calls == 3
+
+    # A completed checkpoint returns the result without calling the LLM
+    assert agent.run(EXPRESSION, checkpoint_path=path) == pytest.approx(18)
+    assert client.num_calls == 3
+
+
+def test_stepwise_resume_keeps_prompt():
+    config = load_config(STEPWISE_CONFIG, append_messages=True)
+    state = AgentRunState('StepwiseCalculatorAgent', EXPRESSION)
+
+    with pytest.raises(ChatGPTError):
+        StepwiseCalculatorAgent(FailingClient(fail_on_call=3), config).run(EXPRESSION, state=state)
+
+    restored = AgentRunState.from_dict(json.loads(json.dumps(state.to_dict())))
+    assert restored.prompt_state['steps'] == [step.text() for step in state.steps]
+    assert restored.steps == state.steps
+    assert [msg['role'] for msg in restored.messages] == ['system', 'user', 'assistant', 'tool', 'user',
+                                                          'assistant', 'tool', 'user']
+
+
+def test_reducing_resume_restores_plan():
+    state = AgentRunState('ReducingCalculatorAgent', EXPRESSION)
+    with pytest.raises(ChatGPTError):
+        ReducingCalculatorAgent(FailingClient(fail_on_call=3),
+                                load_config(REDUCING_CONFIG)).run(EXPRESSION, state=state)
+
+    assert state.remaining_expression == '20 - 10 / (1 + 4)'
+    assert state.resolved_operations == [(0, 5), (1, 20)]
+    assert [(step.a, step.op, step.b, step.result) for step in state.steps] == [(2, '+', 3, 5), (5, '*', 4, 20)]
+    assert not hasattr(state.steps[0], '__dict__')   # Slotted step records
+
+
+def test_state_for_other_expression_is_rejected():
+    agent = ReducingCalculatorAgent(ScriptedCalculatorClient(), load_config(REDUCING_CONFIG))
+
+    with pytest.raises(ValueError):
+        agent.run('6 + 4', state=AgentRunState('ReducingCalculatorAgent', '6 + 5'))
+    with pytest.raises(ValueError):
+        agent.run('6 + 4', state=AgentRunState('StepwiseCalculatorAgent', '6 + 4'))
+
+
+def test_unsupported_state_version():
+    data = AgentRunState('ReducingCalculatorAgent', '6 + 4').to_dict()
+    data['version'] = 0
+
+    with pytest.raises(ValueError):
+        AgentRunState.from_dict(data)
+
+
+def test_step_records_round_trip_through_json():
+    state = AgentRunState('ReducingCalculatorAgent', '1 / 3 + 1',
+                          steps=[StepRecord(1, 3, '/', Fraction(1, 3), 'call_0')])
+    restored = AgentRunState.from_dict(json.loads(json.dumps(state.to_dict(), default=encode_number),
+                                                  object_hook=decode_number))
+
+    assert restored.steps == state.steps
+    assert restored.steps[0].text(precision=5) == '1 / 3 = 0.33333'
@@ -0,0 +1,222 @@
+import asyncio
+import json
+
+import pytest
+
+from conftest import AsyncScriptedClient, load_config
+from src.agents.concurrency import SingleFlight
+from src.agents.metrics import AgentMetrics
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+from src.service import AgentEndpoint, CalculatorService, HTTPServer, OverloadedError
+from src.service import create_service as create_configured_service
+
+
+def create_service(delay=0.0, max_concurrency=100, max_queue_depth=1000):
+    metrics = AgentMetrics()
+    endpoints = {}
+    for name, agent_class in [('reducing', ReducingCalculatorAgent), ('stepwise', StepwiseCalculatorAgent)]:
+        config = load_config(f'config/{name}_agent_config.yaml')
+        agent = agent_class(AsyncScriptedClient(delay), config, metrics=metrics)
+        endpoints[name] = AgentEndpoint(agent, max_concurrency, max_queue_depth)
+    return CalculatorService(endpoints, metrics)
+
+
+async def request(port, method, path, payload=None, raw_body=None, content_length=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = raw_body if raw_body is not None else (json.dumps(payload).encode() if payload is not None else b'')
+    content_length = len(body) if content_length is None else content_length
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {content_length}\r\n'
+                 f'Connection: close\r\n\r\n'.encode() + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode().partition(':')
+        headers[name.strip().lower()] = value.strip()
+    data = await reader.readexactly(int(headers['content-length']))
+    writer.close()
+
+    if headers['content-type'] == 'application/json':
+        return status, headers, json.loads(data)
+    return status, headers, data.decode()
+
+
+def with_server(service, test):
+    async def main():
+        server = HTTPServer(service)
+        await server.start('127.0.0.1', 0)
+        try:
+            return await test(server.port)
+        finally:
+            server.server.close()
+            await server.server.wait_closed()
+    return asyncio.run(main())
+
+
+def test_evaluate():
+    async def test(port):
+        status, _, body = await request(port, 'POST', '/evaluate', {'expression': '2 * (3 + 4)'})
+        assert status == 200
+        assert body == {'expression': '2 * (3 + 4)', 'result': 14, 'coalesced': False}
+
+        status, _, body = await request(port, 'POST', '/evaluate', {'expression': '6 + 4', 'agent': 'stepwise'})
+        assert body['result'] == 10
+
+    with_server(create_service(), test)
+
+
+def test_identical_requests_are_coalesced():
+    service = create_service(delay=0.02)
+
+    async def test(port):
+        responses = await asyncio.gather(*(request(port, 'POST', '/evaluate', {'expression': '(2 + 3) * 4'})
+                                           for _ in range(10)))
+        assert [body['result'] for _, _, body in responses] == [20] * 10
+        assert sum(body['coalesced'] for _, _, body in responses) == 9
+
+    with_server(service, test)
+
+    assert service.endpoints['reducing'].agent.llm_client.client.num_calls == 2   # A single run of 2 steps
+    assert service.metrics.counters['coalesced'] == 9
+
+
+def test_admission_control_rejects_over_queue_depth():
+    service = create_service(delay=0.05, max_concurrency=1, max_queue_depth=1)
+
+    async def test(port):
+        responses = await asyncio.gather(*(request(port, 'POST', '/evaluate', {'expression': f'{i} + 1'})
+                                           for i in range(3)))
+        statuses = sorted(status for status, _, _ in responses)
+        assert statuses == [200, 200, 503]
+        assert [headers.get('retry-after') for status, headers, _ in responses if status == 503] == ['1']
+
+    with_server(service, test)
+    assert service.metrics.counters['rejected'] == 1
+    assert service.endpoints['reducing'].pending == 0
+
+
+def test_batch():
+    async def test(port):
+        status, _, body = await request(port, 'POST', '/evaluate/batch',
+                                        {'expressions': ['1 + 2', 'foo', '1 + 2', '10 / (5 - 5)']})
+        assert status == 200
+        results = body['results']
+        assert [r['result'] for r in results] == [3, None, 3, None]
+        assert results[1]['error'].startswith('ValueError')
+        assert results[3]['error'].startswith('ZeroDivisionError')
+
+    with_server(create_service(), test)
+
+
+def test_batch_is_rejected_as_a_whole():
+    async def test(port):
+        status, _, _ = await request(port, 'POST', '/evaluate/batch', {'expressions': ['1 + 2', '2 + 3', '3 + 4']})
+        assert status == 503
+
+    with_server(create_service(max_concurrency=1, max_queue_depth=1), test)
+
+
+def test_batch_admission_is_reserved_before_its_items_start():
+    async def main():
+        service = create_service(delay=0.05, max_concurrency=1, max_queue_depth=2)
+        batch = asyncio.ensure_future(service.evaluate_batch(['1 + 1', '2 + 2', '3 + 3']))
+        await asyncio.sleep(0)   # The batch is admitted, its items are not started yet
+
+        with pytest.raises(OverloadedError):
+            await service.evaluate('4 + 4')
+        results = await batch
+        assert [r['result'] for r in results] == [2, 4, 6]
+        assert service.endpoints['reducing'].pending == 0
+
+    asyncio.run(main())
+
+
+def test_batch_releases_reservations_of_runs_started_meanwhile():
+    async def main():
+        service = create_service(delay=0.05)
+        batch = asyncio.ensure_future(service.evaluate_batch(['1 + 1', '2 + 2', '1 + 1']))
+        single = asyncio.ensure_future(service.evaluate('1 + 1'))   # Starts the run the batch reserved
+        await asyncio.sleep(0)   # Both are admitted, the items of the batch are not started yet
+        assert service.endpoints['reducing'].pending == 3
+
+        results, single_result = await asyncio.gather(batch, single)
+        assert [r['coalesced'] for r in results] == [True, False, True]
+        assert single_result['result'] == 2
+        assert service.endpoints['reducing'].pending == 0
+
+    asyncio.run(main())
+
+
+def test_metrics_endpoint():
+    async def test(port):
+        await request(port, 'POST', '/evaluate', {'expression': '1 + 2'})
+
+        status, headers, text = await request(port, 'GET', '/metrics')
+        assert status == 200
+        assert headers['content-type'].startswith('text/plain')
+        assert 'calculator_agent_llm_calls_total 1' in text
+        assert 'calculator_agent_http_request_seconds_count' in text
+
+        status, _, snapshot = await request(port, 'GET', '/metrics?format=json')
+        assert snapshot['counters']['http_requests'] >= 2
+
+    with_server(create_service(), test)
+
+
+def test_errors():
+    async def test(port):
+        assert (await request(port, 'GET', '/nowhere'))[0] == 404
+        assert (await request(port, 'GET', '/evaluate'))[0] == 405
+        assert (await request(port, 'POST', '/evaluate', raw_body=b'{not json'))[0] == 400
+        assert (await request(port, 'POST', '/evaluate', {'expression': 'foo'}))[0] == 422
+        assert (await request(port, 'POST', '/evaluate', {'expression': '1 + 1', 'agent': 'other'}))[0] == 422
+        assert (await request(port, 'GET', '/health'))[2] == {'status': 'ok'}
+        for content_length in ('abc', '-1'):
+            status, _, body = await request(port, 'POST', '/evaluate', {'expression': '1 + 1'},
+                                            content_length=content_length)
+            assert status == 400 and body['error'].startswith('Invalid Content-Length')
+
+    with_server(create_service(), test)
+
+
+def test_local_mode_without_api_key(monkeypatch):
+    monkeypatch.setattr('src.cli.load_config', lambda name: load_config(f'config/{name}_agent_config.yaml',
+                                                                         api_key=None, evaluation_mode='local'))
+    service = create_configured_service(['reducing'])
+
+    async def main():
+        assert (await service.evaluate('2 * (3 + 4)'))['result'] == 14
+        with pytest.raises(RuntimeError, match='LLM is unavailable'):
+            await service.evaluate('2 + * 3')   # Cannot be parsed locally: falls back to the LLM
+
+    asyncio.run(main())
+
+
+def test_close_closes_the_llm_clients():
+    service = create_service()
+    asyncio.run(service.aclose())
+    assert all(endpoint.agent.llm_client.closed for endpoint in service.endpoints.values())
+
+
+def test_single_flight_shares_errors():
+    calls = []
+
+    async def fail():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        raise RuntimeError('failed')
+
+    async def main():
+        single_flight = SingleFlight()
+        results = await asyncio.gather(single_flight.do('key', fail), single_flight.do('key', fail),
+                                       return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert len(single_flight) == 0
+
+    asyncio.run(main())
+    assert len(calls) == 1
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+
+import pytest
+
+from conftest import AsyncScriptedClient, load_config
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.speculation import speculate
+from src.llm.llm_base import LLMClientBase
+from src.llm.messages import AssistantMessage
+from src.llm.scripted import ScriptedCalculatorClient
+from src.tools.expression_plan import ExpressionPlan
+from src.tools.numeric import NumericBackend
+
+EXPRESSION = '10.3 + 5.44 * 3.1 - 8.776 / 2.2 * 3.44 + 1.23'
+RESULT = 10.3 + 5.44 * 3.1 - 8.776 / 2.2 * 3.44 + 1.23
+
+
+def speculation_config(speculation, **overrides):
+    return load_config(**{'max_llm_calls': 20, 'speculation': speculation, **overrides})
+
+
+class SilentClient(LLMClientBase):
+    """Answers without any tool call."""
+    def run_prompt(self, msg_history):
+        return AssistantMessage(content='Sorry, I cannot help with that.')
+
+
+def test_render_after_leaves_the_plan_unchanged():
+    plan = ExpressionPlan.from_expression('2 * 3 + 4 * 5')
+    before = plan.render()
+
+    assert plan.render_after([(0, 6), (1, 20)]) == '6 + 20'
+    assert plan.render() == before
+    assert [o.op_id for o in plan.ready()] == [0, 1]
+    assert plan.operations[2].operands == [None, None]
+
+
+@pytest.mark.parametrize("parallel_steps, num_calls", [(False, 1), (True, 2)])
+def test_speculate(parallel_steps, num_calls):
+    plan = ExpressionPlan.from_expression('2 * 3 + 4 * 5')
+    speculation = speculate(plan, NumericBackend(), parallel_steps)
+
+    assert len(speculation.calls) == num_calls
+    assert speculation.calls[0][:4] == (2, 3, '*', False)
+    assert speculation.next_expression == ('6 + 20' if parallel_steps else '6 + 4 * 5')
+
+    assert speculate(ExpressionPlan.from_expression('1 / 0'), NumericBackend(), False) is None
+
+
+@pytest.mark.parametrize("parallel_steps", [False, True])
+def test_speculation_hits(parallel_steps):
+    client = ScriptedCalculatorClient(parallel_steps=parallel_steps)
+    agent = ReducingCalculatorAgent(client, speculation_config('local', parallel_steps=parallel_steps))
+
+    assert agent.run(EXPRESSION) == pytest.approx(RESULT)
+    assert agent.metrics.counters['speculation_hits'] == client.num_calls
+    assert 'speculation_misses' not in agent.metrics.counters
+
+
+def test_local_mode_replaces_invalid_steps():
+    agent = ReducingCalculatorAgent(ScriptedCalculatorClient(error_rate=1.0), speculation_config('local'))
+
+    assert agent.run(EXPRESSION) == pytest.approx(RESULT)
+    assert agent.metrics.counters['speculation_misses'] == agent.metrics.counters['speculation_local_steps'] == 6
+
+    agent = ReducingCalculatorAgent(SilentClient(), speculation_config('local'))
+    assert agent.run('2 * 3 + 4') == 10
+
+
+def test_reprompt_mode_asks_again():
+    client = ScriptedCalculatorClient(error_rate=0.5, seed=1)
+    agent = ReducingCalculatorAgent(client, speculation_config('reprompt'))
+
+    assert agent.run(EXPRESSION) == pytest.approx(RESULT)
+    assert agent.metrics.counters['speculation_misses'] > 0
+    assert client.num_calls == 6 + agent.metrics.counters['speculation_misses']
+
+    agent = ReducingCalculatorAgent(SilentClient(), speculation_config('reprompt', max_llm_calls=3))
+    with pytest.raises(RuntimeError, match='Max LLM calls'):
+        agent.run('2 * 3 + 4')
+
+
+def test_run_speculates_in_a_worker_thread():
+    client = ScriptedCalculatorClient(latency=0.01)
+    with ReducingCalculatorAgent(client, speculation_config('local')) as agent:
+        threads = []
+        speculate = agent._speculate
+
+        def recording_speculate(plan):
+            threads.append(threading.current_thread())
+            return speculate(plan)
+
+        agent._speculate = recording_speculate
+        assert agent.run(EXPRESSION) == pytest.approx(RESULT)
+
+    assert len(threads) == client.num_calls
+    assert threading.main_thread() not in threads   # Overlapping the blocking call, not before it
+    assert agent.metrics.counters['speculation_hits'] == client.num_calls
+
+
+@pytest.mark.parametrize("speculation", ['none', 'local'])
+def test_run_does_not_swallow_stop_iteration(speculation):
+    class ExhaustedClient(LLMClientBase):
+        def run_prompt(self, msg_history):
+            return next(iter([]))
+
+    with ReducingCalculatorAgent(ExhaustedClient(), speculation_config(speculation)) as agent:
+        with pytest.raises(StopIteration):
+            agent.run('1 + 2')
+
+
+def test_arun_speculates_while_waiting():
+    client = AsyncScriptedClient(delay=0.001, error_rate=0.5, seed=1)
+    agent = ReducingCalculatorAgent(client, speculation_config('local'))
+
+    assert asyncio.run(agent.arun(EXPRESSION)) == pytest.approx(RESULT)
+    counters = agent.metrics.counters
+    assert counters['speculation_hits'] + counters['speculation_misses'] == counters['llm_calls'] == 6
+
+
+def test_unsupported_mode():
+    with pytest.raises(ValueError):
+        ReducingCalculatorAgent(ScriptedCalculatorClient(), speculation_config('always'))
@@ -0,0 +1,106 @@
+import pytest
+
+from conftest import REDUCING_CONFIG, STEPWISE_CONFIG, load_config
+from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.stepwise_agent import StepwiseCalculatorAgent
+from src.llm.scripted import ScriptedCalculatorClient
+from src.tools.expression_parser import parse_expression
+from src.tools.numeric import NumericBackend
+from src.tools.subexpressions import SharedSubexpressions, count_operations, render_node, tree_depth
+
+EXPRESSIONS = [
+    '8.776 / 2.2 + 1',
+    '3 * (2.2 / 2.2 + 8.776 / 2.2)',
+    '8.776 / 2.2',
+    '(3 - 5) * 2',
+    '10 - (3 - 5) * 4',
+    '2 * (5 - 3)',
+    'foo',
+    '1 / (2 - 2)',
+    '4 - 2 - 2 + 7 / (2 - 2)',
+]
+
+
+def make_agent(agent_class, config_file, **overrides):
+    return agent_class(ScriptedCalculatorClient(), load_config(config_file, **{'batch_dedup': True, **overrides}))
+
+
+def test_render_node_round_trips():
+    for expression in ['10 - (2 - 3)', '(1 + 2) * 3 - 4 / (5 * 6)', '-5 * 2', '2 * (-5)', '8 / 4 / 2']:
+        tree = parse_expression(expression)
+        assert parse_expression(render_node(tree, NumericBackend().format)) == tree
+
+    assert tree_depth(parse_expression('1 + 2 * 3 + 4')) == 3
+    assert count_operations(parse_expression('(1 + 2) * (3 + 4)')) == 3
+
+
+def test_shared_subexpressions_are_normalized_and_maximal():
+    expressions = ['(1 + 2.50) * 4 + 7', '4 * (2.5 + 1) - 7', '(1 + 2.5) / 3', '2.5 - 1']
+    shared = SharedSubexpressions([parse_expression(e) for e in expressions], NumericBackend().format)
+
+    # '4 * (2.5 + 1)' contains '2.5 + 1', which is only selected on its own in '(1 + 2.5) / 3'
+    assert shared.texts() == ['(1 + 2.5) * 4', '1 + 2.5']
+    assert [len(selected) for selected in shared.occurrences] == [1, 1, 1, 0]
+
+    values = {key: 14 if '*' in key else 3.5 for key in shared.subexpressions}
+    assert render_node(shared.rewrite(0, values)[0], str) == '14 + 7'
+    assert render_node(shared.rewrite(2, values)[0], str) == '3.5 / 3'
+    assert shared.rewrite(3, values) == (shared.trees[3], 0)
+
+
+@pytest.mark.parametrize('parallel_steps', [False, True])
+def test_run_many_dedup(parallel_steps):
+    config_file = REDUCING_CONFIG
+    agent = make_agent(ReducingCalculatorAgent, config_file, parallel_steps=parallel_steps)
+    baseline = make_agent(ReducingCalculatorAgent, config_file, parallel_steps=parallel_steps, batch_dedup=False)
+
+    report = agent.run_many(EXPRESSIONS)
+    expected = baseline.run_many(EXPRESSIONS)
+
+    assert [item.expression for item in report.items] == EXPRESSIONS
+    assert report.results == expected.results
+    assert [type(item.error) for item in report.items] == [type(item.error) for item in expected.items]
+    assert expected.dedup is None
+
+    # Shared: '8.776 / 2.2' (3 times), '3 - 5' and '2 - 2' (twice each); '2 * (5 - 3)' is not '(3 - 5) * 2'
+    dedup = report.dedup
+    assert (dedup.num_subexpressions, dedup.num_substitutions) == (3, 7)
+    assert (dedup.operations_before, dedup.operations_after) == (21, 17)
+    assert dedup.llm_calls_saved == agent.metrics.counters['dedup_llm_calls_saved'] == (2 if parallel_steps else 4)
+    if not parallel_steps:   # One call per operation: the estimate is exact
+        assert agent.metrics.counters['llm_calls'] == baseline.metrics.counters['llm_calls'] - dedup.llm_calls_saved
+    assert agent.metrics.counters['llm_calls'] < baseline.metrics.counters['llm_calls']
+    assert 'LLM calls saved' in report.summary()
+
+
+def test_run_many_dedup_duplicates():
+    agent = make_agent(StepwiseCalculatorAgent, STEPWISE_CONFIG)
+
+    report = agent.run_many(['(2 + 3) * 4', '4 * (3 + 2)', '(2 + 3) * 4', '1 + 1'])
+
+    assert report.results == [20, 20, 20, 2]
+    assert report.dedup.num_subexpressions == 1
+    assert agent.metrics.counters['llm_calls'] == 3   # 2 for the shared expression, 1 for '1 + 1'
+
+
+def test_run_many_dedup_bare_numbers():
+    agent = make_agent(ReducingCalculatorAgent, REDUCING_CONFIG)
+    baseline = make_agent(ReducingCalculatorAgent, REDUCING_CONFIG, batch_dedup=False)
+    expressions = ['5', '(5)', '-5', '1 + 2', '(1 + 2) * 3']
+
+    report = agent.run_many(expressions)
+    expected = baseline.run_many(expressions)
+
+    assert report.results == expected.results
+    assert [type(item.error) for item in report.items] == [type(item.error) for item in expected.items]
+    assert report.results[3:] == [3, 9]
+
+
+def test_run_many_dedup_respects_max_expression_length():
+    agent = make_agent(ReducingCalculatorAgent, REDUCING_CONFIG, max_expression_length=16)
+
+    # '1 / 3' becomes 0.3333333333333333, which does not fit: the expressions are run as given
+    report = agent.run_many(['1 / 3 + 1', '1 / 3 + 2'])
+
+    assert report.results == [1 / 3 + 1, 1 / 3 + 2]
+    assert report.dedup.num_substitutions == 0